@@ -0,0 +1,278 @@
+"""
+Offline batch scoring: run recommend_hybrid for many buyers from a JSONL file.
+
+Each input line is either a JSON object with the same fields as one API
+request (buyer_id / buyer_profile_id, preferences_text, preferred_areas,
+limit, loved_property_ids, search_center, radius_miles, search_polygon,
+...) or a bare JSON string, taken as preferences_text. Results stream to
+JSONL as they complete, one line per input line:
+
+    {"line": 3, "buyer_id": "uuid", "success": true, "count": 30, "recommendations": [...], "llm_usage": {...}}
+    {"line": 4, "buyer_id": null, "success": false, "error": "...", "type": "ValueError"}
+
+Usage:
+    python api/batch_score.py buyers.jsonl -o results.jsonl --workers 8
+    python api/batch_score.py prefs.jsonl --module recommend_lightweight --limit 20 > out.jsonl
+    python api/batch_score.py buyers.jsonl -o /dev/null --save            # backfill buyer_properties
+    python api/batch_score.py prefs.jsonl --synthetic 5000 --workers 4    # offline, benchmark stand-ins
+
+Buyers are scored on a process pool. Each worker imports the engine once
+and reuses its clients and in-process caches (geocodes, POIs, embeddings)
+for every chunk it gets; a chunk of --chunk-size buyers goes through
+recommend_hybrid_batch, so listings the chunk shares are enriched once.
+CASSETTE_MODE=replay works as for the handlers (see cassette.py).
+
+Progress, throughput (buyers/sec) and failure counts go to stderr, with a
+JSON summary at the end; the exit status is 1 if any buyer failed.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+
+BATCH_SCORE_WORKERS = int(os.environ.get("BATCH_SCORE_WORKERS", str(os.cpu_count() or 2)))
+BATCH_SCORE_CHUNK_SIZE = int(os.environ.get("BATCH_SCORE_CHUNK_SIZE", "8"))
+PROGRESS_SECONDS = 10
+
+# One engine per worker process, imported by _init_worker
+_engine = None
+_save = False
+
+
+def read_requests(path: str) -> Iterator[Tuple[int, Any]]:
+    """(line number, request body dict or the ValueError it failed to parse with); blank lines skipped"""
+    with (sys.stdin if path == "-" else open(path)) as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                body = json.loads(line)
+            except ValueError as e:
+                yield line_no, ValueError(f"Invalid JSON: {e}")
+                continue
+            if isinstance(body, str):
+                body = {"preferences_text": body}
+            if not isinstance(body, dict):
+                yield line_no, ValueError("Each line must be a JSON object or string")
+                continue
+            yield line_no, body
+
+
+def _chunks(items: Iterator[Tuple[int, Any]], size: int) -> Iterator[List[Tuple[int, Any]]]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _error_line(line_no: int, buyer_id: Optional[str], error: Exception) -> Dict[str, Any]:
+    return {"line": line_no, "buyer_id": buyer_id, "success": False, "error": str(error),
+            "type": type(error).__name__}
+
+
+def _dumps(record: Dict[str, Any]) -> str:
+    if hasattr(_engine, "dumps_json"):
+        return _engine.dumps_json(record).decode("utf-8")
+    return json.dumps(record, default=float)
+
+
+def _init_worker(module_name: str, synthetic: int, latency_scale: float, save: bool):
+    """Import the engine once per process; its module-level clients serve every chunk"""
+    global _engine, _save
+    # Module logging goes to stderr so stdout can carry results
+    sys.stdout = sys.stderr
+    sys.path.insert(0, API_DIR)
+    if synthetic:
+        os.environ.setdefault("OPENAI_API_KEY", "batch-score")
+        os.environ.setdefault("GOOGLE_PLACES_API_KEY", "batch-score")
+    _engine = importlib.import_module(module_name)
+    _save = save
+    if synthetic:
+        import benchmark
+        stub = benchmark.ServiceStub(benchmark.DEFAULT_LATENCY, {}, latency_scale=latency_scale)
+        benchmark.install(_engine, benchmark.synthetic_catalog(synthetic), stub, benchmark.StageTimer())
+
+
+def score_chunk(chunk: List[Tuple[int, Any]], default_limit: int) -> List[Tuple[Optional[str], str]]:
+    """Score one chunk in this worker; [(error type or None, output JSON line)] in input order"""
+    from llm_prompt import TokenUsage
+
+    records: Dict[int, Dict[str, Any]] = {}
+    pending: List[Tuple[int, Optional[str], Dict[str, Any]]] = []
+    for line_no, body in chunk:
+        if isinstance(body, Exception):
+            records[line_no] = _error_line(line_no, None, body)
+            continue
+        try:
+            buyer_id, request_inputs = _engine.buyer_request_inputs({"limit": default_limit, **body})
+        except Exception as e:
+            records[line_no] = _error_line(line_no, body.get("buyer_id") or body.get("buyer_profile_id"), e)
+            continue
+        pending.append((line_no, buyer_id, request_inputs))
+
+    usages = [TokenUsage() for _ in pending]
+    outcomes = _engine.recommend_hybrid_batch([inputs for _, _, inputs in pending], usages=usages) if pending else []
+    for (line_no, buyer_id, _), outcome, usage in zip(pending, outcomes, usages):
+        if not isinstance(outcome, Exception) and _save and buyer_id:
+            try:
+                _engine.save_recommendations_to_db(buyer_id, outcome)
+            except Exception as e:
+                outcome = e
+        if isinstance(outcome, Exception):
+            records[line_no] = _error_line(line_no, buyer_id, outcome)
+        else:
+            records[line_no] = {"line": line_no, "buyer_id": buyer_id, "success": True, "count": len(outcome),
+                                "recommendations": outcome, "llm_usage": usage.as_dict(len(outcome))}
+
+    return [(None if record["success"] else record["type"], _dumps(record))
+            for _, record in sorted(records.items())]
+
+
+class Progress:
+    """Throughput and failure counts, reported to stderr every PROGRESS_SECONDS"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.last_report = self.start
+        self.done = 0
+        self.failures: Counter = Counter()
+
+    def add(self, error_type: Optional[str]):
+        self.done += 1
+        if error_type:
+            self.failures[error_type] += 1
+
+    @property
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self.start
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def maybe_report(self):
+        now = time.perf_counter()
+        if now - self.last_report >= PROGRESS_SECONDS:
+            self.last_report = now
+            print(f"[Batch Score] {self.done} buyers, {self.rate:.2f} buyers/sec, "
+                  f"{sum(self.failures.values())} failed", file=sys.stderr, flush=True)
+
+    def summary(self, workers: int) -> Dict[str, Any]:
+        failed = sum(self.failures.values())
+        return {
+            "buyers": self.done,
+            "succeeded": self.done - failed,
+            "failed": failed,
+            "failures": dict(self.failures),
+            "seconds": round(time.perf_counter() - self.start, 2),
+            "buyers_per_sec": round(self.rate, 3),
+            "workers": workers,
+        }
+
+
+def run(path: str, out, module_name: str = "recommend", workers: int = BATCH_SCORE_WORKERS,
+        chunk_size: int = BATCH_SCORE_CHUNK_SIZE, default_limit: int = 50, save: bool = False,
+        synthetic: int = 0, latency_scale: float = 0.0) -> Dict[str, Any]:
+    """Score every line of path, writing result lines to out as chunks finish; returns the summary"""
+    progress = Progress()
+    chunks = _chunks(read_requests(path), max(1, chunk_size))
+    init_args = (module_name, synthetic, latency_scale, save)
+
+    def write(lines: List[Tuple[Optional[str], str]]):
+        for error_type, line in lines:
+            out.write(line + "\n")
+            progress.add(error_type)
+        out.flush()
+        progress.maybe_report()
+
+    if workers <= 1:
+        # In-process (debugging, profiling)
+        stdout = sys.stdout
+        _init_worker(*init_args)
+        try:
+            for chunk in chunks:
+                write(score_chunk(chunk, default_limit))
+        finally:
+            sys.stdout = stdout
+        return progress.summary(1)
+
+    # Bounded in-flight chunks: the input is streamed, never loaded whole
+    max_in_flight = workers * 2
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init_args) as pool:
+        in_flight: Dict[Future, List[Tuple[int, Any]]] = {}
+
+        def drain(return_when):
+            done, _ = wait(in_flight, return_when=return_when)
+            for future in done:
+                chunk = in_flight.pop(future)
+                try:
+                    write(future.result())
+                except Exception as e:
+                    # Worker crashed (or result not picklable): the whole chunk failed
+                    write([(type(e).__name__, json.dumps(_error_line(line_no, None, e))) for line_no, _ in chunk])
+
+        for chunk in chunks:
+            if len(in_flight) >= max_in_flight:
+                drain(FIRST_COMPLETED)
+            in_flight[pool.submit(score_chunk, chunk, default_limit)] = chunk
+        while in_flight:
+            drain(FIRST_COMPLETED)
+
+    return progress.summary(workers)
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Score buyers / preference texts from JSONL with recommend_hybrid")
+    parser.add_argument("input", help="JSONL file of request bodies or preference strings ('-' for stdin)")
+    parser.add_argument("-o", "--output", default="-", help="result JSONL file (default stdout)")
+    parser.add_argument("--module", default="recommend", choices=["recommend", "recommend_lightweight"])
+    parser.add_argument("--workers", type=int, default=BATCH_SCORE_WORKERS, help="processes (1 = in-process)")
+    parser.add_argument("--chunk-size", type=int, default=BATCH_SCORE_CHUNK_SIZE,
+                        help="buyers per recommend_hybrid_batch call")
+    parser.add_argument("--limit", type=int, default=50, help="default limit for lines without one")
+    parser.add_argument("--save", action="store_true",
+                        help="save each buyer's recommendations to buyer_properties (recommend module only)")
+    parser.add_argument("--synthetic", type=int, default=0, metavar="N",
+                        help="offline: benchmark stand-ins over a synthetic catalog of N listings")
+    parser.add_argument("--latency-scale", type=float, default=0.0,
+                        help="with --synthetic, scale the stand-ins' simulated latencies (0 = none)")
+    parser.add_argument("--verbose", action="store_true", help="keep the engine's INFO logging")
+    parser.add_argument("--json", help="also write the summary to this file")
+    args = parser.parse_args(argv)
+
+    if args.save and args.module != "recommend":
+        parser.error("--save needs --module recommend")
+    if not args.verbose:
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        summary = run(args.input, out, module_name=args.module, workers=args.workers, chunk_size=args.chunk_size,
+                      default_limit=args.limit, save=args.save, synthetic=args.synthetic,
+                      latency_scale=args.latency_scale)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    print(f"[Batch Score] Done: {summary['buyers']} buyers in {summary['seconds']:.1f} s "
+          f"({summary['buyers_per_sec']:.2f} buyers/sec), {summary['failed']} failed", file=sys.stderr)
+    print(json.dumps(summary), file=sys.stderr)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    if summary["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
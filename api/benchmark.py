@@ -0,0 +1,672 @@
+"""
+Offline end-to-end benchmark for recommend_hybrid.
+
+Runs api/recommend.py and/or api/recommend_lightweight.py against
+in-process stand-ins for every external dependency:
+
+- Supabase: query builder and search_properties_geo RPC over a synthetic catalog
+- OpenAI: canned preference parsing, listing scores and embeddings
+- HTTP (requests): Google Places, SF Planning / Google geocoders, Distance
+  Matrix and the PIM service
+
+Each stand-in has a configurable latency (seconds, jittered) and failure
+rate, and counts its calls. Per run the harness records wall time, time
+spent in each pipeline stage (stage functions are wrapped, times are
+inclusive) and external-call counts, and reports p50/p95/p99 for every
+(module, catalog size, limit) combination.
+
+Usage:
+    python api/benchmark.py --catalog 500,5000 --limit 10,50 --runs 20
+    python api/benchmark.py --module lightweight --latency openai=0,places=0   # CPU only
+    python api/benchmark.py --failure-rate openai=0.2,pim=0.1 --json bench.json
+    python api/benchmark.py --latency openai=4 --deadline 8   # stages cut to fit (time_budget.py)
+
+Nothing here touches the network; API keys are set to placeholders so the
+modules take their "configured" code paths.
+"""
+
+import argparse
+import importlib
+import json
+import math
+import os
+import random
+import re
+import statistics
+import sys
+import threading
+import time
+import types
+from collections import Counter, defaultdict
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("GOOGLE_PLACES_API_KEY", "benchmark")
+
+import requests  # noqa: E402  (the real module, for its exception types)
+
+from llm_prompt import count_tokens  # noqa: E402
+
+# Median latency per external service in seconds (jittered +-30% per call)
+DEFAULT_LATENCY = {
+    "openai": 0.8,
+    "embeddings": 0.15,
+    "supabase": 0.04,
+    "places": 0.12,
+    "geocoder": 0.08,
+    "distance_matrix": 0.2,
+    "pim": 0.25,
+}
+DEFAULT_PREFS_TEXT = "3+ bed house in San Francisco or Oakland under $2M with a garage, near parks and good schools"
+
+# Functions timed as pipeline stages (those missing from a module are skipped)
+STAGE_FUNCTIONS = (
+    "parse_prefs_llm",
+    "fetch_properties_from_supabase",
+    "fetch_properties_from_snapshot",
+    "semantic_prerank",
+    "enrich_listings_with_places",
+    "commute_minutes_for_listings",
+    "llm_score_batch",
+    "fit_ml_and_predict",
+    "get_property_coordinates",
+    "get_pim_score",
+    "loved_similarity_boosts",
+    "feedback_adjustments",
+)
+MODULES = {"full": "recommend", "lightweight": "recommend_lightweight"}
+
+CITIES = {
+    "San Francisco": (37.76, -122.44),
+    "Oakland": (37.80, -122.27),
+    "Berkeley": (37.87, -122.27),
+    "Palo Alto": (37.44, -122.14),
+    "San Jose": (37.33, -121.89),
+}
+PROPERTY_TYPES = ("Single Family", "Condo", "Townhouse", "Multi Family")
+DESCRIPTION_WORDS = (
+    "updated kitchen", "hardwood floors", "attached garage", "large backyard", "near park",
+    "close to transit", "in-unit laundry", "ocean views", "fireplace", "solar panels",
+    "quiet street", "walk to shops", "central air", "home office", "deck",
+)
+
+
+class ServiceStub:
+    """Latency, failure injection and call counting shared by all stand-ins"""
+
+    def __init__(self, latency: Dict[str, float], failure_rate: Dict[str, float],
+                 latency_scale: float = 1.0, seed: int = 0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.latency_scale = latency_scale
+        self.calls: Counter = Counter()
+        self.failures: Counter = Counter()
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+
+    def hit(self, service: str, timeout: float = None) -> bool:
+        """Count a call, sleep its latency (at most timeout); False if this call should fail or timed out"""
+        with self._lock:
+            self.calls[service] += 1
+            jitter = self._rng.uniform(0.7, 1.3)
+            failed = self._rng.random() < self.failure_rate.get(service, 0.0)
+            if failed:
+                self.failures[service] += 1
+        delay = self.latency.get(service, 0.0) * self.latency_scale * jitter
+        if timeout is not None and delay > timeout:
+            time.sleep(max(0.0, timeout))
+            return False
+        if delay > 0:
+            time.sleep(delay)
+        return not failed
+
+    def reset(self):
+        self.calls.clear()
+        self.failures.clear()
+
+
+# ------------------- Synthetic catalog -------------------
+def synthetic_catalog(size: int, seed: int = 0, missing_coords: float = 0.05,
+                      pim_cached: float = 0.5) -> List[Dict[str, Any]]:
+    """properties rows with the columns both modules select"""
+    rng = random.Random(seed)
+    city_names = list(CITIES)
+    rows = []
+    for i in range(size):
+        city = city_names[i % len(city_names)] if i < len(city_names) else rng.choice(city_names)
+        lat0, lng0 = CITIES[city]
+        sqft = rng.randint(600, 4500)
+        has_pim = city == "San Francisco" and rng.random() < pim_cached
+        rows.append({
+            "id": f"00000000-0000-4000-8000-{i:012d}",
+            "address": f"{100 + i} {rng.choice(['Oak', 'Pine', 'Elm', 'Market', 'Mission'])} St",
+            "city": city,
+            "state": "CA",
+            "zip_code": f"94{rng.randint(100, 999)}",
+            "coordinates": None if rng.random() < missing_coords else {
+                "lat": lat0 + rng.uniform(-0.04, 0.04), "lng": lng0 + rng.uniform(-0.04, 0.04)},
+            "listing_price": rng.randint(40, 400) * 10000,
+            "bedrooms": rng.randint(1, 6),
+            "bathrooms": rng.choice([1, 1.5, 2, 2.5, 3, 4]),
+            "square_feet": sqft,
+            "lot_size": rng.choice([0, rng.randint(1500, 12000)]),
+            "property_type": rng.choice(PROPERTY_TYPES),
+            "year_built": rng.randint(1900, 2024),
+            "description": "Charming home with " + ", ".join(rng.sample(DESCRIPTION_WORDS, 5)) + ". " * 3,
+            "school_avg_rating": round(rng.uniform(2, 10), 1),
+            "school_closest_miles": round(rng.uniform(0.1, 2.5), 2),
+            "school_best_elementary": rng.randint(1, 10),
+            "school_best_middle": rng.randint(1, 10),
+            "school_best_high": rng.randint(1, 10),
+            "zillow_property_id": str(20000000 + i),
+            "data_source": "benchmark",
+            "pim_score": round(rng.uniform(3, 9), 2) if has_pim else None,
+            "pim_env_risk": 0.5 if has_pim else None,
+            "pim_regulatory_friction": 0.5 if has_pim else None,
+            "pim_expandability": 0.5 if has_pim else None,
+            "pim_reno_recency": 0.5 if has_pim else None,
+            "pim_nuisance": 0.5 if has_pim else None,
+            "pim_scored_at": "2026-01-01T00:00:00+00:00" if has_pim else None,
+            "updated_at": "2026-01-01T00:00:00+00:00",
+        })
+    return rows
+
+
+# ------------------- Supabase -------------------
+class FakeResult:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeQuery:
+    """Subset of the postgrest query builder used by the API modules"""
+
+    def __init__(self, db: "FakeSupabase", table: str):
+        self.db = db
+        self.table = table
+        self.filters: List[Callable[[Dict[str, Any]], bool]] = []
+        self.negate = False
+        self.order_by = None
+        self.offset = 0
+        self.row_limit = None
+        self.single = False
+        self.write = None
+
+    def _add(self, predicate):
+        negate, self.negate = self.negate, False
+        self.filters.append((lambda r: not predicate(r)) if negate else predicate)
+        return self
+
+    def select(self, *_args, **_kwargs):
+        return self
+
+    @property
+    def not_(self):
+        self.negate = True
+        return self
+
+    def eq(self, column, value):
+        return self._add(lambda r: r.get(column) == value)
+
+    def in_(self, column, values):
+        values = set(values)
+        return self._add(lambda r: r.get(column) in values)
+
+    def gt(self, column, value):
+        return self._add(lambda r: r.get(column) is not None and r.get(column) > value)
+
+    def gte(self, column, value):
+        return self._add(lambda r: r.get(column) is not None and r.get(column) >= value)
+
+    def lte(self, column, value):
+        return self._add(lambda r: r.get(column) is not None and r.get(column) <= value)
+
+    def order(self, column, desc=False, **_kwargs):
+        self.order_by = (column, desc)
+        return self
+
+    def limit(self, n):
+        self.row_limit = n
+        return self
+
+    def range(self, start, end):
+        self.offset, self.row_limit = start, end - start + 1
+        return self
+
+    def maybe_single(self):
+        self.single = True
+        return self
+
+    def upsert(self, payload, **_kwargs):
+        self.write = payload if isinstance(payload, list) else [payload]
+        return self
+
+    insert = upsert
+
+    def update(self, values):
+        self.write = values
+        return self
+
+    def execute(self):
+        if not self.db.stub.hit("supabase"):
+            raise RuntimeError("benchmark: injected Supabase failure")
+        rows = self.db.tables.setdefault(self.table, [])
+        if isinstance(self.write, list):
+            return FakeResult(self.write)
+        matched = [r for r in rows if all(f(r) for f in self.filters)]
+        if isinstance(self.write, dict):
+            for row in matched:
+                row.update(self.write)
+            return FakeResult(matched)
+        if self.order_by:
+            column, desc = self.order_by
+            matched.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse=desc)
+        end = None if self.row_limit is None else self.offset + self.row_limit
+        matched = matched[self.offset:end]
+        if self.single:
+            return FakeResult(matched[0] if matched else None)
+        return FakeResult(matched)
+
+
+class FakeRpc:
+    def __init__(self, db: "FakeSupabase", name: str, params: Dict[str, Any]):
+        self.db, self.name, self.params = db, name, params
+
+    def execute(self):
+        if not self.db.stub.hit("supabase"):
+            raise RuntimeError("benchmark: injected Supabase failure")
+        if self.name != "search_properties_geo" or "center_lat" not in self.params:
+            raise RuntimeError(f"benchmark: unsupported rpc {self.name}")
+        p = self.params
+        excluded = set(p.get("exclude_ids") or [])
+        candidates = set(p["candidate_ids"]) if p.get("candidate_ids") is not None else None
+        hits = []
+        for row in self.db.tables["properties"]:
+            coords = row.get("coordinates")
+            if not coords or row["id"] in excluded or (candidates is not None and row["id"] not in candidates):
+                continue
+            if p.get("property_types") and row.get("property_type") not in p["property_types"]:
+                continue
+            if p.get("updated_since") and not row.get("updated_at", "") > p["updated_since"]:
+                continue
+            if not (p.get("min_price", 0) <= row["listing_price"] <= p.get("max_price", math.inf)):
+                continue
+            if row["bedrooms"] < p.get("min_beds", 0) or row["bathrooms"] < p.get("min_baths", 0):
+                continue
+            miles = _haversine_miles(p["center_lat"], p["center_lng"], coords["lat"], coords["lng"])
+            if miles <= p.get("radius_miles", math.inf):
+                hits.append({"property_id": row["id"], "distance_miles": miles})
+        hits.sort(key=lambda h: h["distance_miles"])
+        return FakeResult(hits[:p.get("max_results", 100)])
+
+
+class FakeSupabase:
+    def __init__(self, catalog: List[Dict[str, Any]], stub: ServiceStub):
+        self.stub = stub
+        self.tables: Dict[str, List[Dict[str, Any]]] = {
+            "properties": catalog, "buyer_properties": [], "buyer_profiles": [], "property_deletions": [],
+        }
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def rpc(self, name: str, params: Dict[str, Any]) -> FakeRpc:
+        return FakeRpc(self, name, params)
+
+
+def _haversine_miles(lat1, lon1, lat2, lon2) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((p2 - p1) / 2) ** 2
+         + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 3958.8 * 2 * math.asin(math.sqrt(a))
+
+
+# ------------------- OpenAI -------------------
+_ROW_RE = re.compile(r"^(\d+)\|", re.MULTILINE)
+
+
+class FakeOpenAI:
+    """Canned chat completions (preferences, listing scores) and embeddings"""
+
+    def __init__(self, stub: ServiceStub, prefs: Dict[str, Any] = None, seed: int = 0):
+        self.stub = stub
+        self.prefs = prefs or {
+            "budget_min": 0, "budget_max": 2000000, "min_beds": 3, "min_baths": 0, "min_sqft": 0,
+            "min_lot_size": 0, "must_haves": ["garage"], "nice_to_haves": ["park", "schools"],
+            "preferred_areas": ["San Francisco", "Oakland"], "property_types": ["Single Family"],
+            "commute_address": None, "commute_mode": "driving", "max_commute_minutes": None,
+        }
+        self._rng = random.Random(seed)
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self._chat))
+        self.embeddings = types.SimpleNamespace(create=self._embed)
+
+    def _chat(self, model=None, messages=None, timeout=None, **_kwargs):
+        if not self.stub.hit("openai", timeout):
+            raise RuntimeError("benchmark: injected OpenAI failure or timeout")
+        prompt = messages[-1]["content"]
+        if "Extract structured preferences" in prompt:
+            content = json.dumps(self.prefs)
+        else:
+            content = json.dumps({"scores": [
+                {"idx": int(i), "score": self._rng.randint(20, 95)} for i in _ROW_RE.findall(prompt)
+            ]})
+        usage = types.SimpleNamespace(prompt_tokens=count_tokens(prompt), completion_tokens=count_tokens(content))
+        message = types.SimpleNamespace(content=content)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=usage)
+
+    def _embed(self, model=None, input=None, **kwargs):
+        if not self.stub.hit("embeddings"):
+            raise RuntimeError("benchmark: injected OpenAI failure")
+        texts = [input] if isinstance(input, str) else list(input)
+        dims = kwargs.get("dimensions") or 256
+        data = [types.SimpleNamespace(embedding=np.random.default_rng(hash(t) & 0xFFFF).standard_normal(dims).tolist())
+                for t in texts]
+        return types.SimpleNamespace(data=data)
+
+
+# ------------------- HTTP (Places, geocoders, Distance Matrix, PIM) -------------------
+class FakeResponse:
+    def __init__(self, status_code: int, payload: Any = None):
+        self.status_code = status_code
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+    @property
+    def text(self):
+        return json.dumps(self._payload)
+
+
+class FakeRequests:
+    """Drop-in for the requests module, routing by URL to per-service stubs"""
+
+    Timeout = requests.Timeout
+    RequestException = requests.RequestException
+
+    def __init__(self, stub: ServiceStub, seed: int = 0):
+        self.stub = stub
+        self._rng = random.Random(seed)
+
+    def post(self, url, json=None, **_kwargs):
+        if "places.googleapis.com" in url:
+            return self._places(json or {})
+        if url.endswith("/score"):
+            return self._pim(json or {})
+        raise RuntimeError(f"benchmark: unexpected POST {url}")
+
+    def get(self, url, params=None, **_kwargs):
+        params = params or {}
+        if "distancematrix" in url:
+            return self._distance_matrix(params)
+        if "geocode" in url.lower() or "Geocoder" in url:
+            return self._geocode(url, params)
+        raise RuntimeError(f"benchmark: unexpected GET {url}")
+
+    def _places(self, body):
+        if not self.stub.hit("places"):
+            return FakeResponse(503, {"error": "injected"})
+        center = body["locationRestriction"]["circle"]["center"]
+        radius_deg = body["locationRestriction"]["circle"]["radius"] / 111000.0
+        places = [{
+            "id": f"place-{self._rng.randint(0, 10 ** 9)}",
+            "location": {"latitude": center["latitude"] + self._rng.uniform(-radius_deg, radius_deg) / 2,
+                         "longitude": center["longitude"] + self._rng.uniform(-radius_deg, radius_deg) / 2},
+        } for _ in range(self._rng.randint(0, body.get("maxResultCount", 8)))]
+        return FakeResponse(200, {"places": places})
+
+    def _geocode(self, url, params):
+        if not self.stub.hit("geocoder"):
+            return FakeResponse(503, {})
+        lat, lng = 37.76 + self._rng.uniform(-0.04, 0.04), -122.44 + self._rng.uniform(-0.04, 0.04)
+        if "sfplanning" in url:
+            return FakeResponse(200, {"candidates": [{"location": {"x": lng, "y": lat}}]})
+        return FakeResponse(200, {"status": "OK", "results": [{"geometry": {"location": {"lat": lat, "lng": lng}}}]})
+
+    def _distance_matrix(self, params):
+        if not self.stub.hit("distance_matrix"):
+            return FakeResponse(503, {})
+        rows = [{"elements": [{"status": "OK", "duration": {"value": self._rng.randint(300, 3600)}}]}
+                for _ in params.get("origins", "").split("|")]
+        return FakeResponse(200, {"rows": rows})
+
+    def _pim(self, body):
+        if not self.stub.hit("pim"):
+            return FakeResponse(503, {})
+        return FakeResponse(200, {
+            "listing_id": body.get("property", {}).get("listing_id"),
+            "score_total": round(self._rng.uniform(2, 9.5), 2),
+            "subscores": {k: round(self._rng.random(), 2) for k in
+                          ("env_risk", "regulatory_friction", "expandability", "reno_recency", "nuisance")},
+        })
+
+
+# ------------------- Harness -------------------
+class StageTimer:
+    """Wraps module-level stage functions and accumulates their wall time per run"""
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = defaultdict(float)
+        self.counts: Counter = Counter()
+        self._local = threading.local()
+
+    def wrap(self, name: str, fn: Callable) -> Callable:
+        def timed(*args, **kwargs):
+            # Only the outermost call of a stage is timed (no double counting on recursion)
+            depth = getattr(self._local, name, 0)
+            setattr(self._local, name, depth + 1)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                setattr(self._local, name, depth)
+                if depth == 0:
+                    self.seconds[name] += time.perf_counter() - start
+                    self.counts[name] += 1
+        timed.__wrapped__ = fn
+        return timed
+
+    def reset(self):
+        self.seconds.clear()
+        self.counts.clear()
+
+
+def install(module, catalog: List[Dict[str, Any]], stub: ServiceStub, timer: StageTimer, seed: int = 0):
+    """Point a recommend module (and its HTTP helpers) at the stand-ins"""
+    fake_requests = FakeRequests(stub, seed)
+    module.supabase = FakeSupabase(catalog, stub)
+    module.openai_client = FakeOpenAI(stub, seed=seed)
+    module.requests = fake_requests
+    for helper in ("commute",):
+        sys.modules[helper].requests = fake_requests
+    # Benchmark the database path, not local snapshots, unless configured
+    for name in ("POI_SNAPSHOT_PATH", "FEATURE_SNAPSHOT_PATH"):
+        if hasattr(module, name) and not os.environ.get(f"BENCHMARK_{name}"):
+            setattr(module, name, None)
+    for name in STAGE_FUNCTIONS:
+        fn = getattr(module, name, None)
+        if fn is not None:
+            setattr(module, name, timer.wrap(name, getattr(fn, "__wrapped__", fn)))
+
+
+def clear_caches(module):
+    """Drop in-process caches so every run starts cold"""
+    for owner, name in ((module, "GEOCODING_CACHE"), (sys.modules.get("commute"), "_geocode_cache"),
+                        (sys.modules.get("commute"), "_travel_cache")):
+        cache = getattr(owner, name, None) if owner is not None else None
+        if cache is not None and hasattr(cache, "clear"):
+            cache.clear()
+
+
+def percentiles(values: Sequence[float]) -> Dict[str, float]:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None}
+    arr = np.asarray(values, dtype=np.float64)
+    p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "mean": float(arr.mean())}
+
+
+def run_case(module, catalog_size: int, limit: int, runs: int, stub: ServiceStub, timer: StageTimer,
+             prefs_text: str, warm: bool = False, warmup: int = 1, seed: int = 0,
+             quiet: bool = True, deadline: float = None) -> Dict[str, Any]:
+    """Benchmark one (module, catalog size, limit) combination, each run under a deadline if given"""
+    install(module, synthetic_catalog(catalog_size, seed=seed), stub, timer, seed=seed)
+    latencies, errors, results = [], 0, []
+    stage_runs: Dict[str, List[float]] = defaultdict(list)
+    call_runs: Dict[str, List[int]] = defaultdict(list)
+    failure_totals: Counter = Counter()
+    tokens: List[int] = []
+    degraded: Counter = Counter()
+
+    for i in range(warmup + runs):
+        if not warm:
+            clear_caches(module)
+        stub.reset()
+        timer.reset()
+        usage = module.TokenUsage()
+        time_budget = module.TimeBudget(deadline) if deadline else None
+        start = time.perf_counter()
+        try:
+            with _silenced(quiet):
+                recs = module.recommend_hybrid(user_prefs_text=prefs_text, limit=limit, usage=usage,
+                                               time_budget=time_budget)
+            ok = True
+        except Exception as e:
+            recs, ok = [], False
+            if not quiet:
+                print(f"[Benchmark] Run failed: {e}")
+        elapsed = time.perf_counter() - start
+        if i < warmup:
+            continue
+        if ok:
+            latencies.append(elapsed)
+            results.append(len(recs))
+            tokens.append(usage.total_tokens)
+            if time_budget is not None:
+                degraded.update(time_budget.degraded.keys())
+        else:
+            errors += 1
+        for name in set(timer.seconds) | set(stage_runs):
+            stage_runs[name].append(timer.seconds.get(name, 0.0))
+        for service in set(stub.calls) | set(call_runs):
+            call_runs[service].append(stub.calls.get(service, 0))
+        failure_totals.update(stub.failures)
+
+    return {
+        "module": module.__name__,
+        "catalog_size": catalog_size,
+        "limit": limit,
+        "runs": runs,
+        "deadline_s": deadline,
+        "errors": errors,
+        "latency_s": percentiles(latencies),
+        "throughput_rps": len(latencies) / sum(latencies) if latencies else 0.0,
+        "results_mean": statistics.fmean(results) if results else 0,
+        "llm_tokens_mean": statistics.fmean(tokens) if tokens else 0,
+        "stages_s": {name: percentiles(vals) for name, vals in sorted(stage_runs.items())},
+        "external_calls_mean": {s: statistics.fmean(v) for s, v in sorted(call_runs.items())},
+        "injected_failures": dict(failure_totals),
+        "degraded_runs": dict(degraded),
+    }
+
+
+class _silenced:
+    """Swallow the modules' per-listing print logging during timed runs"""
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+
+    def __enter__(self):
+        if self.enabled:
+            self._stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+
+    def __exit__(self, *exc):
+        if self.enabled:
+            sys.stdout.close()
+            sys.stdout = self._stdout
+        return False
+
+
+def _fmt(seconds: Optional[float]) -> str:
+    return "-" if seconds is None else f"{seconds * 1000:8.1f}"
+
+
+def print_report(case: Dict[str, Any]):
+    lat = case["latency_s"]
+    print(f"\n== {case['module']}  catalog={case['catalog_size']}  limit={case['limit']}  "
+          f"runs={case['runs']}  errors={case['errors']}  results={case['results_mean']:.0f}  "
+          f"tokens={case['llm_tokens_mean']:.0f}")
+    print(f"   latency ms   p50 {_fmt(lat['p50'])}  p95 {_fmt(lat['p95'])}  p99 {_fmt(lat['p99'])}  "
+          f"({case['throughput_rps']:.2f} req/s sequential)")
+    for name, stats in case["stages_s"].items():
+        print(f"   {name:32s} p50 {_fmt(stats['p50'])}  p95 {_fmt(stats['p95'])}  p99 {_fmt(stats['p99'])}")
+    calls = ", ".join(f"{s}={n:.1f}" for s, n in case["external_calls_mean"].items())
+    print(f"   calls/request: {calls}")
+    if case["injected_failures"]:
+        print(f"   injected failures: {case['injected_failures']}")
+    if case["degraded_runs"]:
+        print(f"   runs degraded by the {case['deadline_s']:g} s deadline: {case['degraded_runs']}")
+
+
+def _parse_service_map(text: Optional[str], defaults: Dict[str, float]) -> Dict[str, float]:
+    values = dict(defaults)
+    for item in filter(None, (text or "").split(",")):
+        service, _, value = item.partition("=")
+        values[service.strip()] = float(value)
+    return values
+
+
+def _int_list(text: str) -> List[int]:
+    return [int(v) for v in text.split(",") if v.strip()]
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Offline recommend_hybrid benchmark")
+    parser.add_argument("--module", choices=["full", "lightweight", "both"], default="both")
+    parser.add_argument("--catalog", default="500,5000", help="comma-separated catalog sizes")
+    parser.add_argument("--limit", default="10,50", help="comma-separated limit values")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--latency", help="service=seconds overrides, e.g. openai=0.5,pim=0")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiply every latency (0 = CPU only)")
+    parser.add_argument("--failure-rate", help="service=rate, e.g. openai=0.1,places=0.05")
+    parser.add_argument("--prefs-text", default=DEFAULT_PREFS_TEXT)
+    parser.add_argument("--warm", action="store_true", help="keep in-process caches between runs")
+    parser.add_argument("--deadline", type=float, help="run each request under a time budget of this many seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="show the modules' own logging")
+    parser.add_argument("--json", help="write all results to this file")
+    args = parser.parse_args(argv)
+
+    stub = ServiceStub(
+        latency=_parse_service_map(args.latency, DEFAULT_LATENCY),
+        failure_rate=_parse_service_map(args.failure_rate, {}),
+        latency_scale=args.latency_scale,
+        seed=args.seed,
+    )
+    timer = StageTimer()
+    names = list(MODULES) if args.module == "both" else [args.module]
+    cases = []
+    for name in names:
+        with _silenced(not args.verbose):
+            module = importlib.import_module(MODULES[name])
+        for size in _int_list(args.catalog):
+            for limit in _int_list(args.limit):
+                case = run_case(module, size, limit, args.runs, stub, timer, args.prefs_text,
+                                warm=args.warm, warmup=args.warmup, seed=args.seed, quiet=not args.verbose,
+                                deadline=args.deadline)
+                print_report(case)
+                cases.append(case)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"latency": stub.latency, "latency_scale": stub.latency_scale,
+                       "failure_rate": stub.failure_rate, "cases": cases}, f, indent=2)
+        print(f"\n[Benchmark] Wrote {len(cases)} cases to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
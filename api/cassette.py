@@ -0,0 +1,445 @@
+"""
+Record/replay of external calls ("cassettes") for deterministic runs.
+
+CASSETTE_MODE=record wraps a recommend module's outbound clients -- HTTP
+(Places, SF/Google geocoders, Distance Matrix, PIM), the OpenAI client and
+the Supabase client -- and appends every response, its latency and the
+recommend_hybrid request it belonged to to CASSETTE_PATH (JSON lines,
+gzipped when the path ends in .gz). API keys and headers are not stored.
+
+CASSETTE_MODE=replay serves those responses offline. Calls are matched by
+service and a fingerprint of their arguments; repeated identical calls are
+served in recorded order (the last one is reused once exhausted). Recorded
+failures replay as failures, so fallback paths run as they did. A call
+with no recording raises CassetteMiss. CASSETTE_REPLAY_LATENCY scales the
+recorded latency slept on replay (0 = instant, 1 = as recorded).
+
+Recorded requests can be re-run through the current engine to compare
+speed and ranking against the recording:
+
+    CASSETTE_MODE=record CASSETTE_PATH=/tmp/prod.jsonl.gz ...   # on an instance
+    python api/cassette.py /tmp/prod.jsonl.gz --module recommend_lightweight
+    python api/cassette.py /tmp/prod.jsonl.gz --latency 1.0 --json replay.json
+"""
+
+import argparse
+import dataclasses
+import gzip
+import hashlib
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from types import SimpleNamespace
+from typing import Any, Callable, Deque, Dict, List, Tuple
+
+import requests
+
+import logs
+
+CASSETTE_MODE = os.environ.get("CASSETTE_MODE", "off").lower()  # off | record | replay
+CASSETTE_PATH = os.environ.get("CASSETTE_PATH", "/tmp/recommend_cassette.jsonl.gz")
+CASSETTE_REPLAY_LATENCY = float(os.environ.get("CASSETTE_REPLAY_LATENCY", "0"))
+
+SECRET_PARAMS = {"key", "api_key"}  # query parameters never written to a cassette
+QUERY_PROPERTIES = {"not_"}  # Supabase builder attributes that are properties, not methods
+
+
+class CassetteMiss(RuntimeError):
+    """Replay found no recorded response for a call"""
+
+
+class RecordedError(RuntimeError):
+    """A call that failed while recording, raised again on replay"""
+
+
+def fingerprint(*parts: Any) -> str:
+    raw = json.dumps(parts, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20]
+
+
+def to_namespace(value: Any) -> Any:
+    """JSON-decoded value -> attribute-accessible object (for SDK responses)"""
+    if isinstance(value, dict):
+        return SimpleNamespace(**{k: to_namespace(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return [to_namespace(v) for v in value]
+    return value
+
+
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class Cassette:
+    """One cassette file, in record or replay mode"""
+
+    def __init__(self, path: str, mode: str, latency_scale: float = 0.0):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"cassette mode must be record or replay, not {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.calls: Dict[Tuple[str, str], Deque[Dict[str, Any]]] = defaultdict(deque)
+        self.requests: List[Dict[str, Any]] = []
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._out = None
+        if mode == "replay":
+            self._load()
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._out = _open(path, "a")
+
+    def _load(self):
+        with _open(self.path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry["kind"] == "request":
+                    self.requests.append(entry)
+                else:
+                    self.calls[(entry["service"], entry["key"])].append(entry)
+
+    def _write(self, entry: Dict[str, Any]):
+        line = json.dumps(entry, default=str, separators=(",", ":"))
+        with self._lock:
+            self._out.write(line + "\n")
+            self._out.flush()
+
+    def close(self):
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+
+    def call(self, service: str, key: str, perform: Callable[[], Any],
+             encode: Callable[[Any], Any], decode: Callable[[Any], Any]) -> Any:
+        """Run (record) or look up (replay) one external call"""
+        if self.mode == "replay":
+            return self._replay(service, key, decode)
+
+        start = time.perf_counter()
+        try:
+            result = perform()
+        except Exception as e:
+            self._write({"kind": "call", "service": service, "key": key,
+                         "latency": round(time.perf_counter() - start, 4),
+                         "error": f"{type(e).__name__}: {e}"})
+            raise
+        self._write({"kind": "call", "service": service, "key": key,
+                     "latency": round(time.perf_counter() - start, 4), "response": encode(result)})
+        return result
+
+    def _replay(self, service: str, key: str, decode: Callable[[Any], Any]) -> Any:
+        with self._lock:
+            queue = self.calls.get((service, key))
+            if not queue:
+                self.misses += 1
+                entry = None
+            else:
+                entry = queue.popleft() if len(queue) > 1 else queue[0]
+        if entry is None:
+            logs.count("Cassette", "miss", example=service)
+            raise CassetteMiss(f"no recorded {service} call {key}")
+        if self.latency_scale > 0:
+            time.sleep(entry["latency"] * self.latency_scale)
+        if "error" in entry:
+            raise RecordedError(entry["error"])
+        return decode(entry["response"])
+
+    def record_request(self, module: str, kwargs: Dict[str, Any], results: List[Dict[str, Any]],
+                       elapsed: float):
+        self._write({"kind": "request", "module": module, "kwargs": kwargs, "ms": round(elapsed * 1000.0, 1),
+                     "results": [{"id": r.get("id"), "hybrid_score": r.get("hybrid_score")} for r in results]})
+
+
+# ------------------- HTTP -------------------
+def _http_service(url: str) -> str:
+    if "places.googleapis.com" in url:
+        return "places"
+    if "distancematrix" in url:
+        return "distance_matrix"
+    if "geocode" in url.lower() or "Geocoder" in url:
+        return "geocoder"
+    if url.endswith("/score"):
+        return "pim"
+    return "http"
+
+
+class CassetteResponse:
+    """The parts of requests.Response the recommend modules use"""
+
+    def __init__(self, status_code: int, text: str):
+        self.status_code = status_code
+        self.text = text
+        self.ok = status_code < 400
+
+    def json(self):
+        return json.loads(self.text) if self.text else None
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError(f"{self.status_code} (cassette)", response=self)
+
+
+class CassetteRequests:
+    """Drop-in for the requests module, routed through a cassette"""
+
+    Timeout = requests.Timeout
+    RequestException = requests.RequestException
+
+    def __init__(self, real, cassette: Cassette):
+        self.real = real
+        self.cassette = cassette
+
+    def _call(self, method: str, url: str, params=None, json_body=None, **kwargs):
+        clean_params = {k: v for k, v in (params or {}).items() if k not in SECRET_PARAMS}
+        key = fingerprint(method, url, clean_params, json_body)
+
+        def perform():
+            if method == "GET":
+                return self.real.get(url, params=params, **kwargs)
+            return self.real.post(url, json=json_body, **kwargs)
+
+        return self.cassette.call(
+            _http_service(url), key, perform,
+            encode=lambda r: {"status_code": r.status_code, "text": r.text},
+            decode=lambda d: CassetteResponse(d["status_code"], d["text"]),
+        )
+
+    def get(self, url, params=None, **kwargs):
+        return self._call("GET", url, params=params, **kwargs)
+
+    def post(self, url, json=None, **kwargs):
+        return self._call("POST", url, json_body=json, **kwargs)
+
+
+# ------------------- OpenAI -------------------
+def _dump_sdk(obj: Any) -> Any:
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    return json.loads(json.dumps(obj, default=lambda o: getattr(o, "__dict__", str(o))))
+
+
+class CassetteOpenAI:
+    """Drop-in for an OpenAI client (chat completions and embeddings)"""
+
+    def __init__(self, real, cassette: Cassette):
+        self.real = real
+        self.cassette = cassette
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat))
+        self.embeddings = SimpleNamespace(create=self._embed)
+
+    def _create(self, service: str, target: Callable[[], Any], kwargs: Dict[str, Any]):
+        key = fingerprint({k: v for k, v in kwargs.items() if k != "timeout"})
+        return self.cassette.call(service, key, lambda: target()(**kwargs), encode=_dump_sdk, decode=to_namespace)
+
+    def _chat(self, **kwargs):
+        return self._create("openai", lambda: self.real.chat.completions.create, kwargs)
+
+    def _embed(self, **kwargs):
+        return self._create("openai.embeddings", lambda: self.real.embeddings.create, kwargs)
+
+
+# ------------------- Supabase -------------------
+class CassetteQuery:
+    """Supabase query builder that records its method chain until execute()"""
+
+    def __init__(self, client: "CassetteSupabase", chain: Tuple):
+        self._client = client
+        self._chain = chain
+
+    def __getattr__(self, name: str):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        if name in QUERY_PROPERTIES:
+            return CassetteQuery(self._client, self._chain + ((name, None, None),))
+        return lambda *args, **kwargs: CassetteQuery(self._client, self._chain + ((name, args, kwargs),))
+
+    def _build(self):
+        target = self._client.real
+        for name, args, kwargs in self._chain:
+            target = getattr(target, name)
+            if args is not None:
+                target = target(*args, **kwargs)
+        return target
+
+    def execute(self):
+        key = fingerprint([[name, args, kwargs] for name, args, kwargs in self._chain])
+        return self._client.cassette.call(
+            "supabase", key, lambda: self._build().execute(),
+            encode=lambda r: {"data": r.data, "count": getattr(r, "count", None)},
+            decode=lambda d: SimpleNamespace(data=d["data"], count=d.get("count")),
+        )
+
+
+class CassetteSupabase:
+    def __init__(self, real, cassette: Cassette):
+        self.real = real
+        self.cassette = cassette
+
+    def table(self, name: str) -> CassetteQuery:
+        return CassetteQuery(self, (("table", (name,), {}),))
+
+    def rpc(self, name: str, params: Dict[str, Any] = None) -> CassetteQuery:
+        return CassetteQuery(self, (("rpc", (name, params or {}), {}),))
+
+
+# ------------------- Installation -------------------
+def _request_kwargs(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    out = {}
+    for name, value in kwargs.items():
+        if name == "usage":
+            continue
+        if dataclasses.is_dataclass(value):
+            value = {"__dataclass__": type(value).__name__, **dataclasses.asdict(value)}
+        out[name] = value
+    return out
+
+
+def _restore_kwargs(module, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    out = dict(kwargs)
+    for name, value in kwargs.items():
+        if isinstance(value, dict) and "__dataclass__" in value:
+            fields = {k: v for k, v in value.items() if k != "__dataclass__"}
+            out[name] = getattr(module, value["__dataclass__"])(**fields)
+        elif name == "search_center" and isinstance(value, list):
+            out[name] = tuple(value)
+    return out
+
+
+def install(module, cassette: Cassette):
+    """Route a recommend module's (and its helpers') external clients through cassette"""
+    module.requests = CassetteRequests(module.requests, cassette)
+    commute = sys.modules.get("commute")
+    if commute is not None:
+        commute.requests = CassetteRequests(commute.requests, cassette)
+    module.openai_client = CassetteOpenAI(module.openai_client, cassette)
+    if module.supabase is not None or cassette.mode == "replay":
+        module.supabase = CassetteSupabase(module.supabase, cassette)
+
+    if cassette.mode == "record":
+        engine = module.recommend_hybrid
+
+        signature = inspect.signature(engine)
+
+        def recommend_hybrid(*args, **kwargs):
+            start = time.perf_counter()
+            results = engine(*args, **kwargs)
+            try:
+                bound = signature.bind_partial(*args, **kwargs).arguments
+                cassette.record_request(module.__name__, _request_kwargs(bound), results,
+                                        time.perf_counter() - start)
+            except Exception as e:
+                logs.warning("Cassette", "Could not record request: %s", e)
+            return results
+
+        recommend_hybrid.__wrapped__ = engine
+        module.recommend_hybrid = recommend_hybrid
+    logs.info("Cassette", "%s %s via %s", cassette.mode.capitalize(), module.__name__, cassette.path)
+
+
+def install_from_env(module):
+    """Install per CASSETTE_MODE (no-op when off)"""
+    if CASSETTE_MODE == "off":
+        return None
+    cassette = Cassette(CASSETTE_PATH, CASSETTE_MODE, CASSETTE_REPLAY_LATENCY)
+    install(module, cassette)
+    return cassette
+
+
+# ------------------- Replay CLI -------------------
+def _overlap(a: List[Any], b: List[Any]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(set(a) & set(b)) / max(len(a), len(b))
+
+
+def replay_requests(cassette: Cassette, module_name: str = None) -> List[Dict[str, Any]]:
+    """
+    Re-run every recorded request through recommend_hybrid of module_name
+    (default: the module that recorded it) against the cassette.
+    """
+    from llm_prompt import TokenUsage
+
+    installed = {}
+    rows = []
+    for entry in cassette.requests:
+        name = module_name or entry.get("module") or "recommend_lightweight"
+        if name not in installed:
+            installed[name] = __import__(name)
+            install(installed[name], cassette)
+        module = installed[name]
+        kwargs = _restore_kwargs(module, entry["kwargs"])
+        misses_before = cassette.misses
+        start = time.perf_counter()
+        try:
+            results = module.recommend_hybrid(**kwargs, usage=TokenUsage())
+            error = None
+        except Exception as e:
+            results, error = [], f"{type(e).__name__}: {e}"
+        elapsed = (time.perf_counter() - start) * 1000.0
+        recorded_ids = [r["id"] for r in entry["results"]]
+        replayed_ids = [r.get("id") for r in results]
+        recorded_scores = {r["id"]: r["hybrid_score"] for r in entry["results"]}
+        deltas = [abs(r["hybrid_score"] - recorded_scores[r["id"]]) for r in results
+                  if r.get("id") in recorded_scores and recorded_scores[r["id"]] is not None]
+        rows.append({
+            "module": name,
+            "recorded_module": entry.get("module"),
+            "recorded_ms": entry.get("ms"),
+            "replayed_ms": round(elapsed, 1),
+            "results": len(results),
+            "same_order": recorded_ids == replayed_ids,
+            "overlap": round(_overlap(recorded_ids, replayed_ids), 3),
+            "top10_overlap": round(_overlap(recorded_ids[:10], replayed_ids[:10]), 3),
+            "max_score_delta": round(max(deltas), 3) if deltas else None,
+            "misses": cassette.misses - misses_before,
+            "error": error,
+        })
+    return rows
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Replay recorded requests through the current engine")
+    parser.add_argument("cassette", help="cassette file recorded with CASSETTE_MODE=record")
+    parser.add_argument("--module", choices=("recommend", "recommend_lightweight"),
+                        help="engine to replay through (default: the module that recorded each request)")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="replay recorded latencies scaled by this factor (0 = instant, 1 = as recorded)")
+    parser.add_argument("--json", help="write per-request results to this file")
+    args = parser.parse_args(argv)
+
+    # Clients are replaced by the cassette, but the modules check these are configured
+    os.environ.setdefault("OPENAI_API_KEY", "cassette-replay")
+    os.environ.setdefault("GOOGLE_PLACES_API_KEY", "cassette-replay")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    cassette = Cassette(args.cassette, "replay", latency_scale=args.latency)
+    rows = replay_requests(cassette, args.module)
+    if not rows:
+        print(f"No recorded requests in {args.cassette}")
+        return
+
+    for i, row in enumerate(rows):
+        print(f"#{i:<3} {row['module']:<22} recorded {row['recorded_ms']!s:>8} ms  replayed {row['replayed_ms']:>8} ms  "
+              f"results={row['results']:<3} same_order={row['same_order']!s:<5} overlap={row['overlap']:.2f} "
+              f"top10={row['top10_overlap']:.2f} max_delta={row['max_score_delta']} misses={row['misses']}"
+              + (f"  error={row['error']}" if row["error"] else ""))
+    same = sum(row["same_order"] for row in rows)
+    print(f"{len(rows)} requests: {same} identical rankings, "
+          f"mean overlap {sum(r['overlap'] for r in rows) / len(rows):.3f}, "
+          f"recorded {sum(r['recorded_ms'] or 0 for r in rows):.0f} ms vs replayed "
+          f"{sum(r['replayed_ms'] for r in rows):.0f} ms, {cassette.misses} cassette misses")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Commute-time estimation for recommendation scoring.
+
+The buyer's commute destination is geocoded once, snapped to a small tile,
+and travel times from every candidate are computed in bulk:
+
+- default: a vectorized approximation (great-circle distance x circuity
+  factor / mode speed + fixed overhead), no network calls
+- COMMUTE_MATRIX_ENABLED=true: Google Distance Matrix, many origins to one
+  destination per call (25 origins per request), falling back to the
+  approximation for any origin the API cannot route
+
+Results are cached per (destination tile, mode, property id), so buyers
+commuting to the same area share work and repeat requests cost nothing.
+Both caches are LRUs with a TTL (COMMUTE_CACHE_MAX_ENTRIES,
+COMMUTE_CACHE_TTL), so memory stays bounded and routed times are refreshed.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+import requests
+
+from geo import haversine_miles_vec
+import logs
+from tracing import cache_lookup, count_call, traced
+
+GOOGLE_GEOCODING_URL = "https://maps.googleapis.com/maps/api/geocode/json"
+DISTANCE_MATRIX_URL = "https://maps.googleapis.com/maps/api/distancematrix/json"
+GEOCODING_TIMEOUT = 5
+MATRIX_TIMEOUT = 10
+MATRIX_MAX_ORIGINS = 25
+
+COMMUTE_MATRIX_ENABLED = os.environ.get("COMMUTE_MATRIX_ENABLED", "false").lower() == "true"
+COMMUTE_TILE_DEG = 0.005  # ~0.35 mi - destinations in the same tile share cached times
+
+# Average door-to-door speeds (mph) and fixed overhead (parking, waiting, walking)
+COMMUTE_SPEEDS_MPH = {"driving": 24.0, "transit": 12.0, "bicycling": 10.0, "walking": 3.0}
+COMMUTE_OVERHEAD_MIN = {"driving": 4.0, "transit": 8.0, "bicycling": 2.0, "walking": 0.0}
+ROAD_CIRCUITY = 1.3  # road distance / great-circle distance
+
+COMMUTE_CACHE_MAX_ENTRIES = int(os.environ.get("COMMUTE_CACHE_MAX_ENTRIES", "100000"))
+COMMUTE_CACHE_TTL = float(os.environ.get("COMMUTE_CACHE_TTL", "86400"))  # seconds
+GEOCODE_CACHE_MAX_ENTRIES = 1024
+
+
+class _LRUCache:
+    """Thread-safe LRU of at most max_entries values, each kept for ttl seconds"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[0] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_geocode_cache = _LRUCache(GEOCODE_CACHE_MAX_ENTRIES, COMMUTE_CACHE_TTL)
+_travel_cache = _LRUCache(COMMUTE_CACHE_MAX_ENTRIES, COMMUTE_CACHE_TTL)
+
+
+@traced("geocode.commute_destination")
+def geocode_address(address: str) -> Optional[Tuple[float, float]]:
+    """Geocode a free-form address (e.g. a commute destination) using Google Geocoding API"""
+    google_key = os.environ.get("GOOGLE_PLACES_API_KEY")
+    if not google_key or not address:
+        return None
+
+    cached = _geocode_cache.get(address)
+    if cached is not None:
+        cache_lookup("commute_geocode", True)
+        return cached
+
+    cache_lookup("commute_geocode", False)
+    count_call("geocoder.google")
+
+    try:
+        response = requests.get(
+            GOOGLE_GEOCODING_URL,
+            params={"address": address, "key": google_key},
+            timeout=GEOCODING_TIMEOUT
+        )
+
+        if response.status_code == 200:
+            data = response.json()
+            if data.get("status") == "OK" and data.get("results"):
+                location = data["results"][0]["geometry"]["location"]
+                coords = (float(location["lat"]), float(location["lng"]))
+                _geocode_cache.put(address, coords)
+                logs.info("Commute", "Geocoded destination: %s -> %s", address, coords)
+                return coords
+
+    except Exception as e:
+        logs.warning("Commute", "Geocoding error: %s", e)
+
+    return None
+
+
+def destination_tile(lat: float, lon: float) -> Tuple[str, Tuple[float, float]]:
+    """Snap a destination to its tile; returns (tile key, tile center)"""
+    row = int(np.floor(lat / COMMUTE_TILE_DEG))
+    col = int(np.floor(lon / COMMUTE_TILE_DEG))
+    center = ((row + 0.5) * COMMUTE_TILE_DEG, (col + 0.5) * COMMUTE_TILE_DEG)
+    return f"{row}:{col}", center
+
+
+def approximate_travel_minutes(lats: np.ndarray, lons: np.ndarray,
+                               dest: Tuple[float, float], mode: str = "driving") -> np.ndarray:
+    """Vectorized travel-time estimate (minutes) from many origins to one destination"""
+    speed = COMMUTE_SPEEDS_MPH.get(mode, COMMUTE_SPEEDS_MPH["driving"])
+    overhead = COMMUTE_OVERHEAD_MIN.get(mode, COMMUTE_OVERHEAD_MIN["driving"])
+    miles = haversine_miles_vec(lats, lons, dest[0], dest[1]) * ROAD_CIRCUITY
+    return overhead + miles / speed * 60.0
+
+
+@traced("distance_matrix")
+def matrix_travel_minutes(origins: List[Tuple[float, float]], dest: Tuple[float, float],
+                          mode: str = "driving") -> List[Optional[float]]:
+    """
+    Many-to-one travel times from Google Distance Matrix.
+
+    Sends MATRIX_MAX_ORIGINS origins per request; entries the API could not
+    route (or any failed request) are None.
+    """
+    google_key = os.environ.get("GOOGLE_PLACES_API_KEY")
+    minutes: List[Optional[float]] = [None] * len(origins)
+    if not google_key:
+        return minutes
+
+    for start in range(0, len(origins), MATRIX_MAX_ORIGINS):
+        batch = origins[start:start + MATRIX_MAX_ORIGINS]
+        count_call("distance_matrix")
+        try:
+            response = requests.get(
+                DISTANCE_MATRIX_URL,
+                params={
+                    "origins": "|".join(f"{lat},{lon}" for lat, lon in batch),
+                    "destinations": f"{dest[0]},{dest[1]}",
+                    "mode": mode,
+                    "key": google_key,
+                },
+                timeout=MATRIX_TIMEOUT
+            )
+            if response.status_code != 200:
+                logs.warning("Commute", "Distance Matrix error %s", response.status_code)
+                continue
+
+            rows = (response.json() or {}).get("rows", [])
+            for offset, row in enumerate(rows[:len(batch)]):
+                element = (row.get("elements") or [{}])[0]
+                if element.get("status") == "OK":
+                    minutes[start + offset] = element["duration"]["value"] / 60.0
+
+        except Exception as e:
+            logs.warning("Commute", "Distance Matrix exception: %s", e)
+
+    return minutes
+
+
+def commute_minutes_for_listings(listings: List[Dict[str, Any]], dest: Tuple[float, float],
+                                 mode: str = "driving",
+                                 use_matrix: bool = None) -> List[Optional[float]]:
+    """
+    Travel minutes from each listing to dest, aligned with listings.
+
+    Listings without coordinates get None. Cached values are reused;
+    only uncached listings are estimated (in one vectorized call, or one
+    batched matrix pass).
+    """
+    if use_matrix is None:
+        use_matrix = COMMUTE_MATRIX_ENABLED
+
+    tile, tile_center = destination_tile(*dest)
+    result: List[Optional[float]] = [None] * len(listings)
+    missing, missing_keys, lats, lons = [], [], [], []
+    hits = 0
+
+    for i, listing in enumerate(listings):
+        lat, lon = listing.get("latitude"), listing.get("longitude")
+        if lat is None or lon is None:
+            continue
+        key = (tile, mode, str(listing.get("id")))
+        cached = _travel_cache.get(key)
+        if cached is not None:
+            result[i] = cached
+            hits += 1
+        else:
+            missing.append(i)
+            missing_keys.append(key)
+            lats.append(float(lat))
+            lons.append(float(lon))
+
+    if missing:
+        estimates = approximate_travel_minutes(np.asarray(lats), np.asarray(lons), tile_center, mode)
+        if use_matrix:
+            routed = matrix_travel_minutes(list(zip(lats, lons)), tile_center, mode)
+            estimates = [r if r is not None else float(e) for r, e in zip(routed, estimates)]
+
+        for i, key, minutes in zip(missing, missing_keys, estimates):
+            result[i] = float(minutes)
+            _travel_cache.put(key, float(minutes))
+
+    cache_lookup("commute", True, hits)
+    cache_lookup("commute", False, len(missing))
+    logs.info("Commute", "%d/%d commute times from cache", hits, hits + len(missing))
+    return result
@@ -0,0 +1,380 @@
+"""
+Precomputed property embedding index for semantic pre-ranking.
+
+An offline job embeds every property's description and key attributes and
+writes the vectors as a float32 .npy matrix plus a parallel id array. At
+request time the matrix is opened memory-mapped (zero-copy, shared page
+cache across workers), the parsed Preferences are embedded once, and the
+whole catalog is ranked by cosine similarity with one matrix-vector product.
+The nearest SEMANTIC_SEARCH_SIZE properties then go through the buyer's
+filters; when too few pass, a filtered pool of SEMANTIC_POOL_FACTOR x limit
+candidates is pre-ranked instead.
+
+Embedding clients are any object with embed(texts) -> (n, dim) array:
+- OpenAIEmbeddingClient: OpenAI embeddings API (EMBEDDING_MODEL)
+- HashingEmbeddingClient: local hashed bag-of-words, no network, used when
+  EMBEDDING_MODEL=hashing and handy as a test double
+
+Indexes are written as generations (path/<generation>/) and published by
+atomically replacing path/CURRENT, so readers never pair vectors from one
+build with ids from another.
+
+Build (e.g. nightly):
+    python embedding_index.py --out /tmp/property_embeddings
+"""
+
+import json
+import os
+import re
+import shutil
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import logs
+from tracing import cache_lookup, count_call
+
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_INDEX_PATH = os.environ.get("EMBEDDING_INDEX_PATH")
+SEMANTIC_POOL_FACTOR = int(os.environ.get("SEMANTIC_POOL_FACTOR", "3"))
+SEMANTIC_SEARCH_SIZE = int(os.environ.get("SEMANTIC_SEARCH_SIZE", "300"))
+EMBED_BATCH_SIZE = 256
+KEEP_GENERATIONS = 2
+QUERY_CACHE_SIZE = 512
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+# ------------------- Embedding clients -------------------
+class OpenAIEmbeddingClient:
+    """Embeddings from the OpenAI API, batched EMBED_BATCH_SIZE texts per call"""
+
+    def __init__(self, client, model: str = EMBEDDING_MODEL):
+        self.client = client
+        self.model = model
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = []
+        for start in range(0, len(texts), EMBED_BATCH_SIZE):
+            batch = list(texts[start:start + EMBED_BATCH_SIZE])
+            response = self.client.embeddings.create(model=self.model, input=batch)
+            vectors.extend(item.embedding for item in response.data)
+        return np.asarray(vectors, dtype=np.float32)
+
+
+class HashingEmbeddingClient:
+    """Local hashed bag-of-words (unigrams + bigrams) embeddings"""
+
+    model = "hashing"
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        X = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = _TOKEN_RE.findall((text or "").lower())
+            for term in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+                X[row, zlib.crc32(term.encode("utf-8")) % self.dim] += 1.0
+        return X
+
+
+def get_embedding_client(openai_client=None, model: str = None):
+    """Client matching model (defaults to EMBEDDING_MODEL)"""
+    model = model or EMBEDDING_MODEL
+    if model == "hashing":
+        return HashingEmbeddingClient()
+    return OpenAIEmbeddingClient(openai_client, model=model)
+
+
+def normalize_rows(X: np.ndarray) -> np.ndarray:
+    X = np.asarray(X, dtype=np.float32)
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    np.divide(X, norms, out=X, where=norms > 0)
+    return X
+
+
+# ------------------- Texts -------------------
+def property_text(listing: Dict[str, Any]) -> str:
+    """Embedding text for a normalized listing (see normalize_property_row)"""
+    parts = [
+        f"{listing.get('propertyType') or 'Home'} in {listing.get('city') or 'unknown city'}",
+        f"{listing.get('bedrooms') or 0} bedrooms, {listing.get('bathrooms') or 0} bathrooms",
+    ]
+    if listing.get("livingArea"):
+        parts.append(f"{listing['livingArea']} sqft")
+    if listing.get("lotSize"):
+        parts.append(f"lot {listing['lotSize']} sqft")
+    if listing.get("yearBuilt"):
+        parts.append(f"built {listing['yearBuilt']}")
+    if listing.get("description"):
+        parts.append(str(listing["description"])[:1000])
+    return ". ".join(parts)
+
+
+def preferences_text(prefs) -> str:
+    """Embedding text for a parsed Preferences object"""
+    parts = []
+    if prefs.property_types:
+        parts.append(", ".join(prefs.property_types))
+    if prefs.preferred_areas:
+        parts.append("in " + ", ".join(prefs.preferred_areas))
+    if prefs.min_beds:
+        parts.append(f"{prefs.min_beds} bedrooms")
+    if prefs.min_baths:
+        parts.append(f"{prefs.min_baths} bathrooms")
+    if prefs.min_sqft:
+        parts.append(f"{prefs.min_sqft} sqft")
+    if prefs.must_haves:
+        parts.append("must have " + ", ".join(prefs.must_haves))
+    if prefs.nice_to_haves:
+        parts.append("nice to have " + ", ".join(prefs.nice_to_haves))
+    if getattr(prefs, "school_priority", None) == "high":
+        parts.append("great schools")
+    return ". ".join(parts) or "home"
+
+
+# ------------------- Index -------------------
+class EmbeddingIndex:
+    """
+    L2-normalized property vectors with a parallel id array.
+
+    Args:
+        ids: property ids, row-aligned with vectors
+        vectors: (n, dim) float32 matrix (may be a read-only memmap)
+        model: name of the embedding model the vectors came from
+        built_at: Unix timestamp of the build
+    """
+
+    def __init__(self, ids: np.ndarray, vectors: np.ndarray, model: str, built_at: float):
+        self.ids = np.asarray(ids, dtype=np.str_)
+        self.vectors = vectors
+        self.model = model
+        self.built_at = float(built_at)
+        self._row_by_id = {pid: row for row, pid in enumerate(self.ids.tolist())}
+
+    def __len__(self) -> int:
+        return self.ids.shape[0]
+
+    def rows_for(self, property_ids: Sequence[str]) -> np.ndarray:
+        """Row numbers for property_ids (-1 where the property is not indexed)"""
+        return np.asarray([self._row_by_id.get(str(pid), -1) for pid in property_ids], dtype=np.intp)
+
+    def scores(self, query: np.ndarray, property_ids: Sequence[str]) -> np.ndarray:
+        """Cosine similarity of query to each property (NaN for unindexed ones)"""
+        rows = self.rows_for(property_ids)
+        out = np.full(rows.shape[0], np.nan, dtype=np.float32)
+        found = rows >= 0
+        if found.any():
+            out[found] = self.vectors[rows[found]] @ query
+        return out
+
+    def search(self, query: np.ndarray, k: int = 100) -> List[Tuple[str, float]]:
+        """Brute-force top-k over the whole catalog: [(property_id, cosine)] best first"""
+        if len(self) == 0 or k <= 0:
+            return []
+        sims = self.vectors @ query
+        k = min(k, sims.shape[0])
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top], kind="stable")]
+        return [(str(self.ids[i]), float(sims[i])) for i in top]
+
+    # ------------------- Persistence -------------------
+    def save(self, path: str) -> str:
+        """Write a new generation under path and publish it; returns the generation dir"""
+        generation = f"{int(time.time() * 1000)}"
+        gen_dir = os.path.join(path, generation)
+        os.makedirs(gen_dir, exist_ok=True)
+
+        np.save(os.path.join(gen_dir, "vectors.npy"), np.asarray(self.vectors, dtype=np.float32))
+        np.save(os.path.join(gen_dir, "ids.npy"), self.ids)
+        with open(os.path.join(gen_dir, "meta.json"), "w") as f:
+            json.dump({"model": self.model, "built_at": self.built_at, "count": len(self),
+                       "dim": int(self.vectors.shape[1]) if len(self) else 0}, f)
+
+        tmp_path = os.path.join(path, "CURRENT.tmp")
+        with open(tmp_path, "w") as f:
+            f.write(generation)
+        os.replace(tmp_path, os.path.join(path, "CURRENT"))
+
+        generations = sorted(d for d in os.listdir(path) if d.isdigit())
+        for old in generations[:-KEEP_GENERATIONS]:
+            shutil.rmtree(os.path.join(path, old), ignore_errors=True)
+        return gen_dir
+
+    @classmethod
+    def load(cls, path: str) -> "EmbeddingIndex":
+        """Open the current generation memory-mapped (vectors are not copied into memory)"""
+        gen_dir = path  # Indexes written before generations keep their files in path itself
+        if os.path.exists(os.path.join(path, "CURRENT")):
+            with open(os.path.join(path, "CURRENT")) as f:
+                gen_dir = os.path.join(path, f.read().strip())
+        with open(os.path.join(gen_dir, "meta.json")) as f:
+            meta = json.load(f)
+        vectors = np.load(os.path.join(gen_dir, "vectors.npy"), mmap_mode="r")
+        ids = np.load(os.path.join(gen_dir, "ids.npy"), allow_pickle=False)
+        return cls(ids, vectors, meta.get("model", ""), meta.get("built_at", 0))
+
+
+def build_embedding_index(listings: List[Dict[str, Any]], client) -> EmbeddingIndex:
+    """Embed normalized listings with client"""
+    texts = [property_text(listing) for listing in listings]
+    vectors = normalize_rows(client.embed(texts)) if texts else np.zeros((0, 0), dtype=np.float32)
+    ids = [str(listing.get("id")) for listing in listings]
+    return EmbeddingIndex(np.asarray(ids, dtype=np.str_), vectors, client.model, time.time())
+
+
+# ------------------- Per-instance cache -------------------
+_index_cache: Dict[str, Tuple[float, EmbeddingIndex]] = {}
+_query_cache: Dict[Tuple[str, str], np.ndarray] = {}
+
+
+def get_embedding_index(path: Optional[str]) -> Optional[EmbeddingIndex]:
+    """
+    Open the index at path once per instance.
+
+    A newly published generation is picked up when CURRENT (or, for an
+    index written before generations, meta.json) changes. Returns None when
+    no index is configured or it cannot be read.
+    """
+    if not path:
+        return None
+    try:
+        mtime = os.path.getmtime(os.path.join(path, "CURRENT"))
+    except OSError:
+        try:
+            mtime = os.path.getmtime(os.path.join(path, "meta.json"))
+        except OSError:
+            return None
+
+    cached = _index_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    try:
+        index = EmbeddingIndex.load(path)
+    except Exception as e:
+        logs.warning("Embeddings", f"Could not load index {path}: {e}")
+        return cached[1] if cached else None
+
+    _index_cache[path] = (mtime, index)
+    logs.info("Embeddings", f"Loaded index {path} ({len(index)} properties, model {index.model})")
+    return index
+
+
+def embed_query(client, text: str) -> np.ndarray:
+    """Unit query vector for text, cached per (model, text)"""
+    key = (client.model, text)
+    vector = _query_cache.get(key)
+    cache_lookup("query_embedding", vector is not None)
+    if vector is None:
+        count_call("embeddings")
+        vector = normalize_rows(client.embed([text]))[0]
+        if len(_query_cache) >= QUERY_CACHE_SIZE:
+            _query_cache.pop(next(iter(_query_cache)))
+        _query_cache[key] = vector
+    return vector
+
+
+def preferences_query(prefs, index: Optional[EmbeddingIndex], openai_client=None) -> Optional[np.ndarray]:
+    """Query vector for the buyer's preferences in index's model (None without an index or on failure)"""
+    if index is None or len(index) == 0:
+        return None
+    try:
+        return embed_query(get_embedding_client(openai_client, model=index.model), preferences_text(prefs))
+    except Exception as e:
+        logs.warning("Embeddings", f"Could not embed preferences: {e}")
+        return None
+
+
+def semantic_scores(listings: List[Dict[str, Any]], prefs, index: Optional[EmbeddingIndex],
+                    openai_client=None) -> Optional[np.ndarray]:
+    """
+    Cosine similarity of each listing to the buyer's preferences.
+
+    Returns None when no index is available; unindexed listings get NaN.
+    """
+    query = preferences_query(prefs, index, openai_client=openai_client)
+    if query is None:
+        return None
+    return index.scores(query, [listing.get("id") for listing in listings])
+
+
+def semantic_search(prefs, index: Optional[EmbeddingIndex], k: int = SEMANTIC_SEARCH_SIZE,
+                    openai_client=None) -> Optional[List[Tuple[str, float]]]:
+    """
+    The k properties most similar to the buyer's preferences over the whole
+    catalog, [(property_id, cosine)] best first; None without an index.
+    """
+    query = preferences_query(prefs, index, openai_client=openai_client)
+    if query is None:
+        return None
+    return index.search(query, k)
+
+
+def rank_by_hits(listings: List[Dict[str, Any]], hits: List[Tuple[str, float]],
+                 keep: int) -> List[Dict[str, Any]]:
+    """
+    The keep best of listings in semantic_search order, each with its
+    semantic_score; listings not among hits are dropped.
+    """
+    rank = {pid: (i, sim) for i, (pid, sim) in enumerate(hits)}
+    ranked = sorted((listing for listing in listings if str(listing.get("id")) in rank),
+                    key=lambda listing: rank[str(listing.get("id"))][0])[:keep]
+    for listing in ranked:
+        listing["semantic_score"] = rank[str(listing.get("id"))][1]
+    return ranked
+
+
+def semantic_prerank(listings: List[Dict[str, Any]], prefs, index: Optional[EmbeddingIndex],
+                     keep: int, openai_client=None) -> List[Dict[str, Any]]:
+    """
+    Keep the keep listings most similar to prefs, best first.
+
+    Each listing gets a semantic_score (None if unindexed; unindexed
+    listings rank last). Without an index the input is returned unchanged.
+    """
+    sims = semantic_scores(listings, prefs, index, openai_client=openai_client)
+    if sims is None:
+        return listings
+    ranked = np.where(np.isnan(sims), -np.inf, sims)
+    order = np.argsort(-ranked, kind="stable")[:keep]
+    kept = []
+    for i in order:
+        listing = listings[i]
+        listing["semantic_score"] = None if np.isnan(sims[i]) else float(sims[i])
+        kept.append(listing)
+    logs.info("Embeddings", f"Semantic pre-rank kept {len(kept)}/{len(listings)} candidates")
+    return kept
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the property embedding index")
+    parser.add_argument("--out", required=True, help="Output directory")
+    parser.add_argument("--model", default=EMBEDDING_MODEL, help='Embedding model, or "hashing" for local')
+    parser.add_argument("--page-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    from recommend import PROPERTY_COLUMNS, normalize_property_row, openai_client, supabase
+
+    if not supabase:
+        raise SystemExit("SUPABASE_URL / SUPABASE_SERVICE_ROLE_KEY not configured")
+
+    rows, start = [], 0
+    while True:
+        page = supabase.table("properties").select(PROPERTY_COLUMNS).order("id").range(
+            start, start + args.page_size - 1
+        ).execute().data or []
+        rows.extend(normalize_property_row(p) for p in page)
+        if len(page) < args.page_size:
+            break
+        start += args.page_size
+
+    started = time.time()
+    index = build_embedding_index(rows, get_embedding_client(openai_client, model=args.model))
+    index.save(args.out)
+    print(f"[Embeddings] Indexed {len(index)} properties in {time.time() - started:.1f}s -> {args.out}")
@@ -0,0 +1,583 @@
+"""
+Memory-mapped snapshot of the catalog's scoring features.
+
+A periodic job flattens every property into fixed columns - price, beds,
+baths, sqft, lot, year, coordinates, school aggregates, POI distances and
+counts, PIM subscores, amenity flags, and city / property type codes - and
+writes one .npy file per column. Instances open the columns memory-mapped
+(zero-copy, shared page cache across workers), so candidate filtering runs
+in-process as vectorized masks and only the final candidates' display rows
+are fetched from Supabase.
+
+Snapshots are written as generations (path/<generation>/) and published by
+atomically replacing path/CURRENT, so readers never see a half-written one.
+
+Between full builds a snapshot is kept fresh by delta sync: rows whose
+(updated_at, id) is past the snapshot's watermark, and tombstones from
+property_deletions (migration 0014), are pulled and patched into the
+arrays. Instances sync their loaded copy in a background thread every
+FEATURE_SNAPSHOT_SYNC_SECONDS; the CLI can sync and publish a new generation.
+
+Build (e.g. nightly) / sync (e.g. every few minutes):
+    python feature_snapshot.py --out /tmp/feature_snapshot
+    python feature_snapshot.py --out /tmp/feature_snapshot --sync
+"""
+
+import copy
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import logs
+from geo import haversine_miles_vec
+
+POI_KEYS = ("school", "supermarket", "park", "transit")
+PIM_COLUMNS = ("pim_score", "pim_env_risk", "pim_regulatory_friction",
+               "pim_expandability", "pim_reno_recency", "pim_nuisance")
+
+# Keyword sets mirror the must-have checks in rule_score
+AMENITY_KEYWORDS = {
+    "ev": ("ev", "charger", "charging", "electric vehicle"),
+    "yard": ("yard", "garden", "backyard", "outdoor", "patio"),
+    "garage": ("garage", "two car", "2-car", "parking"),
+}
+AMENITY_TRIGGERS = {
+    "ev": ("ev", "ev charger", "charger", "charging"),
+    "yard": ("yard", "garden", "backyard", "outdoor space"),
+    "garage": ("garage", "two car", "2-car", "parking"),
+}
+
+SCHOOL_LEVEL_COLUMNS = ("best_elementary_rating", "best_middle_rating", "best_high_rating")
+
+NUMERIC_COLUMNS = (
+    ("price", "livingArea", "lotSize", "bedrooms", "bathrooms", "yearBuilt",
+     "latitude", "longitude", "avg_school_rating", "closest_school_miles")
+    + SCHOOL_LEVEL_COLUMNS
+    + tuple(f"poi_{k}_miles" for k in POI_KEYS)
+    + tuple(f"poi_{k}_count" for k in POI_KEYS)
+    + PIM_COLUMNS
+)
+FLAG_COLUMNS = tuple(f"amenity_{k}" for k in AMENITY_KEYWORDS)
+CATEGORY_COLUMNS = ("city", "propertyType")
+
+KEEP_GENERATIONS = 2
+SYNC_PAGE_SIZE = 1000
+
+
+def _num(value) -> float:
+    try:
+        return float(value) if value is not None else np.nan
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def amenity_flags(listing: Dict[str, Any]) -> Dict[str, bool]:
+    """Amenity mentions in description / address (same matching as rule_score)"""
+    text = (listing.get("description") or "").lower() + " " + (listing.get("address") or "").lower()
+    return {f"amenity_{k}": any(w in text for w in words) for k, words in AMENITY_KEYWORDS.items()}
+
+
+def must_have_amenities(must_haves: Sequence[str]) -> List[str]:
+    """Flag columns a buyer's must-haves ask for"""
+    return [f"amenity_{k}" for k, triggers in AMENITY_TRIGGERS.items()
+            if any(w in (must_haves or []) for w in triggers)]
+
+
+def snapshot_features(listing: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Flat feature record for one normalized listing.
+
+    Expects enrich_with_schools_data (and optionally POI enrichment) to have
+    run; missing values become NaN.
+    """
+    raw = listing.get("_raw") or {}
+    poi_min = listing.get("poi_min_miles") or {}
+    poi_counts = listing.get("poi_counts") or {}
+    record = {"id": str(listing.get("id")), "city": listing.get("city") or "",
+              "propertyType": listing.get("propertyType") or ""}
+    for col in ("price", "livingArea", "lotSize", "bedrooms", "bathrooms", "yearBuilt",
+                "latitude", "longitude", "avg_school_rating", "closest_school_miles") + SCHOOL_LEVEL_COLUMNS:
+        record[col] = _num(listing.get(col))
+    for k in POI_KEYS:
+        record[f"poi_{k}_miles"] = _num(poi_min.get(k))
+        record[f"poi_{k}_count"] = _num(poi_counts.get(k))
+    for col in PIM_COLUMNS:
+        record[col] = _num(raw.get(col, listing.get(col)))
+    record.update(amenity_flags(listing))
+    return record
+
+
+class FeatureSnapshot:
+    """
+    Column store of scoring features, row-aligned with ids.
+
+    Args:
+        ids: property ids
+        columns: {name: array} for NUMERIC_COLUMNS (float64, NaN = missing),
+            FLAG_COLUMNS (bool) and CATEGORY_COLUMNS (int32 codes)
+        vocab: {category column: [value per code]}
+        built_at: Unix timestamp of the build
+        watermarks: {"updated_at": ..., "deleted_at": ...} ISO timestamps of
+            the newest change / deletion already applied, and "updated_id",
+            the id of the last change at updated_at
+    """
+
+    def __init__(self, ids: np.ndarray, columns: Dict[str, np.ndarray],
+                 vocab: Dict[str, List[str]], built_at: float,
+                 watermarks: Dict[str, Optional[str]] = None):
+        self.built_at = float(built_at)
+        self.watermarks = dict(watermarks or {})
+        self.synced_at = self.built_at
+        self.sync_lock = threading.Lock()
+        codes: Dict[str, Dict[str, List[int]]] = {}
+        for col, values in vocab.items():
+            for code, value in enumerate(values):
+                codes.setdefault(col, {}).setdefault(value.lower(), []).append(code)
+        self._publish(np.asarray(ids, dtype=np.str_), columns, vocab, codes)
+
+    def _publish(self, ids: np.ndarray, columns: Dict[str, np.ndarray],
+                 vocab: Dict[str, List[str]], codes: Dict[str, Dict[str, List[int]]]):
+        """Index a new version of the arrays, then swap it in with its vocabulary in one assignment"""
+        row_by_id = {pid: row for row, pid in enumerate(ids.tolist())}
+        self._rows = (ids, columns, row_by_id, vocab, codes)
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._rows[0]
+
+    @property
+    def columns(self) -> Dict[str, np.ndarray]:
+        return self._rows[1]
+
+    @property
+    def vocab(self) -> Dict[str, List[str]]:
+        return self._rows[3]
+
+    def pinned(self) -> "FeatureSnapshot":
+        """
+        Read-only view of the current version, for callers that map row
+        numbers from one call (filter) to another (ids, listing_features)
+        while a sync may swap in new arrays
+        """
+        return copy.copy(self)
+
+    @staticmethod
+    def _code(vocab: Dict[str, List[str]], codes: Dict[str, Dict[str, List[int]]], col: str, value: str) -> int:
+        """Category code for value, extending vocab and codes (unpublished copies) for unseen values"""
+        values = vocab.setdefault(col, [])
+        matches = codes.setdefault(col, {}).setdefault(value.lower(), [])
+        for code in matches:
+            if values[code] == value:
+                return code
+        values.append(value)
+        matches.append(len(values) - 1)
+        return len(values) - 1
+
+    def __len__(self) -> int:
+        return self._rows[0].shape[0]
+
+    def age_seconds(self) -> float:
+        return time.time() - self.built_at
+
+    def rows_for(self, property_ids: Sequence[str]) -> np.ndarray:
+        """Row numbers for property_ids (-1 where the property is not in the snapshot)"""
+        row_by_id = self._rows[2]
+        return np.asarray([row_by_id.get(str(pid), -1) for pid in property_ids], dtype=np.intp)
+
+    @staticmethod
+    def _category_mask(column: np.ndarray, by_value: Dict[str, List[int]], values: Sequence[str]) -> np.ndarray:
+        codes = [code for v in values if v for code in by_value.get(v.lower(), [])]
+        return np.isin(column, np.asarray(codes, dtype=np.int32))
+
+    def filter(self, min_price: float = 0, max_price: float = None, min_beds: float = 0,
+               min_baths: float = 0, property_types: Sequence[str] = None,
+               cities: Sequence[str] = None, exclude_ids: Sequence[str] = None,
+               center: Optional[Tuple[float, float]] = None,
+               radius_miles: float = None,
+               property_ids: Sequence[str] = None) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """
+        Rows matching the same filters fetch_properties_from_supabase applies
+        (among property_ids only, when given).
+
+        Returns (rows, distances); with center + radius_miles rows are
+        nearest first and distances are in miles, otherwise distances is None.
+        """
+        ids, c, row_by_id, _, codes = self._rows
+        mask = np.ones(ids.shape[0], dtype=bool)
+        if min_price and min_price > 0:
+            mask &= c["price"] >= min_price
+        if max_price is not None and max_price < 999999999:
+            mask &= c["price"] <= max_price
+        if min_beds and min_beds > 0:
+            mask &= c["bedrooms"] >= min_beds
+        if min_baths and min_baths > 0:
+            mask &= c["bathrooms"] >= min_baths
+        if property_types:
+            mask &= self._category_mask(c["propertyType"], codes.get("propertyType", {}), property_types)
+        if cities:
+            mask &= self._category_mask(c["city"], codes.get("city", {}), cities)
+        if exclude_ids:
+            excluded = [row_by_id[str(pid)] for pid in exclude_ids if str(pid) in row_by_id]
+            mask[excluded] = False
+        if property_ids is not None:
+            only = np.zeros_like(mask)
+            only[[row_by_id[str(pid)] for pid in property_ids if str(pid) in row_by_id]] = True
+            mask &= only
+
+        rows = np.flatnonzero(mask)
+        if not (center and radius_miles):
+            return rows, None
+
+        dists = haversine_miles_vec(c["latitude"][rows], c["longitude"][rows], center[0], center[1])
+        keep = dists <= radius_miles  # NaN coordinates drop out here
+        rows, dists = rows[keep], dists[keep]
+        order = np.argsort(dists, kind="stable")
+        return rows[order], dists[order]
+
+    def amenity_matches(self, rows: np.ndarray, must_haves: Sequence[str]) -> np.ndarray:
+        """Number of requested must-have amenities each row mentions"""
+        matches = np.zeros(rows.shape[0], dtype=np.int32)
+        for col in must_have_amenities(must_haves):
+            matches += np.asarray(self.columns[col][rows], dtype=np.int32)
+        return matches
+
+    def listing_features(self, row: int) -> Dict[str, Any]:
+        """Enrichment fields for one row, in the shape the scorers expect"""
+        c = self.columns
+
+        def value(col):
+            v = float(c[col][row])
+            return None if np.isnan(v) else v
+
+        features = {
+            "avg_school_rating": value("avg_school_rating") or 0,
+            "closest_school_miles": value("closest_school_miles"),
+            "poi_min_miles": {k: value(f"poi_{k}_miles") for k in POI_KEYS},
+            "poi_counts": {k: int(value(f"poi_{k}_count") or 0) for k in POI_KEYS},
+        }
+        for col in SCHOOL_LEVEL_COLUMNS + PIM_COLUMNS:
+            features[col] = value(col)
+        return features
+
+    # ------------------- Delta updates -------------------
+    def _encode(self, records: List[Dict[str, Any]], vocab: Dict[str, List[str]],
+                codes: Dict[str, Dict[str, List[int]]]) -> Dict[str, np.ndarray]:
+        columns = {col: np.asarray([r[col] for r in records], dtype=np.float64) for col in NUMERIC_COLUMNS}
+        for col in FLAG_COLUMNS:
+            columns[col] = np.asarray([r[col] for r in records], dtype=bool)
+        for col in CATEGORY_COLUMNS:
+            columns[col] = np.asarray([self._code(vocab, codes, col, r[col]) for r in records], dtype=np.int32)
+        return columns
+
+    def apply_delta(self, records: List[Dict[str, Any]], removed_ids: Sequence[str] = ()) -> Dict[str, int]:
+        """
+        Patch changed records (from snapshot_features) and removals into the arrays.
+
+        Changed rows are written into copies of the columns, new rows are
+        appended and removed rows dropped; the new version is indexed and
+        then swapped in with a single assignment, so concurrent readers see
+        one version or the other. Returns {"updated", "added", "removed"}
+        counts.
+        """
+        ids, columns, row_by_id, vocab, codes = self._rows
+        latest = {r["id"]: r for r in records}  # last version of each id wins
+        removed_rows = self.rows_for([pid for pid in removed_ids if pid not in latest])
+        removed_rows = removed_rows[removed_rows >= 0]
+
+        updates = [(row_by_id[pid], r) for pid, r in latest.items() if pid in row_by_id]
+        added = [r for pid, r in latest.items() if pid not in row_by_id]
+        if not (updates or added or removed_rows.size):
+            return {"updated": 0, "added": 0, "removed": 0}
+
+        if updates or added:
+            # Unseen category values extend copies, published with the arrays
+            vocab = {col: list(values) for col, values in vocab.items()}
+            codes = {col: {v: list(c) for v, c in by_value.items()} for col, by_value in codes.items()}
+
+        if updates:
+            rows = np.asarray([row for row, _ in updates], dtype=np.intp)
+            columns = dict(columns)
+            for col, values in self._encode([r for _, r in updates], vocab, codes).items():
+                columns[col] = np.array(columns[col])
+                columns[col][rows] = values
+
+        if added or removed_rows.size:
+            keep = np.ones(ids.shape[0], dtype=bool)
+            keep[removed_rows] = False
+            new_columns = self._encode(added, vocab, codes) if added else None
+            columns = {
+                col: np.concatenate([np.asarray(array)[keep], new_columns[col]]) if added else np.asarray(array)[keep]
+                for col, array in columns.items()
+            }
+            ids = ids[keep]
+            if added:
+                ids = np.concatenate([ids, np.asarray([r["id"] for r in added], dtype=np.str_)])
+
+        self._publish(ids, columns, vocab, codes)
+        return {"updated": len(updates), "added": len(added), "removed": int(removed_rows.size)}
+
+    # ------------------- Persistence -------------------
+    def save(self, path: str) -> str:
+        """Write a new generation under path and publish it; returns the generation dir"""
+        generation = f"{int(time.time() * 1000)}"
+        gen_dir = os.path.join(path, generation)
+        os.makedirs(gen_dir, exist_ok=True)
+
+        ids, columns, _, vocab, _ = self._rows
+        np.save(os.path.join(gen_dir, "ids.npy"), ids)
+        for name, array in columns.items():
+            np.save(os.path.join(gen_dir, f"{name}.npy"), np.asarray(array))
+        with open(os.path.join(gen_dir, "meta.json"), "w") as f:
+            json.dump({"built_at": self.built_at, "count": ids.shape[0], "vocab": vocab,
+                       "columns": sorted(columns), "watermarks": self.watermarks}, f)
+
+        tmp_path = os.path.join(path, "CURRENT.tmp")
+        with open(tmp_path, "w") as f:
+            f.write(generation)
+        os.replace(tmp_path, os.path.join(path, "CURRENT"))
+
+        generations = sorted(d for d in os.listdir(path) if d.isdigit())
+        for old in generations[:-KEEP_GENERATIONS]:
+            shutil.rmtree(os.path.join(path, old), ignore_errors=True)
+        return gen_dir
+
+    @classmethod
+    def load(cls, path: str) -> "FeatureSnapshot":
+        """
+        Open the current generation memory-mapped.
+
+        Columns are mapped copy-on-write: delta sync patches touch private
+        pages only, never the shared files.
+        """
+        with open(os.path.join(path, "CURRENT")) as f:
+            gen_dir = os.path.join(path, f.read().strip())
+        with open(os.path.join(gen_dir, "meta.json")) as f:
+            meta = json.load(f)
+        ids = np.load(os.path.join(gen_dir, "ids.npy"), allow_pickle=False)
+        columns = {
+            name: np.load(os.path.join(gen_dir, f"{name}.npy"), mmap_mode="c")
+            for name in meta["columns"]
+        }
+        # Generations written before a column was added get it as all-missing
+        count = ids.shape[0]
+        for name in NUMERIC_COLUMNS:
+            columns.setdefault(name, np.full(count, np.nan))
+        for name in FLAG_COLUMNS:
+            columns.setdefault(name, np.zeros(count, dtype=bool))
+        return cls(ids, columns, meta["vocab"], meta["built_at"], meta.get("watermarks"))
+
+
+def build_feature_snapshot(listings: List[Dict[str, Any]],
+                           watermarks: Dict[str, Optional[str]] = None) -> FeatureSnapshot:
+    """Snapshot from enriched, normalized listings"""
+    snapshot = FeatureSnapshot(np.asarray([], dtype=np.str_), {}, {}, time.time(), watermarks)
+    records = [snapshot_features(listing) for listing in listings]
+    # Sorted vocabularies keep codes stable across rebuilds of the same catalog
+    vocab: Dict[str, List[str]] = {}
+    codes: Dict[str, Dict[str, List[int]]] = {}
+    for col in CATEGORY_COLUMNS:
+        for value in sorted({r[col] for r in records}):
+            FeatureSnapshot._code(vocab, codes, col, value)
+    snapshot._publish(np.asarray([r["id"] for r in records], dtype=np.str_),
+                      snapshot._encode(records, vocab, codes), vocab, codes)
+    return snapshot
+
+
+# ------------------- Delta sync -------------------
+PrepareFn = Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]
+
+
+def utc_now_iso(margin_seconds: float = 0) -> str:
+    return (datetime.now(timezone.utc) - timedelta(seconds=margin_seconds)).isoformat()
+
+
+def _parse_ts(value: str) -> Optional[datetime]:
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _after(query, column: str, ts: Optional[str], last_id: Optional[str]):
+    """Filter query to rows after the (column, id) keyset cursor"""
+    if not ts:
+        return query
+    if last_id is None:
+        return query.gt(column, ts)
+    # Quoted: timestamps contain ':' and '.', which PostgREST's or syntax reserves
+    return query.or_(f'{column}.gt."{ts}",and({column}.eq."{ts}",id.gt."{last_id}")')
+
+
+def sync_snapshot(snapshot: FeatureSnapshot, supabase, select_columns: str, prepare: PrepareFn,
+                  page_size: int = SYNC_PAGE_SIZE) -> Dict[str, Any]:
+    """
+    Pull changes since the snapshot's watermarks and patch them in.
+
+    Changed rows come from properties past the (updated_at, id) watermark
+    (oldest first, paged), removals from property_deletions. prepare must turn raw rows
+    into enriched, normalized listings the same way the request path does.
+
+    Returns stats: updated / added / removed counts, lag_seconds (age of the
+    oldest change that was missing), rows_per_sec and the new watermarks.
+    """
+    started = time.time()
+    updated_since = snapshot.watermarks.get("updated_at")
+    deleted_since = snapshot.watermarks.get("deleted_at")
+
+    # Keyset pagination on (updated_at, id): rows updated mid-sync move past
+    # the cursor instead of shifting later pages, and rows sharing a
+    # timestamp across a page boundary (bulk backfills) are not skipped
+    changed_rows: List[Dict[str, Any]] = []
+    cursor = (updated_since, snapshot.watermarks.get("updated_id"))
+    while True:
+        query = supabase.table("properties").select(f"{select_columns}, updated_at")
+        query = _after(query, "updated_at", *cursor)
+        page = query.order("updated_at").order("id").limit(page_size).execute().data or []
+        changed_rows.extend(page)
+        if len(page) < page_size or not page[-1].get("updated_at"):
+            break
+        cursor = (page[-1]["updated_at"], page[-1]["id"])
+
+    removed_ids: List[str] = []
+    deletions: List[Dict[str, Any]] = []
+    try:
+        query = supabase.table("property_deletions").select("property_id, deleted_at")
+        if deleted_since:
+            query = query.gt("deleted_at", deleted_since)
+        deletions = query.execute().data or []
+        removed_ids = [str(d["property_id"]) for d in deletions]
+    except Exception as e:
+        logs.warning("Feature Snapshot", f"Could not fetch deletions (migration 0014 applied?): {e}")
+
+    records = [snapshot_features(listing) for listing in prepare(changed_rows)] if changed_rows else []
+    counts = snapshot.apply_delta(records, removed_ids)
+
+    timestamps = [r["updated_at"] for r in changed_rows if r.get("updated_at")]
+    if timestamps:
+        # Rows come ordered by (updated_at, id): the last one is the new cursor
+        last = [r for r in changed_rows if r.get("updated_at")][-1]
+        snapshot.watermarks["updated_at"] = last["updated_at"]
+        snapshot.watermarks["updated_id"] = str(last["id"])
+    deleted_at = [d["deleted_at"] for d in deletions if d.get("deleted_at")]
+    if deleted_at:
+        snapshot.watermarks["deleted_at"] = max(deleted_at)
+
+    oldest = min(filter(None, (_parse_ts(t) for t in timestamps + deleted_at)), default=None)
+    lag = (datetime.now(timezone.utc) - oldest).total_seconds() if oldest else 0.0
+    elapsed = time.time() - started
+    snapshot.synced_at = time.time()
+
+    stats = dict(counts, lag_seconds=lag, seconds=elapsed,
+                 rows_per_sec=(len(changed_rows) + len(removed_ids)) / elapsed if elapsed > 0 else 0.0,
+                 watermarks=dict(snapshot.watermarks))
+    logs.info("Feature Snapshot", f"Synced {counts['updated']} updated, {counts['added']} added, "
+                                  f"{counts['removed']} removed in {elapsed:.2f}s "
+                                  f"({stats['rows_per_sec']:.0f} rows/s, lag {lag:.0f}s)")
+    return stats
+
+
+def sync_if_due(snapshot: FeatureSnapshot, supabase, select_columns: str, prepare: PrepareFn,
+                interval_seconds: float) -> bool:
+    """
+    Start sync_snapshot in a background thread when the last sync is older
+    than interval_seconds; returns whether one was started.
+
+    Never blocks the caller: requests keep reading the current arrays while
+    the sync (including prepare's enrichment calls) runs, and pick up the
+    new version once it is swapped in. At most one sync runs per snapshot.
+    Sync errors are logged, not raised.
+    """
+    if interval_seconds <= 0 or time.time() - snapshot.synced_at < interval_seconds:
+        return False
+    if not snapshot.sync_lock.acquire(blocking=False):
+        return False
+
+    def run():
+        try:
+            sync_snapshot(snapshot, supabase, select_columns, prepare)
+        except Exception as e:
+            logs.warning("Feature Snapshot", f"Delta sync failed: {e}")
+            snapshot.synced_at = time.time()  # Retry after the next interval, not on every request
+        finally:
+            snapshot.sync_lock.release()
+
+    threading.Thread(target=run, name="feature-snapshot-sync", daemon=True).start()
+    return True
+
+
+# ------------------- Per-instance cache -------------------
+_snapshot_cache: Dict[str, Tuple[float, FeatureSnapshot]] = {}
+
+
+def get_feature_snapshot(path: Optional[str]) -> Optional[FeatureSnapshot]:
+    """
+    Open the snapshot at path once per instance.
+
+    A newly published generation is picked up when CURRENT changes.
+    Returns None when no snapshot is configured or it cannot be read.
+    """
+    if not path:
+        return None
+    try:
+        mtime = os.path.getmtime(os.path.join(path, "CURRENT"))
+    except OSError:
+        return None
+
+    cached = _snapshot_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    try:
+        snapshot = FeatureSnapshot.load(path)
+    except Exception as e:
+        logs.warning("Feature Snapshot", f"Could not load snapshot {path}: {e}")
+        return cached[1] if cached else None
+
+    _snapshot_cache[path] = (mtime, snapshot)
+    logs.info("Feature Snapshot", f"Loaded {path} ({len(snapshot)} properties, "
+                                  f"age {snapshot.age_seconds() / 3600:.1f}h)")
+    return snapshot
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build or delta-sync the property feature snapshot")
+    parser.add_argument("--out", required=True, help="Output directory")
+    parser.add_argument("--sync", action="store_true", help="Apply changes since the current generation")
+    parser.add_argument("--page-size", type=int, default=SYNC_PAGE_SIZE)
+    args = parser.parse_args()
+
+    from recommend import PROPERTY_COLUMNS, prepare_snapshot_listings, supabase
+
+    if not supabase:
+        raise SystemExit("SUPABASE_URL / SUPABASE_SERVICE_ROLE_KEY not configured")
+
+    started = time.time()
+    if args.sync:
+        snapshot = FeatureSnapshot.load(args.out)
+        sync_snapshot(snapshot, supabase, PROPERTY_COLUMNS, prepare_snapshot_listings, page_size=args.page_size)
+    else:
+        # Anything changed after the scan starts (minus clock-skew margin) is
+        # re-applied by the next sync; applying a row twice is harmless
+        build_started = utc_now_iso(margin_seconds=60)
+        listings, start = [], 0
+        while True:
+            page = supabase.table("properties").select(PROPERTY_COLUMNS).order("id").range(
+                start, start + args.page_size - 1
+            ).execute().data or []
+            listings.extend(prepare_snapshot_listings(page))
+            if len(page) < args.page_size:
+                break
+            start += args.page_size
+        snapshot = build_feature_snapshot(listings, {"updated_at": build_started, "deleted_at": build_started})
+
+    gen_dir = snapshot.save(args.out)
+    print(f"[Feature Snapshot] Saved {len(snapshot)} properties in {time.time() - started:.1f}s -> {gen_dir}")
@@ -0,0 +1,108 @@
+"""
+Vectorized geo utilities shared by the recommendation APIs.
+
+All functions take array-likes of decimal degrees and return distances in
+miles. Inputs broadcast like regular NumPy arithmetic, so one call covers a
+whole batch of listings instead of a Python loop of scalar haversine calls.
+"""
+
+from typing import Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+EARTH_RADIUS_MILES = 3958.7613
+
+ArrayLike = Union[float, Sequence[float], np.ndarray]
+
+
+def haversine_miles_vec(lat1: ArrayLike, lon1: ArrayLike,
+                        lat2: ArrayLike, lon2: ArrayLike) -> np.ndarray:
+    """Element-wise (broadcasting) haversine distance in miles"""
+    phi1 = np.radians(np.asarray(lat1, dtype=np.float64))
+    phi2 = np.radians(np.asarray(lat2, dtype=np.float64))
+    dphi = phi2 - phi1
+    dlambda = np.radians(np.asarray(lon2, dtype=np.float64) - np.asarray(lon1, dtype=np.float64))
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def distance_matrix_miles(lat_a: ArrayLike, lon_a: ArrayLike,
+                          lat_b: ArrayLike, lon_b: ArrayLike) -> np.ndarray:
+    """
+    Pairwise distances between point sets A (n) and B (m).
+
+    Returns an (n, m) matrix where [i, j] is the distance from A[i] to B[j].
+    """
+    lat_a = np.asarray(lat_a, dtype=np.float64).reshape(-1, 1)
+    lon_a = np.asarray(lon_a, dtype=np.float64).reshape(-1, 1)
+    lat_b = np.asarray(lat_b, dtype=np.float64).reshape(1, -1)
+    lon_b = np.asarray(lon_b, dtype=np.float64).reshape(1, -1)
+    return haversine_miles_vec(lat_a, lon_a, lat_b, lon_b)
+
+
+def min_distance_miles(lat_a: ArrayLike, lon_a: ArrayLike,
+                       lat_b: ArrayLike, lon_b: ArrayLike) -> np.ndarray:
+    """
+    Distance from each point in A to its nearest point in B.
+
+    Returns an (n,) array; all NaN when B is empty.
+    """
+    lat_a = np.asarray(lat_a, dtype=np.float64).reshape(-1)
+    if np.size(lat_b) == 0:
+        return np.full(lat_a.shape[0], np.nan)
+    return distance_matrix_miles(lat_a, lon_a, lat_b, lon_b).min(axis=1)
+
+
+def group_min(values: np.ndarray, groups: np.ndarray, n_groups: int) -> np.ndarray:
+    """
+    Minimum of values per group id in [0, n_groups).
+
+    Groups without any value are NaN.
+    """
+    out = np.full(n_groups, np.inf)
+    if len(values):
+        np.minimum.at(out, np.asarray(groups, dtype=np.intp), np.asarray(values, dtype=np.float64))
+    out[np.isinf(out)] = np.nan
+    return out
+
+
+def grouped_min_distance_miles(src_lat: ArrayLike, src_lon: ArrayLike,
+                               dst_lat: ArrayLike, dst_lon: ArrayLike,
+                               groups: ArrayLike, n_groups: int) -> np.ndarray:
+    """
+    Per-group minimum of paired distances src[k] -> dst[k].
+
+    Used for batches where each (listing, POI type) slot has its own set of
+    candidate places: all pairs are flattened into one array with their slot
+    id in groups, measured in a single call, then reduced per slot.
+    """
+    dists = haversine_miles_vec(src_lat, src_lon, dst_lat, dst_lon)
+    return group_min(np.atleast_1d(dists), np.asarray(groups), n_groups)
+
+
+def polygon_to_geojson(polygon: Sequence[Sequence[float]]) -> dict:
+    """
+    Convert a [(lat, lng), ...] ring to a closed GeoJSON Polygon geometry.
+
+    GeoJSON orders coordinates as [lng, lat].
+    """
+    ring = [[float(lng), float(lat)] for lat, lng in polygon]
+    if len(ring) < 3:
+        raise ValueError("Polygon needs at least 3 points")
+    if ring[0] != ring[-1]:
+        ring.append(ring[0])
+    return {"type": "Polygon", "coordinates": [ring]}
+
+
+def parse_lat_lng(value) -> Optional[Tuple[float, float]]:
+    """Accept {"lat", "lng"} / {"latitude", "longitude"} / [lat, lng] request values"""
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        lat = value.get("lat", value.get("latitude"))
+        lng = value.get("lng", value.get("longitude"))
+    else:
+        lat, lng = value
+    if lat is None or lng is None:
+        return None
+    return float(lat), float(lng)
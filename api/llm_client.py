@@ -0,0 +1,265 @@
+"""
+Shared LLM call layer for preference parsing and listing scoring.
+
+Every call asks for JSON-schema structured output, and replies are parsed
+defensively (markdown fences, surrounding prose, truncated JSON). Replies
+are then validated against what was asked for:
+
+- scoring keeps every valid (idx, score) pair it can recover and re-asks
+  only for the listings still missing, until LLM_MAX_RETRIES or the
+  request's deadline runs out; callers fall back to rule scores for the rest
+- preference parsing coerces each field and drops invalid ones, so a bad
+  field costs that field, not the request
+
+Nothing here raises on a bad or missing reply; failures are logged and
+reported as missing results.
+"""
+
+import json
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from llm_prompt import TokenUsage, build_score_prompts, max_completion_tokens
+import logs
+from tracing import count_call, span
+
+LLM_MODEL = os.environ.get("LLM_MODEL", "gpt-4o-mini")
+LLM_DEADLINE_SECONDS = float(os.environ.get("LLM_DEADLINE_SECONDS", "25"))
+LLM_CALL_TIMEOUT = float(os.environ.get("LLM_CALL_TIMEOUT", "15"))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "1"))
+MIN_CALL_SECONDS = 1.0  # don't start a call with less time than this left
+
+_FENCE_RE = re.compile(r"^```[a-zA-Z]*\s*|\s*```$")
+_PAIR_RE = re.compile(r'"idx"\s*:\s*(\d+)\s*,\s*"score"\s*:\s*(-?\d+(?:\.\d+)?)')
+_MAP_PAIR_RE = re.compile(r'"(\d+)"\s*:\s*(-?\d+(?:\.\d+)?)')
+
+SCORES_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "scores": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"idx": {"type": "integer"}, "score": {"type": "number"}},
+                "required": ["idx", "score"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["scores"],
+    "additionalProperties": False,
+}
+
+# Preferences fields: (JSON type, nullable)
+PREFERENCE_FIELDS = {
+    "budget_min": ("integer", False),
+    "budget_max": ("integer", False),
+    "min_beds": ("integer", False),
+    "min_baths": ("number", False),
+    "min_sqft": ("integer", False),
+    "min_lot_size": ("number", False),
+    "must_haves": ("array", False),
+    "nice_to_haves": ("array", False),
+    "preferred_areas": ("array", False),
+    "property_types": ("array", False),
+    "commute_address": ("string", True),
+    "commute_mode": ("string", False),
+    "max_commute_minutes": ("integer", True),
+}
+COMMUTE_MODES = ("driving", "transit", "bicycling", "walking")
+
+
+def _field_schema(json_type: str, nullable: bool) -> Dict[str, Any]:
+    schema: Dict[str, Any] = {"type": [json_type, "null"] if nullable else json_type}
+    if json_type == "array":
+        schema["items"] = {"type": "string"}
+    return schema
+
+
+PREFERENCES_SCHEMA = {
+    "type": "object",
+    "properties": {name: _field_schema(*spec) for name, spec in PREFERENCE_FIELDS.items()},
+    "required": list(PREFERENCE_FIELDS),
+    "additionalProperties": False,
+}
+
+
+class Deadline:
+    """Wall-clock budget shared by all LLM calls of one request"""
+
+    def __init__(self, seconds: float = None):
+        self.expires_at = time.monotonic() + (LLM_DEADLINE_SECONDS if seconds is None else seconds)
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() < MIN_CALL_SECONDS
+
+
+def parse_json_reply(text: str) -> Optional[Any]:
+    """JSON value from a model reply, tolerating fences and surrounding prose; None if unparseable"""
+    text = _FENCE_RE.sub("", (text or "").strip())
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    start, end = text.find("{"), text.rfind("}")
+    if 0 <= start < end:
+        try:
+            return json.loads(text[start:end + 1])
+        except ValueError:
+            pass
+    return None
+
+
+def call_json(client, prompt: str, schema: Dict[str, Any], schema_name: str,
+              deadline: Deadline, usage: TokenUsage = None, max_tokens: int = None):
+    """
+    One structured-output chat completion.
+
+    Returns (parsed JSON or None, raw reply text). Returns (None, "") when
+    the call itself fails or there is no time left.
+    """
+    if deadline.expired():
+        logs.warning("LLM", "Deadline reached, skipping %s call", schema_name)
+        return None, ""
+    kwargs = {}
+    if max_tokens:
+        kwargs["max_tokens"] = max_tokens
+    count_call("openai")
+    try:
+        with span("openai.chat", schema=schema_name):
+            response = client.chat.completions.create(
+                model=LLM_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.0,
+                response_format={
+                    "type": "json_schema",
+                    "json_schema": {"name": schema_name, "schema": schema, "strict": True},
+                },
+                timeout=min(LLM_CALL_TIMEOUT, deadline.remaining()),
+                **kwargs
+            )
+    except Exception as e:
+        logs.warning("LLM", "%s call failed: %s", schema_name, e)
+        return None, ""
+
+    if usage is not None:
+        usage.add(response)
+    text = response.choices[0].message.content or ""
+    return parse_json_reply(text), text
+
+
+# ------------------- Listing scores -------------------
+def extract_scores(parsed: Any, raw_text: str, valid: Sequence[int]) -> Dict[int, float]:
+    """
+    Valid idx -> score pairs from a scoring reply.
+
+    Accepts the schema shape ({"scores": [{"idx", "score"}]}) and the older
+    {"idx": score} map; when the JSON is broken (e.g. cut off at max_tokens)
+    complete pairs are recovered from the raw text. Scores are clamped to
+    0-100; unknown indices and non-numeric scores are dropped.
+    """
+    pairs: List[tuple] = []
+    if isinstance(parsed, dict) and isinstance(parsed.get("scores"), list):
+        pairs = [(item.get("idx"), item.get("score")) for item in parsed["scores"] if isinstance(item, dict)]
+    elif isinstance(parsed, dict):
+        pairs = list(parsed.items())
+    else:
+        pairs = _PAIR_RE.findall(raw_text) or _MAP_PAIR_RE.findall(raw_text)
+
+    allowed = set(valid)
+    scores: Dict[int, float] = {}
+    for idx, score in pairs:
+        try:
+            idx, score = int(idx), float(score)
+        except (TypeError, ValueError):
+            continue
+        if idx in allowed and score == score:  # drop NaN
+            scores[idx] = min(100.0, max(0.0, score))
+    return scores
+
+
+def score_listings(client, prefs, listings: Sequence[Dict[str, Any]], deadline: Deadline = None,
+                   usage: TokenUsage = None, max_retries: int = None) -> Dict[int, float]:
+    """
+    LLM scores by listing position; listings without a valid score are absent.
+
+    After the first pass only the listings that are still missing are sent
+    again (as a fresh, smaller prompt), up to max_retries extra passes.
+    """
+    deadline = deadline or Deadline()
+    retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+    scores: Dict[int, float] = {}
+    pending = list(range(len(listings)))
+
+    for attempt in range(retries + 1):
+        if not pending or deadline.expired():
+            break
+        if attempt:
+            logs.info("LLM", "Retrying %d unscored listings (attempt %d)", len(pending), attempt + 1)
+        subset = [listings[i] for i in pending]
+        for prompt, positions in build_score_prompts(prefs, subset):
+            parsed, text = call_json(client, prompt, SCORES_SCHEMA, "listing_scores", deadline,
+                                     usage=usage, max_tokens=max_completion_tokens(len(positions)))
+            for position, score in extract_scores(parsed, text, positions).items():
+                scores[pending[position]] = score
+        pending = [i for i in pending if i not in scores]
+
+    if pending:
+        logs.warning("LLM", "No valid score for %d/%d listings", len(pending), len(listings))
+    return scores
+
+
+# ------------------- Preferences -------------------
+def _coerce(value: Any, json_type: str, nullable: bool):
+    if value is None:
+        if nullable:
+            return None
+        raise ValueError("null")
+    if json_type == "integer":
+        return int(float(value))
+    if json_type == "number":
+        return float(value)
+    if json_type == "array":
+        if isinstance(value, str):
+            value = [value]
+        return [str(v) for v in value if v not in (None, "")]
+    return str(value)
+
+
+def coerce_preferences(data: Any) -> Dict[str, Any]:
+    """Keep the valid, correctly typed Preferences fields of a parsed reply"""
+    if not isinstance(data, dict):
+        return {}
+    fields: Dict[str, Any] = {}
+    for name, (json_type, nullable) in PREFERENCE_FIELDS.items():
+        if name not in data:
+            continue
+        try:
+            fields[name] = _coerce(data[name], json_type, nullable)
+        except (TypeError, ValueError):
+            logs.warning("LLM", "Dropping invalid preference %s=%r", name, data[name])
+    if fields.get("commute_mode") not in COMMUTE_MODES:
+        fields.pop("commute_mode", None)
+    return fields
+
+
+def parse_preferences(client, prompt: str, deadline: Deadline = None,
+                      usage: TokenUsage = None) -> Optional[Dict[str, Any]]:
+    """
+    Preferences fields extracted by the LLM, or None if it could not be reached.
+
+    A reply that is not valid JSON is retried once (time permitting).
+    """
+    deadline = deadline or Deadline()
+    for attempt in range(2):
+        parsed, _ = call_json(client, prompt, PREFERENCES_SCHEMA, "buyer_preferences", deadline, usage=usage)
+        if isinstance(parsed, dict):
+            return coerce_preferences(parsed)
+        if deadline.expired():
+            break
+    return None
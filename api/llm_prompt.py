@@ -0,0 +1,170 @@
+"""
+Compact prompts and token accounting for LLM listing scoring.
+
+Listings are encoded as one pipe-separated row each (short column names,
+price in $k, description trimmed) instead of a multi-line block per
+property. The prompt is measured before sending: descriptions are trimmed
+step by step until it fits LLM_PROMPT_TOKEN_BUDGET, and if even bare rows
+do not fit, the listings are split into several prompts that each do.
+
+Token counts use tiktoken when installed and a chars/4 estimate otherwise.
+TokenUsage accumulates the provider-reported usage per request.
+"""
+
+import math
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List, Sequence, Tuple
+
+import logs
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")  # gpt-4o family
+except Exception:  # ImportError, or no cached encoding offline
+    _encoding = None
+
+LLM_PROMPT_TOKEN_BUDGET = int(os.environ.get("LLM_PROMPT_TOKEN_BUDGET", "6000"))
+DESCRIPTION_STEPS = (200, 120, 60, 0)  # chars per description, tried in order
+CHUNK_DESCRIPTION_CHARS = 60  # description length used when splitting into chunks
+COMPLETION_TOKENS_PER_LISTING = 12  # '{"idx":12,"score":85},' plus slack
+
+SCORE_HEADER = """You are a real estate expert. Score each property 0-100 for how well it matches the buyer.
+Consider budget fit, location, size, amenities, schools and overall value.
+
+Buyer: {prefs}
+
+Properties (one per line): {columns}
+"""
+
+SCORE_FOOTER = """
+Return JSON with a score for every idx, e.g. {{"scores": [{{"idx": {first}, "score": 85}}]}}"""
+
+LISTING_COLUMNS = "idx|price_k|beds|baths|sqft|lot_sqft|type|year|city|school_avg|notes"
+
+
+def count_tokens(text: str) -> int:
+    """Token count for text (estimate when tiktoken is unavailable)"""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return math.ceil(len(text) / 4)
+
+
+def _clean(value: Any) -> str:
+    return " ".join(str(value).replace("|", "/").split())
+
+
+def preferences_line(prefs) -> str:
+    """One-line buyer summary; empty criteria are omitted"""
+    parts = [f"budget ${prefs.budget_min // 1000:,}k-${prefs.budget_max // 1000:,}k"
+             if prefs.budget_max < 999999999 else f"budget from ${prefs.budget_min // 1000:,}k"]
+    if prefs.min_beds:
+        parts.append(f"beds>={prefs.min_beds}")
+    if prefs.min_baths:
+        parts.append(f"baths>={prefs.min_baths:g}")
+    if prefs.min_sqft:
+        parts.append(f"sqft>={prefs.min_sqft}")
+    if prefs.min_lot_size:
+        parts.append(f"lot>={prefs.min_lot_size:g}")
+    if prefs.must_haves:
+        parts.append("must: " + ", ".join(prefs.must_haves))
+    if prefs.nice_to_haves:
+        parts.append("nice: " + ", ".join(prefs.nice_to_haves))
+    parts.append("areas: " + (", ".join(prefs.preferred_areas) if prefs.preferred_areas else "any"))
+    return "; ".join(parts)
+
+
+def listing_row(index: int, listing: Dict[str, Any], description_chars: int) -> str:
+    """Pipe-separated LISTING_COLUMNS row for one listing"""
+    notes = _clean(listing.get("description") or "")[:description_chars] if description_chars else ""
+    return "|".join([
+        str(index),
+        str(round((listing.get("price") or 0) / 1000)),
+        f"{listing.get('bedrooms') or 0}",
+        f"{listing.get('bathrooms') or 0:g}",
+        str(listing.get("livingArea") or 0),
+        str(listing.get("lotSize") or 0),
+        _clean(listing.get("propertyType") or "-"),
+        str(listing.get("yearBuilt") or "-"),
+        _clean(listing.get("city") or "-"),
+        f"{listing.get('avg_school_rating') or 0:.1f}",
+        notes,
+    ])
+
+
+def _assemble(prefs_text: str, rows: List[str], first_index: int) -> str:
+    return (SCORE_HEADER.format(prefs=prefs_text, columns=LISTING_COLUMNS)
+            + "\n".join(rows)
+            + SCORE_FOOTER.format(first=first_index))
+
+
+def build_score_prompts(prefs, listings: Sequence[Dict[str, Any]],
+                        budget_tokens: int = None) -> List[Tuple[str, List[int]]]:
+    """
+    Prompts covering all listings within budget_tokens each.
+
+    Returns [(prompt, listing indices)]. Row idx values are positions in
+    listings, so replies from every chunk map straight back.
+    """
+    budget = budget_tokens or LLM_PROMPT_TOKEN_BUDGET
+    prefs_text = preferences_line(prefs)
+    overhead = count_tokens(_assemble(prefs_text, [], 0))
+    indices = list(range(len(listings)))
+
+    for chars in DESCRIPTION_STEPS:
+        rows = [listing_row(i, listing, chars) for i, listing in enumerate(listings)]
+        if overhead + sum(count_tokens(row) + 1 for row in rows) <= budget:
+            if chars < DESCRIPTION_STEPS[0]:
+                logs.info("LLM Prompt", f"Trimmed descriptions to {chars} chars to fit {budget} tokens")
+            return [(_assemble(prefs_text, rows, 0), indices)]
+
+    # Still over budget: split into chunks that each fit
+    chunks: List[Tuple[str, List[int]]] = []
+    rows, chunk, used = [], [], overhead
+    for i, listing in enumerate(listings):
+        row = listing_row(i, listing, CHUNK_DESCRIPTION_CHARS)
+        cost = count_tokens(row) + 1
+        if chunk and used + cost > budget:
+            chunks.append((_assemble(prefs_text, rows, chunk[0]), chunk))
+            rows, chunk, used = [], [], overhead
+        rows.append(row)
+        chunk.append(i)
+        used += cost
+    if chunk:
+        chunks.append((_assemble(prefs_text, rows, chunk[0]), chunk))
+    logs.info("LLM Prompt", f"Split {len(listings)} listings into {len(chunks)} prompts of <= {budget} tokens")
+    return chunks
+
+
+def max_completion_tokens(n_listings: int) -> int:
+    return COMPLETION_TOKENS_PER_LISTING * n_listings + 20
+
+
+@dataclass
+class TokenUsage:
+    """Provider-reported token usage accumulated over one request"""
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    calls: int = 0
+
+    def add(self, response) -> "TokenUsage":
+        """Add the usage block of a chat completion response (if any)"""
+        usage = getattr(response, "usage", None)
+        self.calls += 1
+        if usage is not None:
+            self.prompt_tokens += getattr(usage, "prompt_tokens", 0) or 0
+            self.completion_tokens += getattr(usage, "completion_tokens", 0) or 0
+        return self
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def as_dict(self, recommendations: int = 0) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+            "tokens_per_recommendation": round(self.total_tokens / recommendations, 1) if recommendations else None,
+        }
@@ -0,0 +1,149 @@
+"""
+Level-gated, structured logging for the recommendation API.
+
+Lines keep the existing "[Tag] message" shape (or one JSON object per line
+with LOG_FORMAT=json) and carry the request's correlation id. Per-listing
+work is not logged line by line: hot loops call count(tag, outcome) and
+the stage emits a single summary() line such as
+
+    [PIM] 50 properties: cached=31 scored=12 outside_coverage=5 timeout=2 (timeout: p41, p97) rid=3f9c0a1b2c4d
+
+Detail lines use debug() with lazy %-formatting, so a disabled level costs
+one comparison. LOG_SAMPLE_RATE logs that share of requests at DEBUG in
+full, regardless of LOG_LEVEL.
+"""
+
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from threading import Lock
+from typing import Any, Dict, List, Optional
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+LEVELS = {name: level for level, name in LEVEL_NAMES.items()}
+
+LOG_LEVEL = LEVELS.get(os.environ.get("LOG_LEVEL", "INFO").upper(), INFO)
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()  # text | json
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0"))
+LOG_EXAMPLES = 3  # examples kept per aggregated outcome
+
+
+class RequestLog:
+    """Correlation id, effective level and loop aggregates of one request"""
+
+    def __init__(self, request_id: str = None, sampled: bool = False):
+        self.request_id = request_id or uuid.uuid4().hex[:12]
+        self.sampled = sampled
+        self.level = DEBUG if sampled else LOG_LEVEL
+        self.counts: Dict[str, Counter] = {}
+        self.examples: Dict[str, Dict[str, List[str]]] = {}
+        self._lock = Lock()
+
+    def count(self, tag: str, outcome: str, n: int = 1, example: Any = None):
+        with self._lock:
+            self.counts.setdefault(tag, Counter())[outcome] += n
+            if example is not None:
+                kept = self.examples.setdefault(tag, {}).setdefault(outcome, [])
+                if len(kept) < LOG_EXAMPLES:
+                    kept.append(str(example))
+
+    def pop(self, tag: str):
+        with self._lock:
+            return self.counts.pop(tag, None), self.examples.pop(tag, {})
+
+
+_current: ContextVar[Optional[RequestLog]] = ContextVar("request_log", default=None)
+_default = RequestLog(request_id="-")  # outside a request (CLI tools, module import)
+
+
+def current() -> RequestLog:
+    return _current.get() or _default
+
+
+def enabled(level: int) -> bool:
+    """Cheap level check for callers that build expensive log arguments"""
+    return level >= (_current.get() or _default).level
+
+
+class request:
+    """
+    Context manager scoping logs to one request.
+
+    request_id is taken from the caller (e.g. an X-Request-ID header) or
+    generated; a LOG_SAMPLE_RATE share of requests is logged at DEBUG.
+    """
+
+    def __init__(self, request_id: str = None, sampled: bool = None):
+        if sampled is None:
+            sampled = LOG_SAMPLE_RATE > 0 and random.random() < LOG_SAMPLE_RATE
+        self.log = RequestLog(request_id, sampled)
+        self.token = None
+
+    def __enter__(self) -> RequestLog:
+        self.token = _current.set(self.log)
+        return self.log
+
+    def __exit__(self, *exc):
+        _current.reset(self.token)
+        return False
+
+
+def _emit(ctx: RequestLog, level: int, tag: str, message: str, fields: Dict[str, Any]):
+    if LOG_FORMAT == "json":
+        record = {"ts": round(time.time(), 3), "level": LEVEL_NAMES[level], "tag": tag,
+                  "msg": message, "request_id": ctx.request_id, **fields}
+        line = json.dumps(record, default=str)
+    else:
+        prefix = f"[{tag}] " if level < WARNING else f"[{tag}] {LEVEL_NAMES[level]}: "
+        extra = "".join(f" {k}={v}" for k, v in fields.items())
+        line = f"{prefix}{message}{extra} rid={ctx.request_id}"
+    sys.stdout.write(line + "\n")
+
+
+def log(level: int, tag: str, message: str, *args, **fields):
+    ctx = _current.get() or _default
+    if level < ctx.level:
+        return
+    _emit(ctx, level, tag, message % args if args else message, fields)
+
+
+def debug(tag: str, message: str, *args, **fields):
+    log(DEBUG, tag, message, *args, **fields)
+
+
+def info(tag: str, message: str, *args, **fields):
+    log(INFO, tag, message, *args, **fields)
+
+
+def warning(tag: str, message: str, *args, **fields):
+    log(WARNING, tag, message, *args, **fields)
+
+
+def error(tag: str, message: str, *args, **fields):
+    log(ERROR, tag, message, *args, **fields)
+
+
+def count(tag: str, outcome: str, n: int = 1, example: Any = None):
+    """Aggregate one loop outcome for the next summary(tag) line"""
+    (_current.get() or _default).count(tag, outcome, n, example)
+
+
+def summary(tag: str, message: str, *args, level: int = INFO):
+    """Emit (and reset) the aggregated counts of tag as one line; nothing if none were counted"""
+    ctx = _current.get() or _default
+    counts, examples = ctx.pop(tag)
+    if not counts or level < ctx.level:
+        return
+    parts = " ".join(f"{outcome}={n}" for outcome, n in counts.most_common())
+    shown = "; ".join(f"{outcome}: {', '.join(ids)}" for outcome, ids in examples.items())
+    text = (message % args if args else message) + f": {parts}" + (f" ({shown})" if shown else "")
+    if LOG_FORMAT == "json":
+        _emit(ctx, level, tag, text, {"counts": dict(counts)})
+    else:
+        _emit(ctx, level, tag, text, {})
@@ -0,0 +1,283 @@
+"""
+Local POI store for offline nearby / min-distance queries.
+
+A snapshot of schools, supermarkets, parks and transit stations (the
+PLACES_TYPES categories) is pulled from the Google Places API by a periodic
+refresh job and saved as a compressed .npz file. At request time the
+snapshot is loaded once per instance into a uniform lat/lon grid index, so
+the nearby queries used by POI enrichment run locally in microseconds
+instead of one Places call per listing per type.
+
+Refresh (e.g. nightly via Cloud Scheduler):
+    python poi_index.py --bbox 37.70,-122.52,37.83,-122.35 --out /tmp/poi_snapshot.npz
+"""
+
+import math
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import logs
+from geo import haversine_miles_vec
+
+MILES_PER_DEG_LAT = 69.0
+DEFAULT_CELL_DEG = 0.01  # ~0.7 mi
+
+PlacesFn = Callable[..., List[Dict[str, Any]]]
+
+
+class GridIndex:
+    """
+    Uniform lat/lon grid over a static point set.
+
+    Points are sorted by cell key (row-major), so the cells of one grid row
+    that intersect a query circle form a single contiguous key range and are
+    found with one searchsorted pair per row.
+    """
+
+    def __init__(self, lats: Sequence[float], lons: Sequence[float], cell_deg: float = DEFAULT_CELL_DEG):
+        self.lats = np.asarray(lats, dtype=np.float64).reshape(-1)
+        self.lons = np.asarray(lons, dtype=np.float64).reshape(-1)
+        self.cell_deg = cell_deg
+        self._offset = int(math.ceil(180.0 / cell_deg)) + 1
+        self._width = 2 * self._offset + 1
+
+        keys = self._key(self._cell(self.lats), self._cell(self.lons))
+        self._order = np.argsort(keys, kind="stable")
+        self._keys = keys[self._order]
+
+    def __len__(self) -> int:
+        return self.lats.shape[0]
+
+    def _cell(self, deg):
+        return np.floor(np.asarray(deg) / self.cell_deg).astype(np.int64)
+
+    def _key(self, rows, cols):
+        return (rows + self._offset) * self._width + (cols + self._offset)
+
+    def query_radius(self, lat: float, lon: float, radius_miles: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Points within radius_miles of (lat, lon).
+
+        Returns (indices, distances) sorted by distance.
+        """
+        if len(self) == 0:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+
+        dlat = radius_miles / MILES_PER_DEG_LAT
+        dlon = radius_miles / (MILES_PER_DEG_LAT * max(math.cos(math.radians(lat)), 0.01))
+        row_lo, row_hi = int(self._cell(lat - dlat)), int(self._cell(lat + dlat))
+        col_lo, col_hi = int(self._cell(lon - dlon)), int(self._cell(lon + dlon))
+
+        chunks = []
+        for row in range(row_lo, row_hi + 1):
+            lo = np.searchsorted(self._keys, self._key(row, col_lo), side="left")
+            hi = np.searchsorted(self._keys, self._key(row, col_hi), side="right")
+            if hi > lo:
+                chunks.append(self._order[lo:hi])
+
+        if not chunks:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+
+        candidates = np.concatenate(chunks)
+        dists = haversine_miles_vec(lat, lon, self.lats[candidates], self.lons[candidates])
+        mask = dists <= radius_miles
+        candidates, dists = candidates[mask], dists[mask]
+        order = np.argsort(dists, kind="stable")
+        return candidates[order], dists[order]
+
+
+class POIStore:
+    """
+    Snapshot of POIs per PLACES_TYPES key, each with its own GridIndex.
+
+    Args:
+        points: {poi_key: {"lat": array, "lon": array, "id": array}}
+        bbox: (min_lat, min_lon, max_lat, max_lon) covered by the snapshot
+        built_at: Unix timestamp of the refresh that produced the snapshot
+    """
+
+    def __init__(self, points: Dict[str, Dict[str, np.ndarray]],
+                 bbox: Tuple[float, float, float, float], built_at: float,
+                 cell_deg: float = DEFAULT_CELL_DEG):
+        self.points = points
+        self.bbox = tuple(float(v) for v in bbox)
+        self.built_at = float(built_at)
+        self.indexes = {
+            key: GridIndex(p["lat"], p["lon"], cell_deg=cell_deg)
+            for key, p in points.items()
+        }
+
+    def covers(self, lat: float, lon: float) -> bool:
+        """Whether (lat, lon) lies inside the refreshed area"""
+        min_lat, min_lon, max_lat, max_lon = self.bbox
+        return min_lat <= lat <= max_lat and min_lon <= lon <= max_lon
+
+    def age_seconds(self) -> float:
+        return time.time() - self.built_at
+
+    def nearby(self, lat: float, lon: float, poi_key: str, radius_miles: float,
+               max_results: int = 8) -> Tuple[Optional[float], int]:
+        """
+        Local equivalent of a Places searchNearby call ranked by distance.
+
+        Returns (min_distance_miles or None, number of places found capped
+        at max_results), matching what enrichment derived from the API.
+        """
+        index = self.indexes.get(poi_key)
+        if index is None:
+            return None, 0
+        _, dists = index.query_radius(lat, lon, radius_miles)
+        if dists.size == 0:
+            return None, 0
+        return float(dists[0]), int(min(dists.size, max_results))
+
+    def enrich(self, lat: float, lon: float, poi_keys: List[str],
+               places_types: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """Build the {"poi_min_miles", "poi_counts"} dict for one location"""
+        poi_min, poi_counts = {}, {}
+        for k in poi_keys:
+            if k not in places_types:
+                continue
+            poi_min[k], poi_counts[k] = self.nearby(
+                lat, lon, k, places_types[k].get("radius_miles", 2.0)
+            )
+        return {"poi_min_miles": poi_min, "poi_counts": poi_counts}
+
+    # ------------------- Persistence -------------------
+    def save(self, path: str):
+        """Write the snapshot as a compressed .npz (atomic rename)"""
+        arrays = {
+            "meta_bbox": np.asarray(self.bbox, dtype=np.float64),
+            "meta_built_at": np.asarray([self.built_at], dtype=np.float64),
+            "meta_keys": np.asarray(sorted(self.points), dtype=np.str_),
+        }
+        for key, p in self.points.items():
+            arrays[f"{key}__lat"] = np.asarray(p["lat"], dtype=np.float64)
+            arrays[f"{key}__lon"] = np.asarray(p["lon"], dtype=np.float64)
+            arrays[f"{key}__id"] = np.asarray(p["id"], dtype=np.str_)
+
+        tmp_path = f"{path}.tmp.npz"
+        np.savez_compressed(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "POIStore":
+        with np.load(path, allow_pickle=False) as data:
+            points = {
+                str(key): {
+                    "lat": data[f"{key}__lat"],
+                    "lon": data[f"{key}__lon"],
+                    "id": data[f"{key}__id"],
+                }
+                for key in data["meta_keys"]
+            }
+            return cls(points, tuple(data["meta_bbox"]), float(data["meta_built_at"][0]))
+
+
+# ------------------- Per-instance cache -------------------
+_store_cache: Dict[str, Tuple[float, POIStore]] = {}
+
+
+def get_poi_store(path: Optional[str]) -> Optional[POIStore]:
+    """
+    Load the snapshot at path once per instance.
+
+    The file's mtime is checked on each call, so a refreshed snapshot
+    written in place is picked up without a restart. Returns None when
+    no snapshot is configured or it cannot be read.
+    """
+    if not path:
+        return None
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    cached = _store_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    try:
+        store = POIStore.load(path)
+    except Exception as e:
+        logs.warning("POI Index", f"Could not load snapshot {path}: {e}")
+        return cached[1] if cached else None
+
+    _store_cache[path] = (mtime, store)
+    logs.info("POI Index", f"Loaded snapshot {path} "
+                           f"({sum(len(i) for i in store.indexes.values())} POIs, age {store.age_seconds() / 3600:.1f}h)")
+    return store
+
+
+# ------------------- Refresh from Places API -------------------
+def build_poi_snapshot(bbox: Tuple[float, float, float, float],
+                       places_types: Dict[str, Dict[str, Any]],
+                       places_fn: PlacesFn,
+                       spacing_miles: float = 0.5,
+                       max_results: int = 20) -> POIStore:
+    """
+    Refresh a snapshot by tiling bbox with Places nearby searches.
+
+    Each tile center is queried per POI type with a radius that covers the
+    whole tile; results are de-duplicated by place id. Tiles that hit
+    max_results may be truncated by the API - lower spacing_miles for
+    dense areas.
+    """
+    min_lat, min_lon, max_lat, max_lon = bbox
+    mid_lat = (min_lat + max_lat) / 2
+    step_lat = spacing_miles / MILES_PER_DEG_LAT
+    step_lon = spacing_miles / (MILES_PER_DEG_LAT * math.cos(math.radians(mid_lat)))
+    radius = spacing_miles * 0.75  # > half the tile diagonal (0.707)
+
+    centers = [
+        (lat, lon)
+        for lat in np.arange(min_lat, max_lat + step_lat, step_lat)
+        for lon in np.arange(min_lon, max_lon + step_lon, step_lon)
+    ]
+
+    points = {}
+    truncated = 0
+    for key, spec in places_types.items():
+        seen: Dict[str, Tuple[float, float]] = {}
+        for lat, lon in centers:
+            places = places_fn(float(lat), float(lon), spec["includedTypes"], radius, max_results=max_results)
+            if len(places) >= max_results:
+                truncated += 1
+            for p in places:
+                loc = p.get("location", {}) or {}
+                plat, plon = loc.get("latitude"), loc.get("longitude")
+                if plat is None or plon is None:
+                    continue
+                pid = p.get("id") or f"{float(plat):.6f},{float(plon):.6f}"
+                seen[pid] = (float(plat), float(plon))
+
+        ids = list(seen)
+        coords = np.asarray([seen[i] for i in ids], dtype=np.float64).reshape(-1, 2)
+        points[key] = {"lat": coords[:, 0], "lon": coords[:, 1], "id": np.asarray(ids, dtype=np.str_)}
+        print(f"[POI Index] {key}: {len(ids)} places from {len(centers)} tiles")
+
+    if truncated:
+        print(f"[POI Index] Warning: {truncated} tile queries hit max_results={max_results}; "
+              f"consider a smaller spacing")
+
+    return POIStore(points, bbox, time.time())
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Refresh the local POI snapshot from Google Places")
+    parser.add_argument("--bbox", required=True, help="min_lat,min_lon,max_lat,max_lon")
+    parser.add_argument("--out", required=True, help="Output .npz path")
+    parser.add_argument("--spacing-miles", type=float, default=0.5)
+    args = parser.parse_args()
+
+    from recommend import PLACES_TYPES, places_nearby
+
+    box = tuple(float(v) for v in args.bbox.split(","))
+    snapshot = build_poi_snapshot(box, PLACES_TYPES, places_nearby, spacing_miles=args.spacing_miles)
+    snapshot.save(args.out)
+    print(f"[POI Index] Saved snapshot to {args.out}")
@@ -0,0 +1,331 @@
+"""
+Precomputed recommendations for active buyers.
+
+Run nightly (e.g. Cloud Scheduler -> Cloud Run job, or cron):
+
+    python api/precompute.py                      # full_ml engine, all active buyers
+    python api/precompute.py --module recommend_lightweight --workers 8
+    python api/precompute.py --buyer <person id> --full
+
+For each buyer active in the last PRECOMPUTE_ACTIVE_DAYS (profile edited or
+property activity) the buyer's request inputs are rebuilt the way the API
+builds them (profile preferences, interaction lists), then:
+
+- skipped   stored list matches the inputs and the catalog has not changed
+- incremental  inputs unchanged: only listings changed since the stored
+            catalog_version are scored (recommend_hybrid updated_since) and
+            merged into the stored top-N; changed/deleted listings are dropped
+- full      no row, new inputs (preferences or interactions changed), or the
+            last full run is older than PRECOMPUTE_FULL_REFRESH_DAYS
+
+Rows go to precomputed_recommendations (migration 0017). The handlers call
+load_precomputed() and serve a stored list without running the pipeline
+when the request's inputs fingerprint matches and the row is younger than
+PRECOMPUTED_MAX_AGE_HOURS.
+
+Buyers run on a thread pool: the pipeline is dominated by network calls
+(OpenAI, Places, PIM) and the module-level clients are thread-safe.
+Incremental merges compare hybrid scores across runs; for the full_ml
+engine the ML component is refit per run, so merged scores are approximate
+until the next full run.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set
+
+import logs
+from response_cache import request_key
+from tracing import count_call
+
+PRECOMPUTED_RECOMMENDATIONS = os.environ.get("PRECOMPUTED_RECOMMENDATIONS", "true").lower() == "true"
+PRECOMPUTED_MAX_AGE_HOURS = float(os.environ.get("PRECOMPUTED_MAX_AGE_HOURS", "36"))
+PRECOMPUTE_TOP_N = int(os.environ.get("PRECOMPUTE_TOP_N", "50"))
+PRECOMPUTE_ACTIVE_DAYS = float(os.environ.get("PRECOMPUTE_ACTIVE_DAYS", "30"))
+PRECOMPUTE_FULL_REFRESH_DAYS = float(os.environ.get("PRECOMPUTE_FULL_REFRESH_DAYS", "7"))
+PRECOMPUTE_WORKERS = int(os.environ.get("PRECOMPUTE_WORKERS", "4"))
+
+TABLE = "precomputed_recommendations"
+ENGINES = {"recommend": "full_ml", "recommend_lightweight": "lightweight"}
+PAGE_SIZE = 1000
+
+
+def inputs_fingerprint(engine: str, inputs: Dict[str, Any]) -> str:
+    """Fingerprint of a request's inputs, ignoring limit (a stored top-N serves any smaller limit)"""
+    return request_key(engine, **{k: v for k, v in inputs.items() if k not in ("limit", "usage")})
+
+
+def _parse_ts(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        ts = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def _age_hours(value: Optional[str]) -> float:
+    ts = _parse_ts(value)
+    if ts is None:
+        return float("inf")
+    return (datetime.now(timezone.utc) - ts).total_seconds() / 3600.0
+
+
+# ------------------- Serving -------------------
+def load_precomputed(supabase, engine: str, buyer_id: str, inputs: Dict[str, Any],
+                     limit: int) -> Optional[List[Dict[str, Any]]]:
+    """
+    Stored recommendations for this buyer and request, or None if there is
+    no usable row (other inputs, too old, fewer than limit results, table
+    missing).
+    """
+    if not PRECOMPUTED_RECOMMENDATIONS or not supabase or not buyer_id:
+        return None
+    try:
+        count_call("supabase")
+        rows = supabase.table(TABLE).select("inputs_fingerprint, recommendations, computed_at").eq(
+            "buyer_id", buyer_id).eq("engine", engine).limit(1).execute().data or []
+    except Exception as e:
+        logs.warning("Precomputed", "Lookup failed: %s", e)
+        return None
+    if not rows:
+        return None
+    row = rows[0]
+    recommendations = row.get("recommendations") or []
+    if row.get("inputs_fingerprint") != inputs_fingerprint(engine, inputs):
+        logs.info("Precomputed", "Stored list for %s was computed from other inputs", buyer_id)
+        return None
+    if _age_hours(row.get("computed_at")) > PRECOMPUTED_MAX_AGE_HOURS or len(recommendations) < limit:
+        return None
+    logs.info("Precomputed", "Serving %d stored recommendations for %s", limit, buyer_id)
+    return recommendations[:limit]
+
+
+# ------------------- Batch -------------------
+def active_buyers(supabase, active_days: float = PRECOMPUTE_ACTIVE_DAYS) -> List[Dict[str, str]]:
+    """[{"buyer_id", "buyer_profile_id"}] active since active_days ago"""
+    since = (datetime.now(timezone.utc) - timedelta(days=active_days)).isoformat()
+    return supabase.rpc("active_buyer_profiles", {"p_since": since}).execute().data or []
+
+
+def latest_catalog_change(supabase) -> Optional[str]:
+    """Newest properties.updated_at / property_deletions.deleted_at (the catalog version a run covers)"""
+    stamps = []
+    for table, column in (("properties", "updated_at"), ("property_deletions", "deleted_at")):
+        try:
+            rows = supabase.table(table).select(column).order(column, desc=True).limit(1).execute().data or []
+        except Exception as e:
+            logs.warning("Precompute", "Could not read %s.%s: %s", table, column, e)
+            continue
+        if rows and rows[0].get(column):
+            stamps.append(rows[0][column])
+    return max(stamps, key=lambda s: _parse_ts(s) or datetime.min.replace(tzinfo=timezone.utc), default=None)
+
+
+class CatalogChanges:
+    """Listings updated / deleted since a timestamp, fetched once per run and shared by all buyers"""
+
+    def __init__(self, supabase, since: Optional[str]):
+        self.since = since
+        self.updated: Dict[str, datetime] = {}
+        self.deleted: Dict[str, datetime] = {}
+        if since:
+            self.updated = self._fetch(supabase, "properties", "id", "updated_at", since)
+            self.deleted = self._fetch(supabase, "property_deletions", "property_id", "deleted_at", since)
+
+    @staticmethod
+    def _fetch(supabase, table: str, id_column: str, ts_column: str, since: str) -> Dict[str, datetime]:
+        # Keyset pagination on (timestamp, id) (indexed by migration 0014): rows
+        # sharing a timestamp across a page boundary are not skipped
+        out: Dict[str, datetime] = {}
+        query = supabase.table(table).select(f"{id_column}, {ts_column}").gt(ts_column, since)
+        while True:
+            page = query.order(ts_column).order(id_column).limit(PAGE_SIZE).execute().data or []
+            for row in page:
+                out[row[id_column]] = _parse_ts(row[ts_column])
+            if len(page) < PAGE_SIZE or not page[-1].get(ts_column):
+                return out
+            ts, last_id = page[-1][ts_column], page[-1][id_column]
+            # Quoted: timestamps contain ':' and '.', which PostgREST's or syntax reserves
+            query = supabase.table(table).select(f"{id_column}, {ts_column}").or_(
+                f'{ts_column}.gt."{ts}",and({ts_column}.eq."{ts}",{id_column}.gt."{last_id}")')
+
+    def touched_since(self, since: Optional[str]) -> Set[str]:
+        """Ids changed or deleted after since"""
+        ts = _parse_ts(since)
+        if ts is None:
+            return set(self.updated) | set(self.deleted)
+        return ({pid for pid, t in self.updated.items() if t and t > ts} |
+                {pid for pid, t in self.deleted.items() if t and t > ts})
+
+
+def buyer_inputs(module, engine: str, supabase, buyer_id: str, buyer_profile_id: str) -> Optional[Dict[str, Any]]:
+    """
+    The request inputs the API builds for this buyer (profile preferences,
+    interaction lists), so a stored list matches live requests; None if the
+    buyer has no profile.
+    """
+    profile = supabase.table("buyer_profiles").select("*").eq("id", buyer_profile_id).limit(1).execute().data
+    if not profile:
+        return None
+    profile = profile[0]
+    prefs = module.Preferences(
+        budget_min=profile.get("price_min") or 0,
+        budget_max=profile.get("price_max") or 999999999,
+        must_haves=profile.get("must_have_features") or [],
+        nice_to_haves=profile.get("nice_to_have_features") or [],
+        preferred_areas=profile.get("preferred_areas") or [],
+        property_types=profile.get("property_type_preferences") or []
+    )
+    interactions: Dict[str, List[str]] = {"loved": [], "viewing_scheduled": [], "saved": [], "passed": []}
+    rows = supabase.table("buyer_properties").select("property_id, interest_level").eq("buyer_id", buyer_id).execute().data
+    for row in rows or []:
+        if row.get("interest_level") in interactions:
+            interactions[row["interest_level"]].append(row["property_id"])
+
+    inputs: Dict[str, Any] = {
+        "user_prefs_text": profile.get("raw_background") or None,
+        "prefs": prefs,
+        "preferred_areas": None,
+    }
+    if engine == "lightweight":
+        inputs.update(
+            buyer_id=buyer_id,
+            loved_property_ids=interactions["loved"],
+            viewing_scheduled_property_ids=interactions["viewing_scheduled"],
+            saved_property_ids=interactions["saved"],
+            passed_property_ids=interactions["passed"],
+        )
+    else:
+        inputs["loved_property_ids"] = interactions["loved"]
+    inputs.update(search_center=None, radius_miles=None, search_polygon=None)
+    return inputs
+
+
+def _jsonable(module, recommendations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # numpy scalars / NaN -> plain JSON values
+    if hasattr(module, "dumps_json"):
+        return json.loads(module.dumps_json(recommendations))
+    return json.loads(json.dumps(recommendations, default=float))
+
+
+def merge_top_n(stored: List[Dict[str, Any]], fresh: List[Dict[str, Any]], touched: Set[str],
+                top_n: int) -> List[Dict[str, Any]]:
+    """Stored results minus changed/deleted listings, plus freshly scored ones, best first"""
+    fresh_ids = {r.get("id") for r in fresh}
+    kept = [r for r in stored if r.get("id") not in touched and r.get("id") not in fresh_ids]
+    merged = kept + fresh
+    merged.sort(key=lambda r: r.get("hybrid_score") or 0, reverse=True)
+    return merged[:top_n]
+
+
+def precompute_buyer(module, engine: str, supabase, buyer: Dict[str, str], top_n: int,
+                     catalog_version: Optional[str], changes: CatalogChanges, force_full: bool = False) -> str:
+    """Bring one buyer's stored list up to date; returns skipped | incremental | full | no_profile"""
+    buyer_id = buyer["buyer_id"]
+    inputs = buyer_inputs(module, engine, supabase, buyer_id, buyer.get("buyer_profile_id"))
+    if inputs is None:
+        return "no_profile"
+    fingerprint = inputs_fingerprint(engine, inputs)
+
+    stored = supabase.table(TABLE).select("*").eq("buyer_id", buyer_id).eq("engine", engine).limit(1).execute().data
+    stored = stored[0] if stored else None
+    full = (force_full or stored is None or stored.get("inputs_fingerprint") != fingerprint
+            or _age_hours(stored.get("full_run_at")) > PRECOMPUTE_FULL_REFRESH_DAYS * 24)
+
+    now = datetime.now(timezone.utc).isoformat()
+    if full:
+        recommendations = module.recommend_hybrid(**inputs, limit=top_n)
+        row = {"recommendations": _jsonable(module, recommendations), "full_run_at": now}
+        outcome = "full"
+    else:
+        touched = changes.touched_since(stored.get("catalog_version"))
+        if not touched:
+            return "skipped"
+        fresh = module.recommend_hybrid(**inputs, limit=top_n, updated_since=stored.get("catalog_version"))
+        row = {"recommendations": merge_top_n(stored.get("recommendations") or [], _jsonable(module, fresh),
+                                              touched, top_n)}
+        outcome = "incremental"
+
+    row.update({
+        "buyer_id": buyer_id,
+        "engine": engine,
+        "buyer_profile_id": buyer.get("buyer_profile_id"),
+        "inputs_fingerprint": fingerprint,
+        "catalog_version": catalog_version,
+        "computed_at": now,
+    })
+    supabase.table(TABLE).upsert(row, on_conflict="buyer_id,engine").execute()
+    return outcome
+
+
+def run(module, supabase, buyers: List[Dict[str, str]], workers: int = PRECOMPUTE_WORKERS,
+        top_n: int = PRECOMPUTE_TOP_N, force_full: bool = False) -> Dict[str, Any]:
+    """Precompute buyers on a thread pool; returns outcome counts and timing"""
+    engine = ENGINES[module.__name__]
+    start = time.perf_counter()
+    # Read the version first: listings changing during the run are picked up next time
+    catalog_version = latest_catalog_change(supabase)
+    stored_versions = [r.get("catalog_version") for r in
+                       (supabase.table(TABLE).select("catalog_version").eq("engine", engine).execute().data or [])]
+    oldest = min((v for v in stored_versions if v), key=lambda v: _parse_ts(v), default=None)
+    changes = CatalogChanges(supabase, oldest)
+    logs.info("Precompute", "%d buyers, engine=%s, catalog version %s, %d listings changed since %s",
+              len(buyers), engine, catalog_version, len(changes.updated) + len(changes.deleted), oldest)
+
+    outcomes: Counter = Counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="precompute") as pool:
+        futures = {pool.submit(precompute_buyer, module, engine, supabase, buyer, top_n,
+                               catalog_version, changes, force_full): buyer["buyer_id"] for buyer in buyers}
+        for future in as_completed(futures):
+            try:
+                outcomes[future.result()] += 1
+            except Exception as e:
+                outcomes["failed"] += 1
+                logs.count("Precompute", "failed", example=f"{futures[future]}: {e}")
+
+    elapsed = time.perf_counter() - start
+    logs.summary("Precompute", "Failures")
+    report = {"buyers": len(buyers), "seconds": round(elapsed, 1), **outcomes}
+    logs.info("Precompute", "Done in %.1f s: %s", elapsed,
+              ", ".join(f"{k}={v}" for k, v in sorted(outcomes.items())))
+    return report
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Precompute recommendations for active buyers")
+    parser.add_argument("--module", default="recommend", choices=sorted(ENGINES),
+                        help="engine whose handler will serve the stored lists")
+    parser.add_argument("--workers", type=int, default=PRECOMPUTE_WORKERS)
+    parser.add_argument("--top-n", type=int, default=PRECOMPUTE_TOP_N)
+    parser.add_argument("--active-days", type=float, default=PRECOMPUTE_ACTIVE_DAYS)
+    parser.add_argument("--buyer", action="append", help="person id (repeatable); default: all active buyers")
+    parser.add_argument("--full", action="store_true", help="full run for every buyer (ignore stored lists)")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    module = __import__(args.module)
+    if module.supabase is None:
+        sys.exit("SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY must be set")
+    supabase = module.supabase
+
+    if args.buyer:
+        profiles = supabase.table("buyer_profiles").select("id, person_id").in_("person_id", args.buyer).execute().data
+        buyers = [{"buyer_id": p["person_id"], "buyer_profile_id": p["id"]} for p in profiles or []]
+    else:
+        buyers = active_buyers(supabase, args.active_days)
+    report = run(module, supabase, buyers, workers=args.workers, top_n=args.top_n, force_full=args.full)
+    print(json.dumps(report))
+    if report.get("failed"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+On-demand profiling of single recommendation requests.
+
+Off by default. A request is profiled when
+
+- PROFILE_TOKEN is set and the request carries a matching X-Profile
+  header; its response then includes a "profile" summary, or
+- PROFILE_REQUESTS=true (every request; e.g. a staging instance).
+
+A profiled request runs under cProfile (deterministic, calling thread
+only: time spent in worker threads shows up as waiting in the pool) plus
+tracemalloc. The full profile is written to PROFILE_DIR as
+<label>-<request_id>.prof (open with `python -m pstats` or snakeviz)
+together with <label>-<request_id>.alloc.txt listing the top allocation
+sites; request ids taken from X-Request-ID are reduced to a safe file name.
+
+When profiling is off, profile_request() returns a shared no-op context
+manager and nothing else runs.
+"""
+
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import re
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+import logs
+
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PROFILE_REQUESTS = os.environ.get("PROFILE_REQUESTS", "false").lower() == "true"
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "/tmp/profiles")
+PROFILE_TOP = int(os.environ.get("PROFILE_TOP", "25"))  # rows in the returned summary
+TRACEMALLOC_FRAMES = 10
+
+_UNSAFE_NAME_RE = re.compile(r"[^A-Za-z0-9_-]+")
+
+
+def header_requested(header_value: Optional[str]) -> bool:
+    """Whether an X-Profile header value carries the configured token"""
+    return bool(PROFILE_TOKEN and header_value) and hmac.compare_digest(header_value, PROFILE_TOKEN)
+
+
+def safe_file_name(value: str, max_length: int = 64) -> str:
+    """value reduced to letters, digits, '_' and '-' (no separators or dots), at most max_length chars"""
+    return _UNSAFE_NAME_RE.sub("_", str(value or ""))[:max_length].strip("_") or "request"
+
+
+def profiling_wanted(header_value: Optional[str] = None) -> bool:
+    return PROFILE_REQUESTS or header_requested(header_value)
+
+
+class Profile:
+    """Result of one profiled request"""
+
+    def __init__(self, request_id: str, label: str):
+        self.request_id = request_id
+        self.label = label
+        self.wall_ms = 0.0
+        self.profile_path: Optional[str] = None
+        self.alloc_path: Optional[str] = None
+        self.top_functions: List[Dict[str, Any]] = []
+        self.top_allocations: List[Dict[str, Any]] = []
+        self.peak_kb = 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        """Compact payload returned to the caller"""
+        return {
+            "request_id": self.request_id,
+            "wall_ms": round(self.wall_ms, 1),
+            "peak_traced_kb": round(self.peak_kb, 1),
+            "profile_file": self.profile_path,
+            "allocations_file": self.alloc_path,
+            "top_functions": self.top_functions,
+            "top_allocations": self.top_allocations,
+        }
+
+
+class _NoopProfile:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_PROFILE = _NoopProfile()
+
+
+class _ActiveProfile:
+    def __init__(self, label: str):
+        self.result = Profile(logs.current().request_id, label)
+        self.profiler = cProfile.Profile()
+        self.started_tracemalloc = False
+        self.start = 0.0
+
+    def __enter__(self) -> Profile:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self.started_tracemalloc = True
+        tracemalloc.reset_peak()
+        self.start = time.perf_counter()
+        self.profiler.enable()
+        return self.result
+
+    def __exit__(self, *exc):
+        self.profiler.disable()
+        self.result.wall_ms = (time.perf_counter() - self.start) * 1000.0
+        snapshot = tracemalloc.take_snapshot()
+        self.result.peak_kb = tracemalloc.get_traced_memory()[1] / 1024.0
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+        try:
+            self._collect(snapshot)
+        except Exception as e:
+            logs.warning("Profile", "Could not save profile: %s", e)
+        return False
+
+    def _collect(self, snapshot: tracemalloc.Snapshot):
+        result = self.result
+        stats = pstats.Stats(self.profiler)
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+        for (filename, line, func), (_, calls, tottime, cumtime, _) in rows[:PROFILE_TOP]:
+            result.top_functions.append({
+                "function": f"{os.path.basename(filename)}:{line}({func})",
+                "calls": calls,
+                "tottime_ms": round(tottime * 1000.0, 2),
+                "cumtime_ms": round(cumtime * 1000.0, 2),
+            })
+
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ))
+        allocations = snapshot.statistics("lineno")
+        for stat in allocations[:PROFILE_TOP]:
+            frame = stat.traceback[0]
+            result.top_allocations.append({
+                "site": f"{os.path.basename(frame.filename)}:{frame.lineno}",
+                "kb": round(stat.size / 1024.0, 1),
+                "count": stat.count,
+            })
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        # The request id may come from the client's X-Request-ID header
+        base = os.path.join(PROFILE_DIR, f"{safe_file_name(result.label)}-{safe_file_name(result.request_id)}")
+        result.profile_path = base + ".prof"
+        stats.dump_stats(result.profile_path)
+
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP)
+        result.alloc_path = base + ".alloc.txt"
+        with open(result.alloc_path, "w") as f:
+            f.write(f"# {result.label} request {result.request_id}: {result.wall_ms:.1f} ms, "
+                    f"peak traced {result.peak_kb:.1f} KiB\n")
+            for stat in allocations[:100]:
+                f.write(f"{stat}\n")
+                for line in stat.traceback.format()[-TRACEMALLOC_FRAMES * 2:]:
+                    f.write(f"    {line}\n")
+            f.write("\n# cProfile, top functions by cumulative time\n")
+            f.write(out.getvalue())
+
+        logs.info("Profile", "%.1f ms, peak %.1f KiB -> %s", result.wall_ms, result.peak_kb, result.profile_path)
+
+
+def profile_request(enabled: bool, label: str = "recommend"):
+    """
+    Context manager profiling the enclosed block; yields a Profile, or None
+    (a shared no-op, nothing started) when enabled is False.
+    """
+    if not enabled:
+        return _NOOP_PROFILE
+    return _ActiveProfile(label)
@@ -4,16 +4,50 @@ Adapted from smart_home_hybrid_vc_demo.py to work with Supabase data
 """
 
 from http.server import BaseHTTPRequestHandler
+import atexit
+import contextvars
 import json
 import math
 import os
+import sys
+import time
 from typing import Dict, List, Any, Optional, Tuple
 from dataclasses import dataclass, asdict
+from concurrent.futures import Future, ThreadPoolExecutor
 import numpy as np
-import pandas as pd
 from openai import OpenAI
 import requests
 
+from commute import commute_minutes_for_listings, geocode_address
+from embedding_index import (EMBEDDING_INDEX_PATH, SEMANTIC_POOL_FACTOR, SEMANTIC_SEARCH_SIZE, get_embedding_index,
+                             rank_by_hits, semantic_prerank, semantic_search)
+from feature_snapshot import FeatureSnapshot, get_feature_snapshot, sync_if_due
+from llm_client import Deadline, parse_preferences, score_listings
+from llm_prompt import TokenUsage
+from geo import grouped_min_distance_miles, parse_lat_lng, polygon_to_geojson
+from similarity import (
+    build_feature_matrix,
+    cache_loved_vectors,
+    get_cached_loved_vectors,
+    similarity_boost,
+    similarity_to_loved,
+)
+from poi_index import get_poi_store
+import cassette
+import logs
+from precompute import load_precomputed
+from response_cache import cache_bypassed, cache_version, get_response_cache, request_key
+from profiling import header_requested, profile_request, profiling_wanted
+from time_budget import TimeBudget, measured, observe, request_deadline
+from tracing import cache_lookup, count_call, span, start_trace, traced, tracing_wanted
+from write_behind import WriteBehindQueue
+
+# Fast JSON encoder (optional - falls back to stdlib json)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Supabase connection
 try:
     from supabase import create_client, Client
@@ -49,6 +83,47 @@ def kw_in(text: str, *words) -> bool:
     return any(w in t for w in words)
 
 
+def _finite(obj: Any) -> Any:
+    """obj with non-finite floats mapped to None (the stdlib encoder would emit NaN / Infinity)"""
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(value) for value in obj]
+    return obj
+
+
+def _json_default(obj: Any) -> Any:
+    """Fallback encoder for numpy scalars/arrays when orjson is not installed"""
+    if isinstance(obj, np.generic):
+        return _finite(obj.item())
+    if isinstance(obj, np.ndarray):
+        return _finite(obj.tolist())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps_json(payload: Any) -> bytes:
+    """
+    Serialize a response payload to JSON bytes.
+
+    Uses orjson when available (native float/numpy handling, NaN -> null),
+    otherwise the stdlib encoder with a numpy-aware default and the same
+    NaN / Infinity -> null mapping.
+    """
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(_finite(payload), default=_json_default, allow_nan=False).encode('utf-8')
+
+
+def _opt_float(value: Any) -> Optional[float]:
+    """Convert to float, mapping None/NaN to None"""
+    if value is None:
+        return None
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
 # ------------------- Google Places API Integration -------------------
 PLACES_TYPES = {
     "school": {"includedTypes": ["school"], "radius_miles": 2.0},
@@ -57,6 +132,11 @@ PLACES_TYPES = {
     "transit": {"includedTypes": ["transit_station", "subway_station", "train_station"], "radius_miles": 1.0},
 }
 
+# Local POI snapshot (see poi_index.py); Places API is only used outside its coverage
+POI_SNAPSHOT_PATH = os.environ.get("POI_SNAPSHOT_PATH")
+FEATURE_SNAPSHOT_PATH = os.environ.get("FEATURE_SNAPSHOT_PATH")
+FEATURE_SNAPSHOT_SYNC_SECONDS = int(os.environ.get("FEATURE_SNAPSHOT_SYNC_SECONDS", "300"))
+
 
 # ------------------- PIM Service Integration -------------------
 PIM_SERVICE_URL = os.environ.get("PIM_SERVICE_URL", "https://pim-service-646197723218.us-central1.run.app")
@@ -71,6 +151,7 @@ GEOCODING_TIMEOUT = 5
 GEOCODING_CACHE = {}  # Simple in-memory cache
 
 
+@traced("places.search_nearby")
 def places_nearby(lat: float, lon: float, included_types: List[str],
                   radius_miles: float, max_results: int = 8) -> List[Dict[str, Any]]:
     """
@@ -79,7 +160,7 @@ def places_nearby(lat: float, lon: float, included_types: List[str],
     """
     api_key = os.environ.get("GOOGLE_PLACES_API_KEY")
     if not api_key:
-        print("[Places API] Warning: GOOGLE_PLACES_API_KEY not configured, skipping POI enrichment")
+        logs.count("Places API", "not_configured")
         return []
 
     url = "https://places.googleapis.com/v1/places:searchNearby"
@@ -100,55 +181,104 @@ def places_nearby(lat: float, lon: float, included_types: List[str],
         "Content-Type": "application/json",
     }
 
+    count_call("places")
     try:
         resp = requests.post(url, headers=headers, json=body, timeout=10)
         if resp.status_code != 200:
-            print(f"[Places API] Error {resp.status_code}: {resp.text[:200]}")
+            logs.count("Places API", f"http_{resp.status_code}", example=resp.text[:80])
             return []
+        logs.count("Places API", "ok")
         return (resp.json() or {}).get("places", []) or []
     except Exception as e:
-        print(f"[Places API] Exception: {e}")
+        logs.count("Places API", "exception", example=e)
         return []
 
 
-def enrich_with_places(listing: Dict[str, Any], poi_keys: List[str] = None) -> Dict[str, Any]:
+def enrich_listings_with_places(listings: List[Dict[str, Any]],
+                                poi_keys: List[str] = None, time_budget: TimeBudget = None) -> List[Dict[str, Any]]:
     """
-    Enrich listing with nearby POI distances using Google Places API
-    Returns dict with poi_min_miles and poi_counts
+    Enrich a batch of listings with nearby POI distances using Google Places API
+
+    Listings inside the local POI snapshot (POI_SNAPSHOT_PATH) are answered
+    from its spatial index without any API call. Remaining listings are
+    looked up per (listing, POI type), with all distances computed in one
+    vectorized haversine call and reduced to per-type minimums. With a
+    time_budget, only as many listings as fit are looked up (see time_budget.py).
+    Returns one {"poi_min_miles", "poi_counts"} dict per listing.
     """
     if poi_keys is None:
         poi_keys = ["school", "supermarket", "park", "transit"]
+    keys = [k for k in poi_keys if k in PLACES_TYPES]
 
-    lat, lon = listing.get("latitude"), listing.get("longitude")
-    if lat is None or lon is None:
-        return {"poi_min_miles": {}, "poi_counts": {}}
-
-    poi_min, poi_counts = {}, {}
+    results = [{"poi_min_miles": {}, "poi_counts": {}} for _ in listings]
+    slots, src_lat, src_lon, dst_lat, dst_lon = [], [], [], [], []
+    store = get_poi_store(POI_SNAPSHOT_PATH)
+    served_locally = 0
 
-    for k in poi_keys:
-        if k not in PLACES_TYPES:
+    lookups = []
+    for li, listing in enumerate(listings):
+        lat, lon = listing.get("latitude"), listing.get("longitude")
+        if lat is None or lon is None:
             continue
 
-        spec = PLACES_TYPES[k]
-        places = places_nearby(lat, lon, spec["includedTypes"], spec.get("radius_miles", 2.0), max_results=8)
-
-        dists = []
-        for p in places:
-            loc = p.get("location", {}) or {}
-            plat = loc.get("latitude")
-            plon = loc.get("longitude")
-
-            if plat is not None and plon is not None:
+        if store is not None and store.covers(float(lat), float(lon)):
+            results[li] = store.enrich(float(lat), float(lon), keys, PLACES_TYPES)
+            served_locally += 1
+            continue
+        lookups.append(li)
+
+    # Under a time budget only the first listings that fit are looked up; the rest go without POI data
+    if time_budget is not None:
+        allowed = time_budget.affordable("places", len(lookups), reserve=("llm",))
+        if allowed < len(lookups):
+            time_budget.degrade("places", f"nearby searches for {allowed}/{len(lookups)} listings")
+            lookups = lookups[:allowed]
+
+    start = time.perf_counter()
+    for li in lookups:
+        lat, lon = listings[li]["latitude"], listings[li]["longitude"]
+        for ki, k in enumerate(keys):
+            spec = PLACES_TYPES[k]
+            places = places_nearby(lat, lon, spec["includedTypes"], spec.get("radius_miles", 2.0), max_results=8)
+            results[li]["poi_counts"][k] = len(places)
+
+            for p in places:
+                loc = p.get("location", {}) or {}
                 try:
-                    dist = haversine_miles(lat, lon, float(plat), float(plon))
-                    dists.append(dist)
-                except Exception:
-                    pass
+                    plat = float(loc.get("latitude"))
+                    plon = float(loc.get("longitude"))
+                except (TypeError, ValueError):
+                    continue  # Missing or malformed location: skip before appending anything
+                dst_lat.append(plat)
+                dst_lon.append(plon)
+                src_lat.append(float(lat))
+                src_lon.append(float(lon))
+                slots.append(li * len(keys) + ki)
+    observe("places", time.perf_counter() - start, len(lookups))
+
+    logs.summary("Places API", "Nearby searches for %d listings", len(listings))
+    if store is not None:
+        cache_lookup("poi_snapshot", True, served_locally)
+        cache_lookup("poi_snapshot", False, len(listings) - served_locally)
+        logs.info("POI Index", f"Served {served_locally}/{len(listings)} listings from local snapshot")
+
+    mins = grouped_min_distance_miles(src_lat, src_lon, dst_lat, dst_lon, slots, len(listings) * len(keys))
+
+    for li, result in enumerate(results):
+        for ki, k in enumerate(keys):
+            if k in result["poi_counts"] and k not in result["poi_min_miles"]:
+                dist = mins[li * len(keys) + ki]
+                result["poi_min_miles"][k] = None if np.isnan(dist) else float(dist)
+
+    return results
 
-        poi_min[k] = min(dists) if dists else None
-        poi_counts[k] = len(places)
 
-    return {"poi_min_miles": poi_min, "poi_counts": poi_counts}
+def enrich_with_places(listing: Dict[str, Any], poi_keys: List[str] = None) -> Dict[str, Any]:
+    """
+    Enrich listing with nearby POI distances using Google Places API
+    Returns dict with poi_min_miles and poi_counts
+    """
+    return enrich_listings_with_places([listing], poi_keys=poi_keys)[0]
 
 
 # ------------------- Coordinate Extraction with Fallbacks -------------------
@@ -190,16 +320,20 @@ def get_property_coordinates(listing: Dict[str, Any]) -> Optional[Tuple[float, f
         if coords:
             return coords
 
-    print(f"[Coords] No coordinates found for {listing.get('id')}")
+    logs.count("Coords", "missing", example=listing.get("id"))
     return None
 
 
+@traced("geocode.sf_planning")
 def geocode_sf_planning(address: str) -> Optional[Tuple[float, float]]:
     """Geocode using SF Planning GIS geocoder"""
     cache_key = f"sf_{address}"
     if cache_key in GEOCODING_CACHE:
+        cache_lookup("geocode", True)
         return GEOCODING_CACHE[cache_key]
 
+    cache_lookup("geocode", False)
+    count_call("geocoder.sf")
     try:
         response = requests.get(
             SF_GEOCODER_URL,
@@ -222,15 +356,17 @@ def geocode_sf_planning(address: str) -> Optional[Tuple[float, float]]:
                     # Verify within SF bounds
                     if 37.7 <= coords[0] <= 37.83 and -122.52 <= coords[1] <= -122.35:
                         GEOCODING_CACHE[cache_key] = coords
-                        print(f"[SF Geocoder] Found: {address} -> {coords}")
+                        logs.count("Geocoder", "sf_found")
+                        logs.debug("SF Geocoder", "Found: %s -> %s", address, coords)
                         return coords
 
     except Exception as e:
-        print(f"[SF Geocoder] Error: {e}")
+        logs.count("Geocoder", "sf_error", example=e)
 
     return None
 
 
+@traced("geocode.google")
 def geocode_google(address: str, city: str) -> Optional[Tuple[float, float]]:
     """Geocode using Google Geocoding API"""
     google_key = os.environ.get("GOOGLE_PLACES_API_KEY")
@@ -239,8 +375,11 @@ def geocode_google(address: str, city: str) -> Optional[Tuple[float, float]]:
 
     cache_key = f"google_{address}_{city}"
     if cache_key in GEOCODING_CACHE:
+        cache_lookup("geocode", True)
         return GEOCODING_CACHE[cache_key]
 
+    cache_lookup("geocode", False)
+    count_call("geocoder.google")
     try:
         response = requests.get(
             GOOGLE_GEOCODING_URL,
@@ -254,16 +393,23 @@ def geocode_google(address: str, city: str) -> Optional[Tuple[float, float]]:
                 location = data["results"][0]["geometry"]["location"]
                 coords = (float(location["lat"]), float(location["lng"]))
                 GEOCODING_CACHE[cache_key] = coords
-                print(f"[Google Geocoder] Found: {address} -> {coords}")
+                logs.count("Geocoder", "google_found")
+                logs.debug("Google Geocoder", "Found: %s -> %s", address, coords)
                 return coords
 
     except Exception as e:
-        print(f"[Google Geocoder] Error: {e}")
+        logs.count("Geocoder", "google_error", example=e)
 
     return None
 
 
 # ------------------- PIM Scoring Client -------------------
+def pim_supported(city: str) -> bool:
+    """Whether the PIM service is enabled and covers city"""
+    return PIM_ENABLED and city in PIM_SUPPORTED_CITIES
+
+
+@traced("pim.score")
 def get_pim_score(listing_id: str, city: str, lat: float, lon: float) -> Optional[Dict]:
     """
     Call PIM microservice to get property score.
@@ -275,15 +421,13 @@ def get_pim_score(listing_id: str, city: str, lat: float, lon: float) -> Optiona
         - Property outside coverage area
         - Service timeout/error
     """
-    if not PIM_ENABLED:
-        return None
-
-    if city not in PIM_SUPPORTED_CITIES:
+    if not pim_supported(city):
         return None
 
     if lat is None or lon is None:
         return None
 
+    count_call("pim")
     try:
         response = requests.post(
             f"{PIM_SERVICE_URL}/score",
@@ -300,24 +444,25 @@ def get_pim_score(listing_id: str, city: str, lat: float, lon: float) -> Optiona
 
         if response.status_code == 200:
             pim_data = response.json()
-            print(f"[PIM] ✓ Scored {listing_id}: {pim_data['score_total']:.2f}/10")
+            logs.count("PIM", "scored")
+            logs.debug("PIM", "Scored %s: %.2f/10", listing_id, pim_data["score_total"])
             return pim_data
 
         elif response.status_code == 400:
             # Property outside SF or city not supported
-            print(f"[PIM] ⊘ Property {listing_id} outside coverage area")
+            logs.count("PIM", "outside_coverage")
             return None
 
         else:
-            print(f"[PIM] ✗ Service error {response.status_code} for {listing_id}")
+            logs.count("PIM", f"http_{response.status_code}", example=listing_id)
             return None
 
     except requests.Timeout:
-        print(f"[PIM] ⏱ Timeout for {listing_id}")
+        logs.count("PIM", "timeout", example=listing_id)
         return None
 
     except Exception as e:
-        print(f"[PIM] ✗ Error for {listing_id}: {e}")
+        logs.count("PIM", "error", example=f"{listing_id}: {e}")
         return None
 
 
@@ -336,6 +481,8 @@ class Preferences:
     property_types: List[str] = None
     school_priority: str = "medium"  # "low", "medium", "high"
     commute_address: str = None  # Optional commute destination
+    commute_mode: str = "driving"  # "driving", "transit", "bicycling", "walking"
+    max_commute_minutes: int = None  # Optional commute tolerance
 
     def __post_init__(self):
         if self.must_haves is None:
@@ -348,9 +495,12 @@ class Preferences:
             self.property_types = []
 
 
-def parse_prefs_llm(user_text: str) -> Preferences:
+def parse_prefs_llm(user_text: str, usage: TokenUsage = None, deadline: Deadline = None) -> Preferences:
     """
     Parse free-form buyer preferences using OpenAI LLM
+
+    Invalid fields are dropped; if the LLM cannot be reached the default
+    (unfiltered) preferences are returned.
     """
     prompt = f"""
 You are a real estate assistant. Extract structured preferences from this buyer's description.
@@ -369,24 +519,132 @@ Return a JSON with these fields:
 - nice_to_haves (list of strings, preferred but not required)
 - preferred_areas (list of city names or neighborhoods)
 - property_types (list of strings like "Single Family", "Condo", "Townhouse")
+- commute_address (string, work or other regular commute destination if mentioned, else null)
+- commute_mode (one of "driving", "transit", "bicycling", "walking", default "driving")
+- max_commute_minutes (integer, maximum acceptable commute if mentioned, else null)
 
 Only output valid JSON, nothing else.
 """
 
-    response = openai_client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.0
-    )
+    fields = parse_preferences(openai_client, prompt, deadline=deadline, usage=usage)
+    if fields is None:
+        logs.warning("LLM", "Preference parsing unavailable, using default preferences")
+        fields = {}
+    return Preferences(**fields)
+
+
+# Columns fetched for scoring - include PIM cache columns
+PROPERTY_COLUMNS = (
+    "id, address, city, state, zip_code, coordinates, "
+    "listing_price, bedrooms, bathrooms, square_feet, lot_size, "
+    "property_type, year_built, description, "
+    "school_avg_rating, school_closest_miles, school_best_elementary, school_best_middle, school_best_high, "
+    "zillow_property_id, data_source, "
+    "pim_score, pim_env_risk, pim_regulatory_friction, pim_expandability, pim_reno_recency, pim_nuisance, pim_scored_at"
+)
+
+
+def normalize_property_row(prop: Dict[str, Any]) -> Dict[str, Any]:
+    """Normalize a properties row to match original ML code expectations"""
+    return {
+        "id": prop.get("id", ""),  # Database UUID (REQUIRED by frontend)
+        "zpid": prop.get("zillow_property_id") or prop["id"],
+        "address": prop.get("address", ""),
+        "city": prop.get("city", ""),
+        "state": prop.get("state", ""),
+        "zipcode": prop.get("zip_code", ""),
+        "price": prop.get("listing_price", 0),
+        "bedrooms": prop.get("bedrooms", 0),
+        "bathrooms": prop.get("bathrooms", 0),
+        "livingArea": prop.get("square_feet", 0),
+        "lotSize": prop.get("lot_size", 0),
+        "propertyType": prop.get("property_type", ""),
+        "yearBuilt": prop.get("year_built", None),
+        "description": prop.get("description", ""),
+        "latitude": prop.get("coordinates", {}).get("lat") if isinstance(prop.get("coordinates"), dict) else None,
+        "longitude": prop.get("coordinates", {}).get("lng") if isinstance(prop.get("coordinates"), dict) else None,
+        "avg_school_rating": prop.get("school_avg_rating"),  # Precomputed (migration 0015)
+        "closest_school_miles": prop.get("school_closest_miles"),
+        "best_elementary_rating": prop.get("school_best_elementary"),
+        "best_middle_rating": prop.get("school_best_middle"),
+        "best_high_rating": prop.get("school_best_high"),
+        "_raw": prop
+    }
+
+
+def fetch_interacted_property_ids(buyer_id: str = None) -> List[str]:
+    """Property ids the buyer has already interacted with (excluded from recommendations)"""
+    if not buyer_id or not supabase:
+        return []
+    try:
+        logs.info("DB Filter", f"Fetching already-seen properties for buyer: {buyer_id}")
+        count_call("supabase")
+        seen_response = supabase.table("buyer_properties").select("property_id").eq("buyer_id", buyer_id).execute()
+
+        if seen_response.data:
+            excluded_property_ids = [item["property_id"] for item in seen_response.data]
+            logs.info("DB Filter", f"Excluding {len(excluded_property_ids)} already-seen properties")
+            return excluded_property_ids
+    except Exception as e:
+        logs.warning("DB Filter", f"Could not fetch seen properties: {e}")
+    return []
+
+
+def fetch_geo_candidate_ids(
+    center: Optional[Tuple[float, float]] = None,
+    radius_miles: float = None,
+    polygon: List[Tuple[float, float]] = None,
+    min_price: int = 0,
+    max_price: int = 999999999,
+    min_beds: int = 0,
+    min_baths: float = 0,
+    property_types: List[str] = None,
+    exclude_ids: List[str] = None,
+    limit: int = 100,
+    updated_since: str = None,
+    candidate_ids: List[str] = None
+) -> Optional[List[Tuple[str, float]]]:
+    """
+    Nearest-first candidate ids within a radius and/or polygon.
 
-    result_text = response.choices[0].message.content.strip()
-    # Remove markdown code blocks if present
-    if result_text.startswith("```"):
-        lines = result_text.split("\n")
-        result_text = "\n".join(lines[1:-1])
+    Uses the search_properties_geo RPC (PostGIS GiST index, see
+    supabase/migrations/0013_property_geo_search.sql and 0018, which adds
+    the updated_since and candidate_ids filters). Returns
+    [(property_id, distance_miles), ...], or None if the RPC is unavailable
+    so the caller can fall back to the city filter.
+    """
+    params: Dict[str, Any] = {"max_results": limit}
+    if center:
+        params["center_lat"], params["center_lng"] = center
+    if radius_miles:
+        params["radius_miles"] = float(radius_miles)
+    if polygon:
+        params["polygon"] = polygon_to_geojson(polygon)
+    if min_price and min_price > 0:
+        params["min_price"] = min_price
+    if max_price is not None and max_price < 999999999:
+        params["max_price"] = max_price
+    if min_beds and min_beds > 0:
+        params["min_beds"] = min_beds
+    if min_baths and min_baths > 0:
+        params["min_baths"] = min_baths
+    if property_types:
+        params["property_types"] = property_types
+    if exclude_ids:
+        params["exclude_ids"] = exclude_ids
+    if updated_since:
+        params["updated_since"] = updated_since
+    if candidate_ids is not None:
+        params["candidate_ids"] = candidate_ids
 
-    parsed = json.loads(result_text)
-    return Preferences(**parsed)
+    try:
+        count_call("supabase")
+        response = supabase.rpc("search_properties_geo", params).execute()
+    except Exception as e:
+        logs.warning("Geo Search", f"RPC unavailable, falling back to area filter: {e}")
+        return None
+
+    return [(row["property_id"], row["distance_miles"]) for row in (response.data or [])]
 
 
 def fetch_properties_from_supabase(
@@ -397,39 +655,71 @@ def fetch_properties_from_supabase(
     min_baths: float = 0,
     property_types: List[str] = None,
     limit: int = 100,
-    buyer_id: str = None
+    buyer_id: str = None,
+    center: Optional[Tuple[float, float]] = None,
+    radius_miles: float = None,
+    polygon: List[Tuple[float, float]] = None,
+    updated_since: str = None,
+    property_ids: List[str] = None
 ) -> List[Dict[str, Any]]:
     """
     Fetch properties from Supabase database with filters
+
+    Geo mode: when center + radius_miles and/or polygon are given, candidates
+    come from the spatial index ordered by distance (each carries
+    distance_miles) and preferred_areas is not used.
+
+    updated_since (ISO timestamp) restricts candidates to listings changed
+    after it (incremental precompute runs); property_ids restricts them to
+    those ids (semantic search hits).
     """
     if not supabase:
         return []
 
     # Fetch properties the buyer has already interacted with (if buyer_id provided)
-    excluded_property_ids = []
-    if buyer_id:
-        try:
-            print(f"[DB Filter] Fetching already-seen properties for buyer: {buyer_id}")
-            seen_response = supabase.table("buyer_properties").select("property_id").eq("buyer_id", buyer_id).execute()
-
-            if seen_response.data:
-                excluded_property_ids = [item["property_id"] for item in seen_response.data]
-                print(f"[DB Filter] Excluding {len(excluded_property_ids)} already-seen properties")
-        except Exception as e:
-            print(f"[DB Filter] Warning: Could not fetch seen properties: {e}")
-
-    # Build query - include PIM cache columns
-    query = supabase.table("properties").select(
-        "id, address, city, state, zip_code, coordinates, "
-        "listing_price, bedrooms, bathrooms, square_feet, lot_size, "
-        "property_type, year_built, description, schools, "
-        "zillow_property_id, data_source, "
-        "pim_score, pim_env_risk, pim_regulatory_friction, pim_expandability, pim_reno_recency, pim_nuisance, pim_scored_at"
-    )
+    excluded_property_ids = fetch_interacted_property_ids(buyer_id)
+
+    # Geo retrieval mode: nearest candidates within radius / polygon
+    if (center and radius_miles) or polygon:
+        geo_hits = fetch_geo_candidate_ids(
+            center=center,
+            radius_miles=radius_miles,
+            polygon=polygon,
+            min_price=min_price,
+            max_price=max_price,
+            min_beds=min_beds,
+            min_baths=min_baths,
+            property_types=property_types,
+            exclude_ids=excluded_property_ids,
+            limit=limit,
+            updated_since=updated_since,
+            candidate_ids=property_ids
+        )
+        if geo_hits is not None:
+            logs.info("Geo Search", f"{len(geo_hits)} candidates within search area")
+            if not geo_hits:
+                return []
+            distance_by_id = dict(geo_hits)
+            count_call("supabase")
+            response = supabase.table("properties").select(PROPERTY_COLUMNS).in_("id", list(distance_by_id)).execute()
+            rows = sorted(response.data, key=lambda r: distance_by_id.get(r["id"], math.inf))
+            properties = []
+            for prop in rows:
+                normalized = normalize_property_row(prop)
+                normalized["distance_miles"] = distance_by_id.get(prop["id"])
+                properties.append(normalized)
+            return properties
+
+    # Build query
+    query = supabase.table("properties").select(PROPERTY_COLUMNS)
 
     # Exclude properties the buyer has already seen
     if excluded_property_ids:
         query = query.not_.in_("id", excluded_property_ids)
+    if updated_since:
+        query = query.gt("updated_at", updated_since)
+    if property_ids is not None:
+        query = query.in_("id", property_ids)
 
     # Apply filters
     if min_price and min_price > 0:
@@ -456,26 +746,25 @@ def fetch_properties_from_supabase(
 
     query = query.limit(limit)
 
+    count_call("supabase")
     response = query.execute()
 
     # FALLBACK: If preferred_areas filter returned 0 results, retry without it
     # This handles cases where preferred_areas are neighborhoods, not cities
     if used_area_filter and len(response.data) == 0:
-        print(f"[DB Filter] No properties found matching preferred_areas={preferred_areas} as cities")
-        print(f"[DB Filter] Retrying without area filter (preferred_areas may be neighborhoods)")
+        logs.info("DB Filter", f"No properties found matching preferred_areas={preferred_areas} as cities")
+        logs.info("DB Filter", "Retrying without area filter (preferred_areas may be neighborhoods)")
 
         # Rebuild query without the city filter - include PIM cache columns
-        query = supabase.table("properties").select(
-            "id, address, city, state, zip_code, coordinates, "
-            "listing_price, bedrooms, bathrooms, square_feet, lot_size, "
-            "property_type, year_built, description, schools, "
-            "zillow_property_id, data_source, "
-            "pim_score, pim_env_risk, pim_regulatory_friction, pim_expandability, pim_reno_recency, pim_nuisance, pim_scored_at"
-        )
+        query = supabase.table("properties").select(PROPERTY_COLUMNS)
 
         # Exclude properties the buyer has already seen (in fallback query too)
         if excluded_property_ids:
             query = query.not_.in_("id", excluded_property_ids)
+        if updated_since:
+            query = query.gt("updated_at", updated_since)
+        if property_ids is not None:
+            query = query.in_("id", property_ids)
 
         if min_price and min_price > 0:
             query = query.gte("listing_price", min_price)
@@ -489,53 +778,113 @@ def fetch_properties_from_supabase(
         # Skip preferred_areas filter
 
         query = query.limit(limit)
+        count_call("supabase")
         response = query.execute()
-        print(f"[DB Filter] Fallback query returned {len(response.data)} properties")
+        logs.info("DB Filter", f"Fallback query returned {len(response.data)} properties")
 
     # Convert to list of dicts
-    properties = []
-    for prop in response.data:
-        # Normalize structure to match original ML code expectations
-        normalized = {
-            "id": prop.get("id", ""),  # Database UUID (REQUIRED by frontend)
-            "zpid": prop.get("zillow_property_id") or prop["id"],
-            "address": prop.get("address", ""),
-            "city": prop.get("city", ""),
-            "state": prop.get("state", ""),
-            "zipcode": prop.get("zip_code", ""),
-            "price": prop.get("listing_price", 0),
-            "bedrooms": prop.get("bedrooms", 0),
-            "bathrooms": prop.get("bathrooms", 0),
-            "livingArea": prop.get("square_feet", 0),
-            "lotSize": prop.get("lot_size", 0),
-            "propertyType": prop.get("property_type", ""),
-            "yearBuilt": prop.get("year_built", None),
-            "description": prop.get("description", ""),
-            "latitude": prop.get("coordinates", {}).get("lat") if isinstance(prop.get("coordinates"), dict) else None,
-            "longitude": prop.get("coordinates", {}).get("lng") if isinstance(prop.get("coordinates"), dict) else None,
-            "schools": prop.get("schools", []),
-            "_raw": prop
-        }
-        properties.append(normalized)
+    return [normalize_property_row(prop) for prop in response.data]
+
 
+def fetch_properties_from_snapshot(
+    snapshot: FeatureSnapshot,
+    preferred_areas: List[str] = None,
+    min_price: int = 0,
+    max_price: int = 999999999,
+    min_beds: int = 0,
+    min_baths: float = 0,
+    property_types: List[str] = None,
+    must_haves: List[str] = None,
+    limit: int = 100,
+    buyer_id: str = None,
+    center: Optional[Tuple[float, float]] = None,
+    radius_miles: float = None,
+    property_ids: List[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Select candidates in-process from the local feature snapshot
+
+    Filters run as vectorized masks over the memory-mapped columns; rows that
+    mention more of the buyer's must-have amenities come first (nearest first
+    in radius mode). Only the selected `limit` display rows are fetched from
+    Supabase, and school / POI enrichment is taken from the snapshot.
+    property_ids restricts candidates to those ids (semantic search hits).
+    """
+    if not supabase:
+        return []
+
+    # Row numbers below must all refer to one version of the arrays
+    snapshot = snapshot.pinned()
+    excluded_property_ids = fetch_interacted_property_ids(buyer_id)
+    filters = dict(
+        min_price=min_price,
+        max_price=max_price,
+        min_beds=min_beds,
+        min_baths=min_baths,
+        property_types=property_types,
+        exclude_ids=excluded_property_ids,
+        center=center,
+        radius_miles=radius_miles,
+        property_ids=property_ids
+    )
+    geo_mode = bool(center and radius_miles)
+    rows, distances = snapshot.filter(cities=None if geo_mode else preferred_areas, **filters)
+
+    # Same fallback as the database path: preferred_areas may be neighborhoods
+    if preferred_areas and not geo_mode and rows.size == 0:
+        logs.info("Feature Snapshot", f"No properties in preferred_areas={preferred_areas}, retrying without area filter")
+        rows, distances = snapshot.filter(**filters)
+
+    if distances is None:
+        order = np.argsort(-snapshot.amenity_matches(rows, must_haves), kind="stable")
+        rows = rows[order]
+    rows = rows[:limit]
+    logs.info("Feature Snapshot", f"Selected {len(rows)} candidates in-process")
+    if rows.size == 0:
+        return []
+
+    property_ids = snapshot.ids[rows].tolist()
+    count_call("supabase")
+    response = supabase.table("properties").select(PROPERTY_COLUMNS).in_("id", property_ids).execute()
+    rows_by_id = {prop["id"]: prop for prop in response.data or []}
+
+    properties = []
+    for i, (property_id, row) in enumerate(zip(property_ids, rows)):
+        prop = rows_by_id.get(property_id)
+        if prop is None:
+            continue  # Removed since the snapshot was built
+        listing = normalize_property_row(prop)
+        listing.update(snapshot.listing_features(int(row)))
+        if distances is not None:
+            listing["distance_miles"] = float(distances[i])
+        properties.append(listing)
     return properties
 
 
 def enrich_with_schools_data(listing: Dict[str, Any]) -> Dict[str, Any]:
     """
-    Use schools data already stored in the database
+    Finish school fields from the aggregates precomputed in the database
+
+    Rows carry school_avg_rating / school_closest_miles (migration 0015), so
+    there is no per-listing walk over the schools JSON any more.
     """
-    schools = listing.get("schools", [])
+    listing["avg_school_rating"] = float(listing.get("avg_school_rating") or 0)
+    closest = listing.get("closest_school_miles")
+    listing["closest_school_miles"] = float(closest) if closest is not None else None
 
-    # Calculate average school rating if available
-    ratings = [s.get("rating", 0) for s in schools if s.get("rating")]
-    listing["avg_school_rating"] = sum(ratings) / len(ratings) if ratings else 0
+    return listing
 
-    # Find closest school distance
-    distances = [s.get("distance", 999) for s in schools if s.get("distance")]
-    listing["closest_school_miles"] = min(distances) if distances else None
 
-    return listing
+def prepare_snapshot_listings(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Normalize and enrich raw properties rows for the feature snapshot (build and delta sync)"""
+    listings = [normalize_property_row(prop) for prop in rows]
+    for listing in listings:
+        enrich_with_schools_data(listing)
+    if listings and (os.environ.get("GOOGLE_PLACES_API_KEY") or get_poi_store(POI_SNAPSHOT_PATH)):
+        poi_results = enrich_listings_with_places(listings, poi_keys=["school", "supermarket", "park", "transit"])
+        for listing, poi_data in zip(listings, poi_results):
+            listing.update(poi_data)
+    return listings
 
 
 def rule_score(listing: Dict[str, Any], prefs: Preferences) -> Tuple[float, List[str]]:
@@ -617,6 +966,20 @@ def rule_score(listing: Dict[str, Any], prefs: Preferences) -> Tuple[float, List
     if transit_boost > 0:
         score += transit_boost
 
+    # Commute proximity (uses precomputed commute_minutes, 0-8 points)
+    commute = listing.get("commute_minutes")
+    if commute is not None:
+        tolerance = prefs.max_commute_minutes or 60
+        commute_boost = boost(commute, 8, tolerance)
+        if commute_boost > 0:
+            score += commute_boost
+            if commute <= tolerance / 2:
+                reasons.append(f"short commute (~{commute:.0f} min)")
+        elif prefs.max_commute_minutes:
+            # Penalty grows with how far past the buyer's limit the commute is
+            score -= min(8, 8 * (commute - tolerance) / tolerance)
+            reasons.append(f"long commute (~{commute:.0f} min)")
+
     # Must-haves with PENALTIES for missing features
     text = (listing.get("description") or "").lower() + " " + (listing.get("address") or "").lower()
 
@@ -654,84 +1017,38 @@ def rule_score(listing: Dict[str, Any], prefs: Preferences) -> Tuple[float, List
     return final_score, reasons[:4]  # Return top 4 reasons
 
 
-def llm_score_batch(prefs: Preferences, listings: List[Dict[str, Any]]) -> Dict[str, float]:
+def llm_score_batch(prefs: Preferences, listings: List[Dict[str, Any]],
+                    usage: TokenUsage = None, deadline: Deadline = None) -> Dict[str, float]:
     """
-    Score all listings in a single LLM call for efficiency
+    Score all listings with as few LLM calls as fit the token budget
+
+    Listings are sent as compact rows (see llm_prompt) and replies are
+    validated by llm_client, which re-asks only for listings left unscored.
+    Listings still without a valid score are missing from the result.
+    Token usage is added to usage when given.
     """
     if not listings:
         return {}
 
-    # Create summary for each listing
-    summaries = []
-    for i, listing in enumerate(listings):
-        summary = f"""
-Property {i+1}:
-- Address: {listing.get('address', 'N/A')}, {listing.get('city', 'N/A')}
-- Price: ${listing.get('price', 0):,}
-- Beds/Baths: {listing.get('bedrooms', 0)}/{listing.get('bathrooms', 0)}
-- Size: {listing.get('livingArea') or 0:,} sqft, Lot: {listing.get('lotSize') or 0:,} sqft
-- Type: {listing.get('propertyType', 'N/A')}
-- Year: {listing.get('yearBuilt', 'N/A')}
-- Schools: Avg rating {listing.get('avg_school_rating', 0):.1f}/10
-- Description: {(listing.get('description') or 'N/A')[:200]}
-"""
-        summaries.append(summary)
-
-    prefs_text = f"""
-Budget: ${prefs.budget_min:,} - ${prefs.budget_max:,}
-Min beds: {prefs.min_beds}, Min baths: {prefs.min_baths}
-Min sqft: {prefs.min_sqft:,}, Min lot: {prefs.min_lot_size:,} sqft
-Must have: {', '.join(prefs.must_haves) if prefs.must_haves else 'None'}
-Nice to have: {', '.join(prefs.nice_to_haves) if prefs.nice_to_haves else 'None'}
-Preferred areas: {', '.join(prefs.preferred_areas) if prefs.preferred_areas else 'Any'}
-"""
-
-    prompt = f"""
-You are a real estate expert. Score each property (0-100) based on how well it matches the buyer's preferences.
-Consider: budget fit, location, size, amenities, schools, and overall value.
-
-Buyer Preferences:
-{prefs_text}
-
-Properties:
-{chr(10).join(summaries)}
-
-Return ONLY a JSON object mapping property index to score:
-{{"0": 85, "1": 72, ...}}
-"""
-
-    response = openai_client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.0
-    )
-
-    result_text = response.choices[0].message.content.strip()
-    if result_text.startswith("```"):
-        lines = result_text.split("\n")
-        result_text = "\n".join(lines[1:-1])
-
-    scores_by_index = json.loads(result_text)
+    scores_by_index = score_listings(openai_client, prefs, listings, deadline=deadline, usage=usage)
 
     # Map back to zpid
-    scores = {}
-    for i, listing in enumerate(listings):
-        zpid = listing.get("zpid", "")
-        score = scores_by_index.get(str(i), 50)
-        scores[zpid] = float(score)
+    return {listings[i].get("zpid", ""): score for i, score in scores_by_index.items()}
+
 
-    return scores
+ML_MIN_LABELS = 5  # with fewer LLM-scored listings the ML component is dropped
 
 
-def fit_ml_and_predict(X: pd.DataFrame, y_llm: np.ndarray) -> np.ndarray:
+def fit_ml_and_predict(X: np.ndarray, y_llm: np.ndarray, labeled: np.ndarray = None) -> np.ndarray:
     """
-    Train Ridge regression to mimic LLM scores
+    Train Ridge regression to mimic LLM scores (only on the rows in the
+    boolean mask labeled, when given) and predict every row
     """
     from sklearn.linear_model import Ridge
     from sklearn.preprocessing import StandardScaler
 
     # Handle missing values
-    X_filled = X.fillna(0)
+    X_filled = np.nan_to_num(np.asarray(X, dtype=np.float64), nan=0.0)
 
     # Scale features
     scaler = StandardScaler()
@@ -739,7 +1056,10 @@ def fit_ml_and_predict(X: pd.DataFrame, y_llm: np.ndarray) -> np.ndarray:
 
     # Train Ridge regression
     model = Ridge(alpha=1.0)
-    model.fit(X_scaled, y_llm)
+    if labeled is None:
+        model.fit(X_scaled, y_llm)
+    else:
+        model.fit(X_scaled[labeled], y_llm[labeled])
 
     # Predict
     y_pred = model.predict(X_scaled)
@@ -750,175 +1070,365 @@ def fit_ml_and_predict(X: pd.DataFrame, y_llm: np.ndarray) -> np.ndarray:
     return y_pred
 
 
-def recommend_hybrid(
-    user_prefs_text: str = None,
-    prefs: Preferences = None,
+def loved_similarity_boosts(listings: List[Dict[str, Any]], loved_property_ids: List[str],
+                            buyer_id: str = None) -> Optional[np.ndarray]:
+    """
+    Hybrid-score boosts from similarity to the buyer's loved properties.
+
+    Loved rows are fetched with the scoring columns and normalized like
+    candidates; their feature vectors are cached per buyer. All candidates
+    are compared to all loved properties in one matrix product.
+    Returns None when there is nothing to compare against.
+    """
+    if not loved_property_ids:
+        return None
+
+    loved_vectors = get_cached_loved_vectors(buyer_id, loved_property_ids)
+    if loved_vectors is None:
+        if not supabase:
+            return None
+        try:
+            count_call("supabase")
+            loved_response = supabase.table("properties").select(PROPERTY_COLUMNS).in_("id", loved_property_ids).execute()
+        except Exception as e:
+            logs.error("Similarity", f"Error fetching loved properties: {e}")
+            return None
+        loved_rows = [normalize_property_row(p) for p in (loved_response.data or [])]
+        if not loved_rows:
+            return None
+        loved_vectors = build_feature_matrix(loved_rows)
+        cache_loved_vectors(buyer_id, loved_property_ids, loved_vectors)
+
+    logs.info("Similarity", f"Boosting recommendations based on {loved_vectors.shape[0]} loved properties")
+    similarities = similarity_to_loved(build_feature_matrix(listings), loved_vectors)
+    return similarity_boost(similarities)
+
+
+def select_candidates(
+    prefs: Preferences,
     preferred_areas: List[str] = None,
     limit: int = 50,
     buyer_id: str = None,
-    w_llm: float = 0.5,
-    w_ml: float = 0.3,
-    w_rule: float = 0.2
-) -> pd.DataFrame:
+    search_center: Optional[Tuple[float, float]] = None,
+    radius_miles: float = None,
+    search_polygon: List[Tuple[float, float]] = None,
+    updated_since: str = None
+) -> Tuple[List[Dict[str, Any]], bool]:
     """
-    Main recommendation function using hybrid scoring
+    Candidate listings for one buyer (feature snapshot or database, then
+    semantic pre-ranking). Returns (listings, from_snapshot); snapshot
+    listings already carry school and POI features.
     """
-    # Parse preferences if text provided
-    if user_prefs_text and not prefs:
-        prefs = parse_prefs_llm(user_prefs_text)
-
-    if not prefs:
-        raise ValueError("Must provide either user_prefs_text or prefs object")
-
     # Use preferred_areas from prefs if not provided
     if not preferred_areas and prefs.preferred_areas:
         preferred_areas = prefs.preferred_areas
 
-    # Fetch properties from Supabase
-    listings = fetch_properties_from_supabase(
-        preferred_areas=preferred_areas,
-        min_price=prefs.budget_min,
-        max_price=prefs.budget_max,
-        min_beds=prefs.min_beds,
-        min_baths=prefs.min_baths,
-        property_types=prefs.property_types,
-        limit=limit,
-        buyer_id=buyer_id
-    )
+    # Commute-driven search: center the radius on the commute destination
+    if radius_miles and not search_center and prefs.commute_address:
+        search_center = geocode_address(prefs.commute_address)
+
+    semantic_index = get_embedding_index(EMBEDDING_INDEX_PATH)
+
+    # Candidates from the local feature snapshot when available (polygon search needs PostGIS)
+    feature_snapshot = get_feature_snapshot(FEATURE_SNAPSHOT_PATH)
+    use_snapshot = feature_snapshot is not None and not search_polygon and not updated_since
+    if use_snapshot and supabase:
+        # Patch in catalog changes since the last sync (rate-limited, in the background)
+        sync_if_due(feature_snapshot, supabase, PROPERTY_COLUMNS, prepare_snapshot_listings,
+                    FEATURE_SNAPSHOT_SYNC_SECONDS)
+
+    def fetch(fetch_limit: int, property_ids: List[str] = None) -> List[Dict[str, Any]]:
+        with span("fetch_candidates", snapshot=use_snapshot):
+            if use_snapshot:
+                return fetch_properties_from_snapshot(
+                    feature_snapshot,
+                    preferred_areas=preferred_areas,
+                    min_price=prefs.budget_min,
+                    max_price=prefs.budget_max,
+                    min_beds=prefs.min_beds,
+                    min_baths=prefs.min_baths,
+                    property_types=prefs.property_types,
+                    must_haves=prefs.must_haves,
+                    limit=fetch_limit,
+                    buyer_id=buyer_id,
+                    center=search_center,
+                    radius_miles=radius_miles,
+                    property_ids=property_ids
+                )
+            # Fetch properties from Supabase
+            return fetch_properties_from_supabase(
+                preferred_areas=preferred_areas,
+                min_price=prefs.budget_min,
+                max_price=prefs.budget_max,
+                min_beds=prefs.min_beds,
+                min_baths=prefs.min_baths,
+                property_types=prefs.property_types,
+                limit=fetch_limit,
+                buyer_id=buyer_id,
+                center=search_center,
+                radius_miles=radius_miles,
+                polygon=search_polygon,
+                updated_since=updated_since,
+                property_ids=property_ids
+            )
 
-    if not listings:
-        return pd.DataFrame()
+    # Semantic search: the catalog's nearest neighbours of the preferences that pass the
+    # filters, best first (geo and incremental searches keep their own candidate sets)
+    if semantic_index and not (search_center and radius_miles) and not search_polygon and not updated_since:
+        with span("semantic_search"):
+            hits = semantic_search(prefs, semantic_index, k=max(SEMANTIC_SEARCH_SIZE, limit * SEMANTIC_POOL_FACTOR),
+                                   openai_client=openai_client)
+        if hits:
+            listings = rank_by_hits(fetch(len(hits), [pid for pid, _ in hits]), hits, keep=limit)
+            if len(listings) >= limit:
+                logs.info("Embeddings", "Semantic search kept %d/%d nearest neighbours", len(listings), len(hits))
+                return listings, use_snapshot
+            logs.info("Embeddings", "Only %d/%d nearest neighbours pass the filters, pre-ranking the filtered pool",
+                      len(listings), len(hits))
+
+    # Otherwise fetch a wider filtered pool and keep the best `limit` by embedding similarity
+    listings = fetch(limit * SEMANTIC_POOL_FACTOR if semantic_index else limit)
+
+    if semantic_index and len(listings) > limit:
+        with span("semantic_prerank"):
+            listings = semantic_prerank(listings, prefs, semantic_index, keep=limit, openai_client=openai_client)
+
+    return listings, use_snapshot
 
-    # Enrich with schools data
+
+def enrich_candidates(listings: List[Dict[str, Any]], time_budget: TimeBudget = None):
+    """School and Google Places POI features for database candidates, in place"""
     for listing in listings:
         enrich_with_schools_data(listing)
 
     # Enrich with Google Places POI data
-    if os.environ.get("GOOGLE_PLACES_API_KEY"):
-        print(f"[recommend_hybrid] Enriching {len(listings)} properties with POI data...")
-        for listing in listings:
-            poi_data = enrich_with_places(listing, poi_keys=["school", "supermarket", "park", "transit"])
+    if os.environ.get("GOOGLE_PLACES_API_KEY") or get_poi_store(POI_SNAPSHOT_PATH):
+        logs.info("recommend_hybrid", f"Enriching {len(listings)} properties with POI data...")
+        with span("enrich_places", listings=len(listings)):
+            poi_results = enrich_listings_with_places(listings, poi_keys=["school", "supermarket", "park", "transit"],
+                                                      time_budget=time_budget)
+        for listing, poi_data in zip(listings, poi_results):
             listing.update(poi_data)
-        print(f"[recommend_hybrid] POI enrichment complete")
+        logs.info("recommend_hybrid", "POI enrichment complete")
     else:
-        print("[recommend_hybrid] Skipping POI enrichment (GOOGLE_PLACES_API_KEY not configured)")
+        logs.info("recommend_hybrid", "Skipping POI enrichment (no GOOGLE_PLACES_API_KEY or POI snapshot)")
         # Set empty POI data so rule_score doesn't fail
         for listing in listings:
             listing["poi_min_miles"] = {}
             listing["poi_counts"] = {}
 
-    # Calculate rule scores
-    rule_scores = []
-    rule_reasons = []
-    for listing in listings:
-        score, reasons = rule_score(listing, prefs)
-        rule_scores.append(score)
-        rule_reasons.append("; ".join(reasons[:3]))  # Top 3 reasons
 
-    # Calculate LLM scores (batch)
-    llm_scores_dict = llm_score_batch(prefs, listings)
-    llm_scores = [llm_scores_dict.get(listing.get("zpid", ""), 50) for listing in listings]
+def pim_scores_for_listings(listings: List[Dict[str, Any]],
+                            time_budget: TimeBudget = None) -> Tuple[List[Optional[float]], List[Dict[str, Any]]]:
+    """
+    PIM score (0-100, None if unavailable) and subscores per listing (SF
+    properties with coordinates): cached database scores first, then the PIM
+    service -- under a time budget only for as many listings as fit.
+    """
+    pim_scores = []
+    pim_subscores_list = []
+
+    # Only uncached SF listings go to the service; the rest never cost a call
+    uncached = sum(1 for listing in listings
+                   if listing.get("_raw", {}).get("pim_score") is None and pim_supported(listing.get("city", "")))
+    allowed = uncached
+    if time_budget is not None:
+        allowed = time_budget.affordable("pim", uncached, reserve=("llm",))
+        if allowed < uncached:
+            time_budget.degrade("pim", f"service scores for {allowed}/{uncached} listings")
+    called, service_seconds = 0, 0.0
+
+    with span("pim"):
+        for listing in listings:
+            city = listing.get("city", "")
+            raw_listing = listing.get("_raw", {})
+
+            # Check for cached PIM scores from database
+            cached_pim_score = raw_listing.get("pim_score")
+
+            if cached_pim_score is not None:
+                # Use cached scores from database (already in 0-10 scale, convert to 0-100)
+                cache_lookup("pim", True)
+                pim_scores.append(float(cached_pim_score) * 10)
+                pim_subscores_list.append({
+                    "env_risk": raw_listing.get("pim_env_risk"),
+                    "regulatory_friction": raw_listing.get("pim_regulatory_friction"),
+                    "expandability": raw_listing.get("pim_expandability"),
+                    "reno_recency": raw_listing.get("pim_reno_recency"),
+                    "nuisance": raw_listing.get("pim_nuisance"),
+                })
+                logs.count("PIM", "cached")
+                continue
+
+            if not pim_supported(city):
+                pim_scores.append(None)
+                pim_subscores_list.append({})
+                continue
+
+            # No cached score - try PIM service (may fail with 403 but that's okay)
+            cache_lookup("pim", False)
+            pim_data = None
+
+            if called >= allowed:
+                logs.count("PIM", "deadline", example=listing.get("id"))
+            else:
+                called += 1
+                start = time.perf_counter()
+                coords = get_property_coordinates(listing)
+                if coords:
+                    lat, lon = coords
+                    pim_data = get_pim_score(listing.get("id"), city, lat, lon)
+                else:
+                    logs.count("PIM", "no_coordinates", example=listing.get("id"))
+                service_seconds += time.perf_counter() - start
+
+            # Store PIM data
+            if pim_data is not None:
+                # Convert PIM score from 0-10 to 0-100 scale
+                pim_scores.append(pim_data["score_total"] * 10)
+                pim_subscores_list.append(pim_data.get("subscores", {}))
+            else:
+                pim_scores.append(None)
+                pim_subscores_list.append({})
+
+    observe("pim", service_seconds, called)
+    logs.summary("PIM", "%d properties", len(listings))
+    logs.summary("Geocoder", "Coordinate lookups")
+    logs.summary("Coords", "Listings without coordinates")
+
+    return pim_scores, pim_subscores_list
+
+
+def score_candidates(
+    listings: List[Dict[str, Any]],
+    prefs: Preferences,
+    pim_scores: List[Optional[float]],
+    pim_subscores_list: List[Dict[str, Any]],
+    loved_property_ids: List[str] = None,
+    buyer_id: str = None,
+    usage: TokenUsage = None,
+    deadline: Deadline = None,
+    time_budget: TimeBudget = None
+) -> List[Dict[str, Any]]:
+    """
+    Score enriched candidates for one buyer (commute, rules, LLM, ML, PIM,
+    loved similarity). The hybrid score is a weighted average over the
+    components each listing has; under a time budget, commute and LLM
+    scoring only run as far as they fit.
+    """
+    if usage is None:
+        usage = TokenUsage()
+
+    # Commute times: one geocode + one bulk estimate for all candidates
+    if prefs.commute_address and time_budget is not None and not time_budget.affordable("commute", 1, reserve=("llm",)):
+        time_budget.degrade("commute", "skipped")
+    elif prefs.commute_address:
+        with span("commute"), measured("commute"):
+            destination = geocode_address(prefs.commute_address)
+            if destination:
+                commute_times = commute_minutes_for_listings(listings, destination, mode=prefs.commute_mode or "driving")
+                for listing, minutes in zip(listings, commute_times):
+                    listing["commute_minutes"] = minutes
+            else:
+                logs.warning("Commute", "Could not geocode commute address, skipping commute scoring")
+
+    # Calculate rule scores
+    with span("rule_score"):
+        rule_scores = []
+        rule_reasons = []
+        for listing in listings:
+            score, reasons = rule_score(listing, prefs)
+            rule_scores.append(score)
+            rule_reasons.append("; ".join(reasons[:3]))  # Top 3 reasons
+
+    # Calculate LLM scores (batch), ending in time for the stages after it
+    if time_budget is not None:
+        deadline = time_budget.cap(deadline or Deadline())
+    start = time.perf_counter()
+    with span("llm_score", listings=len(listings)):
+        llm_scores_dict = llm_score_batch(prefs, listings, usage=usage, deadline=deadline)
+    # Listings the LLM did not score (unavailable, timed out, invalid reply) drop out of the
+    # hybrid average; their reported llm_score (and ML label) is the rule score
+    has_llm = np.array([listing.get("zpid", "") in llm_scores_dict for listing in listings], dtype=bool)
+    llm_scores = [llm_scores_dict.get(listing.get("zpid", ""), rule_scores[i]) for i, listing in enumerate(listings)]
+    if has_llm.all():
+        observe("llm", time.perf_counter() - start)
+    else:
+        logs.info("LLM", f"No LLM score for {len(listings) - int(has_llm.sum())}/{len(listings)} listings")
+        if time_budget is not None:
+            time_budget.degrade("llm", f"scored {int(has_llm.sum())}/{len(listings)} listings")
 
     # Prepare features for ML model
-    features_list = []
-    for listing in listings:
+    # Columns: price, bedrooms, bathrooms, sqft, lot_size, year_built,
+    #          avg_school_rating, price_per_sqft
+    X = np.zeros((len(listings), 8), dtype=np.float64)
+    for i, listing in enumerate(listings):
         # Handle None values explicitly (when key exists but value is NULL)
         price = listing.get("price") or 0
         living_area = listing.get("livingArea") or 0
 
-        features = {
-            "price": price,
-            "bedrooms": listing.get("bedrooms") or 0,
-            "bathrooms": listing.get("bathrooms") or 0,
-            "sqft": living_area,
-            "lot_size": listing.get("lotSize") or 0,
-            "year_built": listing.get("yearBuilt") or 0,
-            "avg_school_rating": listing.get("avg_school_rating") or 0,
-            "price_per_sqft": price / living_area if living_area > 0 else 0
-        }
-        features_list.append(features)
+        X[i] = (
+            price,
+            listing.get("bedrooms") or 0,
+            listing.get("bathrooms") or 0,
+            living_area,
+            listing.get("lotSize") or 0,
+            listing.get("yearBuilt") or 0,
+            listing.get("avg_school_rating") or 0,
+            price / living_area if living_area > 0 else 0,
+        )
 
-    X = pd.DataFrame(features_list)
-    y_llm = np.array(llm_scores)
+    y_llm = np.array(llm_scores, dtype=np.float64)
 
-    # Train ML model and predict
-    ml_scores = fit_ml_and_predict(X, y_llm)
+    # Train ML model on the LLM-scored listings and predict all of them
+    ml_scores = None
+    if has_llm.all() or has_llm.sum() >= ML_MIN_LABELS:
+        with span("ml_fit"):
+            ml_scores = fit_ml_and_predict(X, y_llm, labeled=None if has_llm.all() else has_llm)
+    else:
+        logs.info("ML", "Too few LLM scores to fit (%d), dropping the ML component", int(has_llm.sum()))
 
     # Normalize all scores to 0-100
     rule_scores_norm = np.array(rule_scores)
     max_rule = rule_scores_norm.max() if rule_scores_norm.max() > 0 else 1
     rule_scores_norm = (rule_scores_norm / max_rule) * 100
 
-    # Get PIM scores for eligible properties (SF properties with coordinates)
-    # Strategy: Use cached scores from database first, fall back to PIM service
-    print(f"[PIM] Checking {len(listings)} properties for PIM scoring...")
-    pim_scores = []
-    pim_subscores_list = []
-
-    for listing in listings:
-        city = listing.get("city", "")
-        raw_listing = listing.get("_raw", {})
-
-        # Check for cached PIM scores from database
-        cached_pim_score = raw_listing.get("pim_score")
-
-        if cached_pim_score is not None:
-            # Use cached scores from database (already in 0-10 scale, convert to 0-100)
-            pim_scores.append(float(cached_pim_score) * 10)
-            pim_subscores_list.append({
-                "env_risk": raw_listing.get("pim_env_risk"),
-                "regulatory_friction": raw_listing.get("pim_regulatory_friction"),
-                "expandability": raw_listing.get("pim_expandability"),
-                "reno_recency": raw_listing.get("pim_reno_recency"),
-                "nuisance": raw_listing.get("pim_nuisance"),
-            })
-            print(f"[PIM] ✓ Using cached score for {listing.get('id')}: {cached_pim_score:.2f}/10")
-            continue
-
-        # No cached score - try PIM service (may fail with 403 but that's okay)
-        coords = get_property_coordinates(listing)
-        pim_data = None
-
-        if coords:
-            lat, lon = coords
-            pim_data = get_pim_score(listing.get("id"), city, lat, lon)
-        else:
-            print(f"[PIM] ⊘ Skipping {listing.get('id')}: No coordinates or cached score")
-
-        # Store PIM data
-        if pim_data is not None:
-            # Convert PIM score from 0-10 to 0-100 scale
-            pim_scores.append(pim_data["score_total"] * 10)
-            pim_subscores_list.append(pim_data.get("subscores", {}))
-        else:
-            pim_scores.append(None)
-            pim_subscores_list.append({})
-
     # Calculate hybrid score with adaptive weights
     hybrid_scores = []
     for i in range(len(listings)):
+        llm_i = llm_scores[i] if has_llm[i] else None
+        ml_i = ml_scores[i] if ml_scores is not None else None
         if pim_scores[i] is not None:
             # SF property with PIM: 40% LLM + 25% ML + 15% Rules + 20% PIM
-            hybrid_score = (
-                0.40 * llm_scores[i] +
-                0.25 * ml_scores[i] +
-                0.15 * rule_scores_norm[i] +
-                0.20 * pim_scores[i]
-            )
+            weighted = [(0.40, llm_i), (0.25, ml_i), (0.15, rule_scores_norm[i]), (0.20, pim_scores[i])]
         else:
             # Non-SF or PIM unavailable: 50% LLM + 30% ML + 20% Rules
-            hybrid_score = (
-                0.50 * llm_scores[i] +
-                0.30 * ml_scores[i] +
-                0.20 * rule_scores_norm[i]
-            )
+            weighted = [(0.50, llm_i), (0.30, ml_i), (0.20, rule_scores_norm[i])]
+        # Missing components (LLM cut short, no ML fit) drop out; the rest are renormalized
+        available = [(weight, score) for weight, score in weighted if score is not None]
+        hybrid_score = sum(weight * score for weight, score in available)
+        if len(available) < len(weighted):
+            hybrid_score /= sum(weight for weight, _ in available)
         hybrid_scores.append(hybrid_score)
 
-    hybrid_scores = np.array(hybrid_scores)
+    hybrid_scores = np.array(hybrid_scores, dtype=np.float64)
 
-    # Create results DataFrame
+    # Boost properties similar to the buyer's loved ones
+    with span("loved_similarity"):
+        boosts = loved_similarity_boosts(listings, loved_property_ids, buyer_id=buyer_id)
+    if boosts is not None:
+        hybrid_scores = np.minimum(100.0, hybrid_scores + boosts)
+
+    # Plain Python floats serialize natively (no numpy scalars in the payload)
+    hybrid_list = hybrid_scores.tolist()
+    ml_list = np.asarray(ml_scores, dtype=np.float64).tolist() if ml_scores is not None else [None] * len(listings)
+    rule_list = rule_scores_norm.tolist()
+
+    # Build results in descending hybrid_score order (stable for ties)
+    order = np.argsort(-hybrid_scores, kind="stable")
     results = []
-    for i, listing in enumerate(listings):
+    for i in order.tolist():
+        listing = listings[i]
         result = {
             "id": listing.get("id", ""),  # Database UUID (required by frontend)
             "zpid": listing.get("zillow_property_id", listing.get("zpid", "")),  # Display ID
@@ -933,10 +1443,16 @@ def recommend_hybrid(
             "property_type": listing.get("property_type", listing.get("propertyType", "")),
             "year_built": listing.get("year_built", listing.get("yearBuilt", "")),
             "avg_school_rating": listing.get("avg_school_rating", 0),
-            "hybrid_score": hybrid_scores[i],
-            "llm_score": llm_scores[i],
-            "ml_score": ml_scores[i],
-            "rule_score": rule_scores_norm[i],
+            "best_elementary_rating": listing.get("best_elementary_rating"),
+            "best_middle_rating": listing.get("best_middle_rating"),
+            "best_high_rating": listing.get("best_high_rating"),
+            "distance_miles": listing.get("distance_miles"),  # Geo search only
+            "commute_minutes": listing.get("commute_minutes"),
+            "semantic_score": listing.get("semantic_score"),  # Embedding index only
+            "hybrid_score": hybrid_list[i],
+            "llm_score": float(llm_scores[i]),
+            "ml_score": ml_list[i],
+            "rule_score": rule_list[i],
             "match_reasons": rule_reasons[i],
             # PIM scores
             "pim_score": pim_scores[i] if pim_scores[i] is not None else None,
@@ -948,124 +1464,582 @@ def recommend_hybrid(
         }
         results.append(result)
 
-    df = pd.DataFrame(results)
-    df = df.sort_values("hybrid_score", ascending=False).reset_index(drop=True)
+    logs.info("LLM", "%d calls, %d prompt + %d completion tokens for %d recommendations",
+              usage.calls, usage.prompt_tokens, usage.completion_tokens, len(results))
+
+    return results
+
+
+def recommend_hybrid(
+    user_prefs_text: str = None,
+    prefs: Preferences = None,
+    preferred_areas: List[str] = None,
+    limit: int = 50,
+    buyer_id: str = None,
+    loved_property_ids: List[str] = None,
+    w_llm: float = 0.5,
+    w_ml: float = 0.3,
+    w_rule: float = 0.2,
+    search_center: Optional[Tuple[float, float]] = None,
+    radius_miles: float = None,
+    search_polygon: List[Tuple[float, float]] = None,
+    usage: TokenUsage = None,
+    updated_since: str = None,
+    time_budget: TimeBudget = None
+) -> List[Dict[str, Any]]:
+    """
+    Main recommendation function using hybrid scoring
+
+    Geo search: pass radius_miles with search_center (or a commute_address
+    in prefs, geocoded as the center) and/or search_polygon to retrieve
+    candidates by distance instead of by city.
+
+    loved_property_ids boosts candidates similar to the buyer's loved
+    properties (cosine similarity over listing feature vectors).
 
-    return df
+    Returns result dicts sorted by hybrid_score (descending), ready to be
+    serialized with dumps_json. LLM token usage is accumulated into usage.
 
+    updated_since (ISO timestamp) only considers listings changed after it;
+    precompute.py uses it to rescore new listings incrementally.
 
-def save_recommendations_to_db(buyer_id: str, recommendations_df: pd.DataFrame):
+    time_budget bounds the run: Places, PIM, commute and LLM scoring are cut
+    to what fits, and what was cut is recorded in time_budget.degraded
+    (see time_budget.py).
+    """
+    if usage is None:
+        usage = TokenUsage()
+    deadline = Deadline()
+    if time_budget is not None:
+        deadline = time_budget.cap(deadline)
+
+    # Parse preferences if text provided
+    if user_prefs_text and not prefs:
+        if time_budget is not None and deadline.expired():
+            time_budget.degrade("preferences", "not parsed, default preferences")
+        with span("parse_preferences"):
+            prefs = parse_prefs_llm(user_prefs_text, usage=usage, deadline=deadline)
+
+    if not prefs:
+        raise ValueError("Must provide either user_prefs_text or prefs object")
+
+    listings, use_snapshot = select_candidates(
+        prefs,
+        preferred_areas=preferred_areas,
+        limit=limit,
+        buyer_id=buyer_id,
+        search_center=search_center,
+        radius_miles=radius_miles,
+        search_polygon=search_polygon,
+        updated_since=updated_since
+    )
+    if not listings:
+        return []
+
+    # School aggregates and POI data come precomputed with snapshot candidates
+    if use_snapshot:
+        logs.info("recommend_hybrid", "POI data from feature snapshot")
+    else:
+        enrich_candidates(listings, time_budget=time_budget)
+
+    pim_scores, pim_subscores_list = pim_scores_for_listings(listings, time_budget=time_budget)
+
+    return score_candidates(listings, prefs, pim_scores, pim_subscores_list,
+                            loved_property_ids=loved_property_ids, buyer_id=buyer_id, usage=usage, deadline=deadline,
+                            time_budget=time_budget)
+
+
+# ------------------- Batch Recommendations -------------------
+BATCH_MAX_BUYERS = int(os.environ.get("BATCH_MAX_BUYERS", "50"))
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", "8"))
+
+# Per-query fields a buyer's candidate carries besides the shared listing data
+QUERY_FIELDS = ("distance_miles", "semantic_score")
+
+
+def _submit_in_context(pool: ThreadPoolExecutor, fn, *args) -> Future:
+    # Each task runs in a copy of the caller's context (request log, trace)
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+
+def _with_query_fields(shared: Dict[str, Any], own: Dict[str, Any]) -> Dict[str, Any]:
+    listing = dict(shared)
+    for key in QUERY_FIELDS:
+        if key in own:
+            listing[key] = own[key]
+        else:
+            listing.pop(key, None)
+    return listing
+
+
+def recommend_hybrid_batch(batch_requests: List[Dict[str, Any]], usages: List[TokenUsage] = None,
+                           workers: int = BATCH_WORKERS) -> List[Any]:
+    """
+    recommend_hybrid for many buyers at once
+
+    Each request is a dict of recommend_hybrid keyword arguments. Candidates
+    are selected per buyer (concurrently, filters differ), then the union is
+    enriched once: schools, Places POIs and PIM scores are computed once per
+    listing however many buyers share it. Each buyer is then scored against
+    their own candidates, again concurrently.
+
+    Returns one entry per request, in order: its result list, or the
+    exception that buyer failed with (the other buyers are unaffected).
+    LLM token usage of request i is accumulated into usages[i].
+    """
+    if usages is None:
+        usages = [TokenUsage() for _ in batch_requests]
+    outcomes: List[Any] = [None] * len(batch_requests)
+    selected: Dict[int, Tuple[Preferences, List[Dict[str, Any]], bool]] = {}
+
+    def select(i: int):
+        request = batch_requests[i]
+        prefs = request.get("prefs")
+        if request.get("user_prefs_text") and not prefs:
+            with span("parse_preferences"):
+                prefs = parse_prefs_llm(request["user_prefs_text"], usage=usages[i], deadline=Deadline())
+        if not prefs:
+            raise ValueError("Must provide either user_prefs_text or prefs object")
+        listings, use_snapshot = select_candidates(
+            prefs,
+            preferred_areas=request.get("preferred_areas"),
+            limit=request.get("limit", 50),
+            buyer_id=request.get("buyer_id"),
+            search_center=request.get("search_center"),
+            radius_miles=request.get("radius_miles"),
+            search_polygon=request.get("search_polygon"),
+            updated_since=request.get("updated_since")
+        )
+        return prefs, listings, use_snapshot
+
+    def score(i: int):
+        prefs, listings, use_snapshot = selected[i]
+        keys = [(listing.get("id"), use_snapshot) for listing in listings]
+        own = [_with_query_fields(shared[key], listing) for key, listing in zip(keys, listings)]
+        request = batch_requests[i]
+        return score_candidates(
+            own,
+            prefs,
+            [pim_by_key[key][0] for key in keys],
+            [pim_by_key[key][1] for key in keys],
+            loved_property_ids=request.get("loved_property_ids"),
+            buyer_id=request.get("buyer_id"),
+            usage=usages[i],
+            deadline=Deadline()
+        )
+
+    def collect(futures: Dict[int, Future], into: Dict[int, Any]):
+        for i, future in futures.items():
+            try:
+                into[i] = future.result()
+            except Exception as e:
+                outcomes[i] = e
+                logs.count("Batch", "failed", example=f"{i}: {e}")
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(batch_requests))), thread_name_prefix="batch") as pool:
+        collect({i: _submit_in_context(pool, select, i) for i in range(len(batch_requests))}, selected)
+
+        # One shared dict per listing (snapshot candidates already carry school / POI features)
+        shared: Dict[Tuple[Any, bool], Dict[str, Any]] = {}
+        for _, listings, use_snapshot in selected.values():
+            for listing in listings:
+                shared.setdefault((listing.get("id"), use_snapshot), listing)
+        candidate_rows = sum(len(listings) for _, listings, _ in selected.values())
+        logs.info("Batch", "%d buyers, %d candidates, %d unique listings",
+                  len(batch_requests), candidate_rows, len(shared))
+
+        from_database = [listing for (_, use_snapshot), listing in shared.items() if not use_snapshot]
+        if from_database:
+            enrich_candidates(from_database)
+        pim_by_key = dict(zip(shared, zip(*pim_scores_for_listings(list(shared.values())))))
+
+        scored: Dict[int, List[Dict[str, Any]]] = {}
+        collect({i: _submit_in_context(pool, score, i) for i, (_, listings, _) in selected.items() if listings},
+                scored)
+
+    for i in selected:
+        if outcomes[i] is None:
+            outcomes[i] = scored.get(i, [])
+    logs.summary("Batch", "Buyers")
+    return outcomes
+
+
+# ------------------- Recommendation Persistence -------------------
+DB_UPSERT_CHUNK_SIZE = int(os.environ.get("DB_UPSERT_CHUNK_SIZE", "500"))
+# "sync", "async" (thread) or "write_behind" (journal + background flush). Only opt into
+# the background modes on instances that keep running after the response (Cloud Run,
+# VMs): Cloud Functions may throttle or recycle the instance, losing queued rows
+DB_SAVE_MODE = os.environ.get("DB_SAVE_MODE", "sync").lower()
+WRITE_BEHIND_PATH = os.environ.get("WRITE_BEHIND_PATH", "/tmp/recommendation_journal.sqlite3")
+_db_executor: Optional[ThreadPoolExecutor] = None
+_write_behind: Optional[WriteBehindQueue] = None
+
+
+def build_recommendation_row(buyer_id: str, row: Dict[str, Any]) -> Dict[str, Any]:
+    """Map one recommendation result to a buyer_properties row"""
+    property_data = {
+        "buyer_id": buyer_id,
+        "property_id": row["id"],
+        "hybrid_score": float(row["hybrid_score"]),
+        "llm_score": float(row["llm_score"]),
+        "ml_score": _opt_float(row.get("ml_score")),
+        "rule_score": float(row["rule_score"]),
+        "is_active": True,
+        "created_at": "now()",
+    }
+
+    # Add PIM scores if available
+    if _opt_float(row.get("pim_score")) is not None:
+        property_data.update({
+            "pim_score": float(row["pim_score"]),
+            "pim_env_risk": _opt_float(row.get("pim_env_risk")),
+            "pim_regulatory_friction": _opt_float(row.get("pim_regulatory_friction")),
+            "pim_expandability": _opt_float(row.get("pim_expandability")),
+            "pim_reno_recency": _opt_float(row.get("pim_reno_recency")),
+            "pim_nuisance": _opt_float(row.get("pim_nuisance")),
+            "pim_scored_at": "now()",
+            "pim_city": row.get("city"),
+        })
+
+    return property_data
+
+
+def upsert_recommendation_rows(rows: List[Dict[str, Any]],
+                               chunk_size: int = DB_UPSERT_CHUNK_SIZE) -> Dict[str, Any]:
+    """
+    Bulk upsert prepared buyer_properties rows.
+
+    Rows are grouped by column set (rows with and without PIM columns are
+    written separately so a bulk upsert never nulls out existing PIM data)
+    and sent in chunks of chunk_size. If a chunk fails, its rows are retried
+    one by one so the failing rows can be reported individually.
+
+    Returns:
+        {"saved": int, "failed": [{"buyer_id": str, "property_id": str, "error": str}, ...]}
+    """
+    report = {"saved": 0, "failed": []}
+    if not rows:
+        return report
+
+    if not supabase:
+        logs.warning("DB", "Supabase client not available, skipping DB save")
+        report["failed"] = [
+            {"buyer_id": r["buyer_id"], "property_id": r["property_id"], "error": "supabase unavailable"}
+            for r in rows
+        ]
+        return report
+
+    groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+
+    chunk_size = max(1, chunk_size)
+    for group in groups.values():
+        for start in range(0, len(group), chunk_size):
+            chunk = group[start:start + chunk_size]
+            try:
+                supabase.table("buyer_properties").upsert(
+                    chunk,
+                    on_conflict="buyer_id,property_id"
+                ).execute()
+                report["saved"] += len(chunk)
+                continue
+            except Exception as e:
+                logs.warning("DB", f"Bulk upsert of {len(chunk)} rows failed, retrying per row: {e}")
+
+            for row in chunk:
+                try:
+                    supabase.table("buyer_properties").upsert(
+                        row,
+                        on_conflict="buyer_id,property_id"
+                    ).execute()
+                    report["saved"] += 1
+                except Exception as e:
+                    logs.error("DB", f"Error saving property {row['property_id']}: {e}")
+                    report["failed"].append({
+                        "buyer_id": row["buyer_id"],
+                        "property_id": row["property_id"],
+                        "error": str(e),
+                    })
+
+    return report
+
+
+def save_recommendations_to_db(buyer_id: str, recommendations: List[Dict[str, Any]],
+                               chunk_size: int = DB_UPSERT_CHUNK_SIZE) -> Dict[str, Any]:
     """
     Save recommendations with PIM scores to buyer_properties table.
 
     This function stores all scoring data including PIM scores and subscores
-    for tracking and analytics purposes.
+    for tracking and analytics purposes. All rows are written with bulk
+    upserts (one call per chunk) instead of one call per recommendation.
+
+    Returns the per-row report from upsert_recommendation_rows.
     """
-    if not supabase:
-        print("[DB] Warning: Supabase client not available, skipping DB save")
-        return
-
-    for _, row in recommendations_df.iterrows():
-        property_data = {
-            "buyer_id": buyer_id,
-            "property_id": row["id"],
-            "hybrid_score": float(row["hybrid_score"]),
-            "llm_score": float(row["llm_score"]),
-            "ml_score": float(row["ml_score"]),
-            "rule_score": float(row["rule_score"]),
-            "is_active": True,
-            "created_at": "now()",
-        }
+    rows = [build_recommendation_row(buyer_id, row) for row in recommendations]
+    report = upsert_recommendation_rows(rows, chunk_size=chunk_size)
+    logs.info("DB", "Saved %d/%d recommendations for buyer %s (%d failed)",
+              report["saved"], len(rows), buyer_id, len(report["failed"]))
+    return report
 
-        # Add PIM scores if available
-        if pd.notna(row.get("pim_score")):
-            property_data.update({
-                "pim_score": float(row["pim_score"]),
-                "pim_env_risk": float(row["pim_env_risk"]) if pd.notna(row.get("pim_env_risk")) else None,
-                "pim_regulatory_friction": float(row["pim_regulatory_friction"]) if pd.notna(row.get("pim_regulatory_friction")) else None,
-                "pim_expandability": float(row["pim_expandability"]) if pd.notna(row.get("pim_expandability")) else None,
-                "pim_reno_recency": float(row["pim_reno_recency"]) if pd.notna(row.get("pim_reno_recency")) else None,
-                "pim_nuisance": float(row["pim_nuisance"]) if pd.notna(row.get("pim_nuisance")) else None,
-                "pim_scored_at": "now()",
-                "pim_city": row.get("city"),
-            })
 
+def save_recommendations_async(buyer_id: str, recommendations: List[Dict[str, Any]]) -> Future:
+    """
+    Fire-and-forget variant of save_recommendations_to_db.
+
+    The write runs on a single background worker thread so the caller can
+    return its response immediately. The returned Future resolves to the
+    per-row report. Note that on platforms that freeze the instance after
+    the response is sent (e.g. GCF), the write only completes once the
+    instance is resumed.
+    """
+    global _db_executor
+    if _db_executor is None:
+        _db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-save")
+    return _db_executor.submit(save_recommendations_to_db, buyer_id, list(recommendations))
+
+
+def get_write_behind_queue() -> WriteBehindQueue:
+    """
+    Lazily create and start the per-instance write-behind queue.
+
+    Rows left in the journal by a previous run of this instance are picked
+    up by the worker on start.
+    """
+    global _write_behind
+    if _write_behind is None:
+        _write_behind = WriteBehindQueue(
+            WRITE_BEHIND_PATH,
+            flush_fn=upsert_recommendation_rows,
+            batch_size=DB_UPSERT_CHUNK_SIZE,
+        )
+        atexit.register(_write_behind.stop)
+    return _write_behind.start()
+
+
+def enqueue_recommendations(buyer_id: str, recommendations: List[Dict[str, Any]]) -> int:
+    """Journal recommendations for write-behind persistence; returns rows queued"""
+    rows = [build_recommendation_row(buyer_id, row) for row in recommendations]
+    return get_write_behind_queue().enqueue(rows)
+
+
+def persist_recommendations(buyer_id: str, recommendations: List[Dict[str, Any]]):
+    """Persist recommendations using the configured DB_SAVE_MODE"""
+    if DB_SAVE_MODE == "write_behind":
         try:
-            supabase.table("buyer_properties").upsert(
-                property_data,
-                on_conflict="buyer_id,property_id"
-            ).execute()
+            queued = enqueue_recommendations(buyer_id, recommendations)
+            logs.info("DB", f"Queued {queued} recommendations for write-behind")
         except Exception as e:
-            print(f"[DB] Error saving property {row['id']}: {e}")
+            # Journal unavailable (e.g. read-only filesystem) - write directly
+            logs.warning("DB", f"Write-behind unavailable ({e}), saving synchronously")
+            save_recommendations_to_db(buyer_id, recommendations)
+    elif DB_SAVE_MODE == "async":
+        save_recommendations_async(buyer_id, recommendations)
+    else:
+        save_recommendations_to_db(buyer_id, recommendations)
 
 
-class handler(BaseHTTPRequestHandler):
+def recommendation_cache_version() -> Optional[str]:
     """
-    Vercel serverless function handler
+    Response cache version. Neither entry point excludes a buyer's
+    interactions here (buyer_id is only used for saving), so only catalog
+    changes invalidate.
     """
+    return cache_version(supabase)
 
-    def do_POST(self):
-        """Handle POST requests for property recommendations"""
-        try:
-            # Parse request body
-            content_length = int(self.headers.get('Content-Length', 0))
-            body = self.rfile.read(content_length).decode('utf-8')
-            data = json.loads(body)
-
-            # Extract parameters
-            user_prefs_text = data.get("preferences_text")
-            buyer_profile_id = data.get("buyer_profile_id")
-            preferred_areas = data.get("preferred_areas")
-            limit = data.get("limit", 50)
-
-            # If buyer_profile_id provided, fetch from database
-            prefs = None
-            if buyer_profile_id and supabase:
-                profile_response = supabase.table("buyer_profiles").select("*").eq("person_id", buyer_profile_id).execute()
-                if profile_response.data:
-                    profile = profile_response.data[0]
-                    prefs = Preferences(
-                        budget_min=profile.get("price_min") or 0,
-                        budget_max=profile.get("price_max") or 999999999,
-                        must_haves=profile.get("must_have_features") or [],
-                        nice_to_haves=profile.get("nice_to_have_features") or [],
-                        preferred_areas=profile.get("preferred_areas") or [],
-                        property_types=profile.get("property_type_preferences") or []
-                    )
-                    # Use raw_background for LLM parsing if available
-                    if not user_prefs_text and profile.get("raw_background"):
-                        user_prefs_text = profile.get("raw_background")
-
-            # Get recommendations
-            df = recommend_hybrid(
-                user_prefs_text=user_prefs_text,
-                prefs=prefs,
-                preferred_areas=preferred_areas,
-                limit=limit
-            )
 
-            # Convert to JSON
-            recommendations = df.to_dict(orient="records")
+def precomputed_recommendations(buyer_id: str, request_inputs: Dict[str, Any], limit: int) -> Optional[List[Dict[str, Any]]]:
+    """The nightly precomputed list for buyer_id if it was computed from these inputs (see precompute.py)"""
+    return load_precomputed(supabase, "full_ml", buyer_id, request_inputs, limit)
 
-            # Send response
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({
+
+def batch_response(request_json: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    """
+    (status, payload) for a batch request: {"buyers": [...], "limit": 30}.
+    Each buyer takes the recommend() fields; matching precomputed lists are
+    served as is, the other buyers share one recommend_hybrid_batch run.
+    Recommendations are saved per buyer_id, like recommend().
+    """
+    buyers = request_json.get("buyers")
+    if not isinstance(buyers, list) or not buyers:
+        return 400, {"success": False, "error": "buyers must be a non-empty list"}
+    if len(buyers) > BATCH_MAX_BUYERS:
+        return 400, {"success": False, "error": f"At most {BATCH_MAX_BUYERS} buyers per batch"}
+
+    default_limit = request_json.get("limit", 50)
+    buyer_ids: List[Optional[str]] = [None] * len(buyers)
+    outcomes: List[Any] = [None] * len(buyers)
+    usages = [TokenUsage() for _ in buyers]
+
+    with start_trace("recommend_batch", enabled=tracing_wanted(request_json.get("include_timings")), version="full_ml",
+                     request_id=logs.current().request_id) as trace:
+        pending: Dict[int, Dict[str, Any]] = {}
+        precomputed = 0
+        for i, buyer in enumerate(buyers):
+            try:
+                if not isinstance(buyer, dict):
+                    raise ValueError("Each buyer must be an object")
+                buyer_ids[i], request_inputs = buyer_request_inputs({"limit": default_limit, **buyer})
+            except Exception as e:
+                outcomes[i] = e
+                continue
+            stored = precomputed_recommendations(buyer_ids[i], request_inputs, request_inputs["limit"])
+            if stored is not None:
+                outcomes[i] = stored
+                precomputed += 1
+            else:
+                pending[i] = request_inputs
+
+        if pending:
+            computed = recommend_hybrid_batch(list(pending.values()), usages=[usages[i] for i in pending])
+            for i, outcome in zip(pending, computed):
+                outcomes[i] = outcome
+
+        results = []
+        for buyer_id, outcome, usage in zip(buyer_ids, outcomes, usages):
+            if isinstance(outcome, Exception):
+                results.append({"buyer_id": buyer_id, "success": False, "error": str(outcome),
+                                "type": type(outcome).__name__})
+                continue
+            if buyer_id:
+                persist_recommendations(buyer_id, outcome)
+            results.append({
+                "buyer_id": buyer_id,
                 "success": True,
-                "count": len(recommendations),
-                "recommendations": recommendations
-            }).encode('utf-8'))
+                "count": len(outcome),
+                "recommendations": outcome,
+                "llm_usage": usage.as_dict(len(outcome))
+            })
 
-        except Exception as e:
-            # Error response
-            self.send_response(500)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({
-                "success": False,
-                "error": str(e)
-            }).encode('utf-8'))
+    failed = sum(1 for result in results if not result["success"])
+    logs.info("Batch", "Returning %d buyers (%d failed, %d precomputed)",
+              len(results), failed, precomputed)
+    payload = {"success": True, "count": len(results), "failed": failed, "results": results}
+    if trace is not None:
+        payload["timings"] = trace.timings()
+    return 200, payload
+
+
+class handler(BaseHTTPRequestHandler):
+    """
+    Vercel serverless function handler
+    """
+
+    def do_POST(self):
+        """Handle POST requests for property recommendations"""
+        with logs.request(self.headers.get("X-Request-ID")):
+            try:
+                # Parse request body
+                content_length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(content_length).decode('utf-8')
+                data = json.loads(body)
+
+                # Many buyers at once: shared candidate enrichment (see batch_response)
+                if "buyers" in data:
+                    status, response = batch_response(data)
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(dumps_json(response))
+                    return
+
+                # Extract parameters
+                user_prefs_text = data.get("preferences_text")
+                buyer_profile_id = data.get("buyer_profile_id")
+                preferred_areas = data.get("preferred_areas")
+                limit = data.get("limit", 50)
+                search_center = parse_lat_lng(data.get("search_center"))
+                radius_miles = data.get("radius_miles")
+                search_polygon = data.get("search_polygon")
+
+                # If buyer_profile_id provided, fetch from database
+                prefs = None
+                if buyer_profile_id and supabase:
+                    profile_response = supabase.table("buyer_profiles").select("*").eq("person_id", buyer_profile_id).execute()
+                    if profile_response.data:
+                        profile = profile_response.data[0]
+                        prefs = Preferences(
+                            budget_min=profile.get("price_min") or 0,
+                            budget_max=profile.get("price_max") or 999999999,
+                            must_haves=profile.get("must_have_features") or [],
+                            nice_to_haves=profile.get("nice_to_have_features") or [],
+                            preferred_areas=profile.get("preferred_areas") or [],
+                            property_types=profile.get("property_type_preferences") or []
+                        )
+                        # Use raw_background for LLM parsing if available
+                        if not user_prefs_text and profile.get("raw_background"):
+                            user_prefs_text = profile.get("raw_background")
+
+                # Get recommendations
+                request_inputs = dict(
+                    user_prefs_text=user_prefs_text,
+                    prefs=prefs,
+                    preferred_areas=preferred_areas,
+                    limit=limit,
+                    search_center=search_center,
+                    radius_miles=radius_miles,
+                    search_polygon=search_polygon
+                )
+                llm_usage = TokenUsage()
+                deadline_seconds = request_deadline(data)
+
+                def run_pipeline():
+                    # (recommendations, stages cut short by the time budget)
+                    time_budget = TimeBudget(deadline_seconds) if deadline_seconds else None
+                    recommendations = recommend_hybrid(**request_inputs, usage=llm_usage, time_budget=time_budget)
+                    return recommendations, time_budget.degraded if time_budget else {}
+
+                # Identical requests (reloads, re-mounts) are served from the response cache
+                cache_key = request_key("full_ml", buyer_profile_id=buyer_profile_id, **request_inputs)
+                version = None if cache_bypassed(data, self.headers) else recommendation_cache_version()
+
+                profile_header = self.headers.get("X-Profile")
+                with start_trace("recommend", enabled=tracing_wanted(data.get("include_timings")), version="full_ml",
+                                 request_id=logs.current().request_id) as trace, \
+                        profile_request(profiling_wanted(profile_header), label="full_ml") as profile:
+                    (recommendations, degraded), cache_status = get_response_cache().fetch(
+                        cache_key, version, run_pipeline, cacheable=lambda value: not value[1])
+
+                response = {
+                    "success": True,
+                    "count": len(recommendations),
+                    "recommendations": recommendations,
+                    "llm_usage": llm_usage.as_dict(len(recommendations)),
+                    "degraded": degraded,
+                    "cache": cache_status
+                }
+                if trace is not None:
+                    response["timings"] = trace.timings()
+                if profile is not None and header_requested(profile_header):
+                    response["profile"] = profile.summary()
+
+                # Send response
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(dumps_json(response))
+
+            except ValueError as ve:
+                # Validation errors (e.g. a non-numeric deadline_seconds), as in the GCF entry point
+                logs.warning("Vercel Handler", f"ValueError: {ve}")
+                self.send_response(400)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({
+                    "success": False,
+                    "error": str(ve),
+                    "type": "ValueError"
+                }).encode('utf-8'))
+
+            except Exception as e:
+                # Error response
+                self.send_response(500)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({
+                    "success": False,
+                    "error": str(e)
+                }).encode('utf-8'))
 
     def do_GET(self):
         """Handle GET requests for health check"""
@@ -1082,6 +2056,92 @@ class handler(BaseHTTPRequestHandler):
 # Google Cloud Function Entry Point
 # ==============================================================================
 
+def buyer_request_inputs(request_json: Dict[str, Any]) -> Tuple[Optional[str], Dict[str, Any]]:
+    """
+    (buyer_id, recommend_hybrid keyword arguments) for one buyer of a
+    recommend() / recommend_batch() body: the buyer's profile preferences
+    when buyer_id or buyer_profile_id is given, generic defaults when there
+    is nothing to go on.
+    """
+    # Extract parameters
+    user_prefs_text = request_json.get('preferences_text')
+    buyer_id = request_json.get('buyer_id')
+    buyer_profile_id = request_json.get('buyer_profile_id')
+    preferred_areas = request_json.get('preferred_areas')
+    limit = request_json.get('limit', 50)
+    loved_property_ids = request_json.get('loved_property_ids')
+    search_center = parse_lat_lng(request_json.get('search_center'))
+    radius_miles = request_json.get('radius_miles')
+    search_polygon = request_json.get('search_polygon')
+
+    # Initialize preferences object
+    prefs = None
+
+    # If buyer_id or buyer_profile_id provided, fetch profile from Supabase
+    if buyer_id or buyer_profile_id:
+        try:
+            if supabase:
+                # First, try to get buyer_profile_id if we only have buyer_id
+                if buyer_id and not buyer_profile_id:
+                    logs.info("GCP Function", f"Looking up buyer profile for buyer_id: {buyer_id}")
+                    buyer_response = supabase.table("buyers").select("buyer_profile_id").eq("id", buyer_id).maybe_single().execute()
+                    if buyer_response.data and buyer_response.data.get("buyer_profile_id"):
+                        buyer_profile_id = buyer_response.data["buyer_profile_id"]
+                        logs.info("GCP Function", f"Found buyer_profile_id: {buyer_profile_id}")
+
+                # Now fetch the profile if we have a profile ID
+                if buyer_profile_id:
+                    logs.info("GCP Function", f"Fetching buyer profile: {buyer_profile_id}")
+                    response = supabase.table("buyer_profiles").select("*").eq("id", buyer_profile_id).maybe_single().execute()
+
+                    if response.data:
+                        profile = response.data
+                        prefs = Preferences(
+                            budget_min=profile.get("price_min") or 0,
+                            budget_max=profile.get("price_max") or 999999999,
+                            must_haves=profile.get("must_have_features") or [],
+                            nice_to_haves=profile.get("nice_to_have_features") or [],
+                            preferred_areas=profile.get("preferred_areas") or [],
+                            property_types=profile.get("property_type_preferences") or []
+                        )
+                        # Use raw_background for LLM parsing if available and no prefs_text provided
+                        if not user_prefs_text and profile.get("raw_background"):
+                            user_prefs_text = profile.get("raw_background")
+                        logs.info("GCP Function", "Loaded buyer profile successfully")
+                    else:
+                        logs.info("GCP Function", f"No buyer profile found for ID: {buyer_profile_id}")
+                else:
+                    logs.info("GCP Function", f"No buyer_profile_id found for buyer_id: {buyer_id}")
+        except Exception as profile_error:
+            logs.warning("GCP Function", f"Could not load buyer profile: {profile_error}")
+            # Continue without profile - will use preferences_text or fail gracefully
+
+    # If we still don't have preferences or text, create default preferences
+    if not prefs and not user_prefs_text:
+        logs.info("GCP Function", "No preferences found - creating default preferences")
+        prefs = Preferences(
+            budget_min=0,
+            budget_max=999999999,
+            must_haves=[],
+            nice_to_haves=[],
+            preferred_areas=preferred_areas or [],
+            property_types=[]
+        )
+        # Set a generic preferences text for LLM scoring
+        user_prefs_text = "Looking for a property that matches my budget and preferred areas."
+
+    return buyer_id, dict(
+        user_prefs_text=user_prefs_text,
+        prefs=prefs,
+        preferred_areas=preferred_areas,
+        limit=limit,
+        loved_property_ids=loved_property_ids,
+        search_center=search_center,
+        radius_miles=radius_miles,
+        search_polygon=search_polygon
+    )
+
+
 def recommend(request):
     """
     Google Cloud Function entry point for property recommendations.
@@ -1096,14 +2156,20 @@ def recommend(request):
         "buyer_profile_id": "uuid",                              // optional
         "preferred_areas": ["Mountain View", "Palo Alto"],       // optional
         "limit": 30,                                             // optional, default 50
-        "loved_property_ids": ["uuid1", "uuid2"]                 // optional, for similarity
+        "loved_property_ids": ["uuid1", "uuid2"],                // optional, for similarity
+        "search_center": {"lat": 37.77, "lng": -122.42},         // optional, geo search
+        "radius_miles": 3,                                       // optional, geo search
+        "search_polygon": [[37.78, -122.45], [37.76, -122.40], ...],  // optional, geo search
+        "deadline_seconds": 20,                                  // optional, default RECOMMEND_DEADLINE_SECONDS (none)
+        "include_timings": true                                  // optional, adds "timings"
     }
 
     Returns:
     {
         "success": true,
         "count": 10,
-        "recommendations": [...]
+        "recommendations": [...],
+        "degraded": {"pim": "service scores for 12/40 listings"}  // stages cut by the deadline
     }
     """
     # Handle CORS preflight OPTIONS request
@@ -1122,135 +2188,154 @@ def recommend(request):
         'Access-Control-Allow-Origin': '*'
     }
 
-    try:
-        # Parse JSON request body
-        request_json = request.get_json(silent=True)
-        if not request_json:
-            return (json.dumps({
+    with logs.request(request.headers.get("X-Request-ID")):
+        try:
+            # Parse JSON request body
+            request_json = request.get_json(silent=True)
+            if not request_json:
+                return (json.dumps({
+                    "success": False,
+                    "error": "Request body must be JSON"
+                }), 400, headers)
+
+            logs.debug("GCP Function", "Received request: %s", request_json)
+
+            buyer_id, request_inputs = buyer_request_inputs(request_json)
+            limit = request_inputs["limit"]
+
+            # Get recommendations using the hybrid model
+            logs.info("GCP Function", f"Calling recommend_hybrid with limit={limit}")
+            llm_usage = TokenUsage()
+            deadline_seconds = request_deadline(request_json)
+
+            def run_pipeline():
+                # (recommendations, stages cut short by the time budget)
+                time_budget = None
+                recommendations = precomputed_recommendations(buyer_id, request_inputs, limit)
+                if recommendations is None:
+                    time_budget = TimeBudget(deadline_seconds) if deadline_seconds else None
+                    recommendations = recommend_hybrid(**request_inputs, usage=llm_usage, time_budget=time_budget)
+                # Save recommendations to database if buyer_id provided
+                if buyer_id:
+                    logs.info("GCP Function", f"Saving {len(recommendations)} recommendations to database for buyer: {buyer_id}")
+                    persist_recommendations(buyer_id, recommendations)
+                return recommendations, time_budget.degraded if time_budget else {}
+
+            # Identical requests (reloads, re-mounts) are served from the response cache;
+            # a cached response was already saved when it was computed. Stale entries are
+            # recomputed in the request (no background refresh that would persist after it)
+            cache_key = request_key("full_ml", buyer_id=buyer_id, **request_inputs)
+            version = None if cache_bypassed(request_json, request.headers) else recommendation_cache_version()
+
+            profile_header = request.headers.get("X-Profile")
+            with start_trace("recommend", enabled=tracing_wanted(request_json.get("include_timings")), version="full_ml",
+                             request_id=logs.current().request_id) as trace, \
+                    profile_request(profiling_wanted(profile_header), label="full_ml") as profile:
+                (recommendations, degraded), cache_status = get_response_cache().fetch(
+                    cache_key, version, run_pipeline, cacheable=lambda value: not value[1], revalidate=False)
+
+            logs.info("GCP Function", f"Returning {len(recommendations)} recommendations")
+
+            # Return success response
+            response_data = {
+                "success": True,
+                "count": len(recommendations),
+                "recommendations": recommendations,
+                "llm_usage": llm_usage.as_dict(len(recommendations)),
+                "degraded": degraded,
+                "cache": cache_status
+            }
+            if trace is not None:
+                response_data["timings"] = trace.timings()
+            if profile is not None and header_requested(profile_header):
+                response_data["profile"] = profile.summary()
+
+            return (dumps_json(response_data), 200, headers)
+
+        except ValueError as ve:
+            # Validation errors (missing parameters, etc.)
+            error_response = {
                 "success": False,
-                "error": "Request body must be JSON"
-            }), 400, headers)
+                "error": str(ve),
+                "type": "ValueError"
+            }
+            logs.warning("GCP Function", f"ValueError: {ve}")
+            return (json.dumps(error_response), 400, headers)
 
-        print(f"[GCP Function] Received request: {request_json}")
+        except Exception as e:
+            # Unexpected errors
+            import traceback
+            error_response = {
+                "success": False,
+                "error": str(e),
+                "type": type(e).__name__,
+                "traceback": traceback.format_exc()
+            }
+            logs.error("GCP Function", "%s\n%s", e, traceback.format_exc())
+            return (json.dumps(error_response), 500, headers)
 
-        # Extract parameters
-        user_prefs_text = request_json.get('preferences_text')
-        buyer_id = request_json.get('buyer_id')
-        buyer_profile_id = request_json.get('buyer_profile_id')
-        preferred_areas = request_json.get('preferred_areas')
-        limit = request_json.get('limit', 50)
-        loved_property_ids = request_json.get('loved_property_ids')
 
-        # Initialize preferences object
-        prefs = None
+def recommend_batch(request):
+    """
+    Google Cloud Function entry point for many buyers at once, e.g. an agent
+    refreshing their whole roster. Candidates shared by several buyers are
+    enriched (schools, Places, PIM) once per batch.
 
-        # If buyer_id or buyer_profile_id provided, fetch profile from Supabase
-        if buyer_id or buyer_profile_id:
-            try:
-                from supabase import create_client
-                supabase_url = os.environ.get("SUPABASE_URL")
-                supabase_key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
-
-                if supabase_url and supabase_key:
-                    supabase = create_client(supabase_url, supabase_key)
-
-                    # First, try to get buyer_profile_id if we only have buyer_id
-                    if buyer_id and not buyer_profile_id:
-                        print(f"[GCP Function] Looking up buyer profile for buyer_id: {buyer_id}")
-                        buyer_response = supabase.table("buyers").select("buyer_profile_id").eq("id", buyer_id).maybe_single().execute()
-                        if buyer_response.data and buyer_response.data.get("buyer_profile_id"):
-                            buyer_profile_id = buyer_response.data["buyer_profile_id"]
-                            print(f"[GCP Function] Found buyer_profile_id: {buyer_profile_id}")
-
-                    # Now fetch the profile if we have a profile ID
-                    if buyer_profile_id:
-                        print(f"[GCP Function] Fetching buyer profile: {buyer_profile_id}")
-                        response = supabase.table("buyer_profiles").select("*").eq("id", buyer_profile_id).maybe_single().execute()
-
-                        if response.data:
-                            profile = response.data
-                            prefs = Preferences(
-                                budget_min=profile.get("price_min") or 0,
-                                budget_max=profile.get("price_max") or 999999999,
-                                must_haves=profile.get("must_have_features") or [],
-                                nice_to_haves=profile.get("nice_to_have_features") or [],
-                                preferred_areas=profile.get("preferred_areas") or [],
-                                property_types=profile.get("property_type_preferences") or []
-                            )
-                            # Use raw_background for LLM parsing if available and no prefs_text provided
-                            if not user_prefs_text and profile.get("raw_background"):
-                                user_prefs_text = profile.get("raw_background")
-                            print(f"[GCP Function] Loaded buyer profile successfully")
-                        else:
-                            print(f"[GCP Function] No buyer profile found for ID: {buyer_profile_id}")
-                    else:
-                        print(f"[GCP Function] No buyer_profile_id found for buyer_id: {buyer_id}")
-            except Exception as profile_error:
-                print(f"[GCP Function] Warning: Could not load buyer profile: {profile_error}")
-                # Continue without profile - will use preferences_text or fail gracefully
-
-        # If we still don't have preferences or text, create default preferences
-        if not prefs and not user_prefs_text:
-            print("[GCP Function] No preferences found - creating default preferences")
-            prefs = Preferences(
-                budget_min=0,
-                budget_max=999999999,
-                must_haves=[],
-                nice_to_haves=[],
-                preferred_areas=preferred_areas or [],
-                property_types=[]
-            )
-            # Set a generic preferences text for LLM scoring
-            user_prefs_text = "Looking for a property that matches my budget and preferred areas."
-
-        # Get recommendations using the hybrid model
-        print(f"[GCP Function] Calling recommend_hybrid with limit={limit}")
-        df = recommend_hybrid(
-            user_prefs_text=user_prefs_text,
-            prefs=prefs,
-            preferred_areas=preferred_areas,
-            limit=limit,
-            loved_property_ids=loved_property_ids
-        )
+    Expected request body:
+    {
+        "buyers": [                                              // required, up to BATCH_MAX_BUYERS
+            {"buyer_id": "uuid", "loved_property_ids": [...]},   // same fields as recommend()
+            {"preferences_text": "2 bed condo...", "limit": 10}
+        ],
+        "limit": 30,                                             // optional, default per buyer
+        "include_timings": true                                  // optional, adds "timings"
+    }
 
-        # Save recommendations to database if buyer_id provided
-        if buyer_id:
-            print(f"[GCP Function] Saving {len(df)} recommendations to database for buyer: {buyer_id}")
-            save_recommendations_to_db(buyer_id, df)
+    Returns:
+    {
+        "success": true,
+        "count": 2,
+        "failed": 0,
+        "results": [{"buyer_id": "uuid", "success": true, "count": 30, "recommendations": [...]}, ...]
+    }
+    """
+    if request.method == 'OPTIONS':
+        headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'POST, OPTIONS',
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Max-Age': '3600'
+        }
+        return ('', 204, headers)
 
-        # Convert DataFrame to list of dicts
-        recommendations = df.to_dict(orient="records")
+    headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*'
+    }
 
-        print(f"[GCP Function] Returning {len(recommendations)} recommendations")
+    with logs.request(request.headers.get("X-Request-ID")):
+        try:
+            request_json = request.get_json(silent=True)
+            if not request_json:
+                return (json.dumps({
+                    "success": False,
+                    "error": "Request body must be JSON"
+                }), 400, headers)
 
-        # Return success response
-        response_data = {
-            "success": True,
-            "count": len(recommendations),
-            "recommendations": recommendations
-        }
+            status, response_data = batch_response(request_json)
+            return (dumps_json(response_data), status, headers)
 
-        return (json.dumps(response_data), 200, headers)
+        except Exception as e:
+            import traceback
+            error_response = {
+                "success": False,
+                "error": str(e),
+                "type": type(e).__name__,
+                "traceback": traceback.format_exc()
+            }
+            logs.error("GCP Function", "%s\n%s", e, traceback.format_exc())
+            return (json.dumps(error_response), 500, headers)
 
-    except ValueError as ve:
-        # Validation errors (missing parameters, etc.)
-        error_response = {
-            "success": False,
-            "error": str(ve),
-            "type": "ValueError"
-        }
-        print(f"[GCP Function] ValueError: {ve}")
-        return (json.dumps(error_response), 400, headers)
 
-    except Exception as e:
-        # Unexpected errors
-        import traceback
-        error_response = {
-            "success": False,
-            "error": str(e),
-            "type": type(e).__name__,
-            "traceback": traceback.format_exc()
-        }
-        print(f"[GCP Function] Error: {e}")
-        print(traceback.format_exc())
-        return (json.dumps(error_response), 500, headers)
+# Record/replay external calls when CASSETTE_MODE is set (see cassette.py)
+cassette.install_from_env(sys.modules[__name__])
@@ -5,14 +5,45 @@ For Full ML version, see recommend_full_ml.py
 """
 
 from http.server import BaseHTTPRequestHandler
+import contextvars
 import json
 import math
 import os
+import sys
+import time
 from typing import Dict, List, Any, Optional, Tuple
 from dataclasses import dataclass
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
 from openai import OpenAI
 import requests
 
+from commute import commute_minutes_for_listings, geocode_address
+from embedding_index import (EMBEDDING_INDEX_PATH, SEMANTIC_POOL_FACTOR, SEMANTIC_SEARCH_SIZE, get_embedding_index,
+                             rank_by_hits, semantic_prerank, semantic_search)
+from feature_snapshot import FeatureSnapshot, get_feature_snapshot, sync_if_due
+from llm_client import Deadline, parse_preferences, score_listings
+from llm_prompt import TokenUsage
+from geo import grouped_min_distance_miles, parse_lat_lng, polygon_to_geojson
+from similarity import (
+    build_feature_matrix,
+    cache_loved_vectors,
+    feedback_adjustment,
+    feedback_weights,
+    get_cached_loved_vectors,
+    get_feedback_centroid,
+    similarity_boost,
+    similarity_to_loved,
+)
+from poi_index import get_poi_store
+import cassette
+import logs
+from precompute import load_precomputed
+from response_cache import cache_bypassed, cache_version, get_response_cache, request_key
+from profiling import header_requested, profile_request, profiling_wanted
+from time_budget import TimeBudget, measured, observe, request_deadline
+from tracing import cache_lookup, count_call, span, start_trace, traced, tracing_wanted
+
 # Supabase connection
 try:
     from supabase import create_client, Client
@@ -55,7 +86,13 @@ PLACES_TYPES = {
     "transit": {"includedTypes": ["transit_station", "subway_station", "train_station"], "radius_miles": 1.0},
 }
 
+# Local POI snapshot (see poi_index.py); Places API is only used outside its coverage
+POI_SNAPSHOT_PATH = os.environ.get("POI_SNAPSHOT_PATH")
+FEATURE_SNAPSHOT_PATH = os.environ.get("FEATURE_SNAPSHOT_PATH")
+FEATURE_SNAPSHOT_SYNC_SECONDS = int(os.environ.get("FEATURE_SNAPSHOT_SYNC_SECONDS", "300"))
+
 
+@traced("places.search_nearby")
 def places_nearby(lat: float, lon: float, included_types: List[str],
                   radius_miles: float, max_results: int = 8) -> List[Dict[str, Any]]:
     """
@@ -64,7 +101,7 @@ def places_nearby(lat: float, lon: float, included_types: List[str],
     """
     api_key = os.environ.get("GOOGLE_PLACES_API_KEY")
     if not api_key:
-        print("[Places API] Warning: GOOGLE_PLACES_API_KEY not configured, skipping POI enrichment")
+        logs.count("Places API", "not_configured")
         return []
 
     url = "https://places.googleapis.com/v1/places:searchNearby"
@@ -85,55 +122,104 @@ def places_nearby(lat: float, lon: float, included_types: List[str],
         "Content-Type": "application/json",
     }
 
+    count_call("places")
     try:
         resp = requests.post(url, headers=headers, json=body, timeout=10)
         if resp.status_code != 200:
-            print(f"[Places API] Error {resp.status_code}: {resp.text[:200]}")
+            logs.count("Places API", f"http_{resp.status_code}", example=resp.text[:80])
             return []
+        logs.count("Places API", "ok")
         return (resp.json() or {}).get("places", []) or []
     except Exception as e:
-        print(f"[Places API] Exception: {e}")
+        logs.count("Places API", "exception", example=e)
         return []
 
 
-def enrich_with_places(listing: Dict[str, Any], poi_keys: List[str] = None) -> Dict[str, Any]:
+def enrich_listings_with_places(listings: List[Dict[str, Any]],
+                                poi_keys: List[str] = None, time_budget: TimeBudget = None) -> List[Dict[str, Any]]:
     """
-    Enrich listing with nearby POI distances using Google Places API
-    Returns dict with poi_min_miles and poi_counts
+    Enrich a batch of listings with nearby POI distances using Google Places API
+
+    Listings inside the local POI snapshot (POI_SNAPSHOT_PATH) are answered
+    from its spatial index without any API call. Remaining listings are
+    looked up per (listing, POI type), with all distances computed in one
+    vectorized haversine call and reduced to per-type minimums. With a
+    time_budget, only as many listings as fit are looked up (see time_budget.py).
+    Returns one {"poi_min_miles", "poi_counts"} dict per listing.
     """
     if poi_keys is None:
         poi_keys = ["school", "supermarket", "park", "transit"]
+    keys = [k for k in poi_keys if k in PLACES_TYPES]
 
-    lat, lon = listing.get("latitude"), listing.get("longitude")
-    if lat is None or lon is None:
-        return {"poi_min_miles": {}, "poi_counts": {}}
-
-    poi_min, poi_counts = {}, {}
+    results = [{"poi_min_miles": {}, "poi_counts": {}} for _ in listings]
+    slots, src_lat, src_lon, dst_lat, dst_lon = [], [], [], [], []
+    store = get_poi_store(POI_SNAPSHOT_PATH)
+    served_locally = 0
 
-    for k in poi_keys:
-        if k not in PLACES_TYPES:
+    lookups = []
+    for li, listing in enumerate(listings):
+        lat, lon = listing.get("latitude"), listing.get("longitude")
+        if lat is None or lon is None:
             continue
 
-        spec = PLACES_TYPES[k]
-        places = places_nearby(lat, lon, spec["includedTypes"], spec.get("radius_miles", 2.0), max_results=8)
-
-        dists = []
-        for p in places:
-            loc = p.get("location", {}) or {}
-            plat = loc.get("latitude")
-            plon = loc.get("longitude")
-
-            if plat is not None and plon is not None:
+        if store is not None and store.covers(float(lat), float(lon)):
+            results[li] = store.enrich(float(lat), float(lon), keys, PLACES_TYPES)
+            served_locally += 1
+            continue
+        lookups.append(li)
+
+    # Under a time budget only the first listings that fit are looked up; the rest go without POI data
+    if time_budget is not None:
+        allowed = time_budget.affordable("places", len(lookups), reserve=("llm",))
+        if allowed < len(lookups):
+            time_budget.degrade("places", f"nearby searches for {allowed}/{len(lookups)} listings")
+            lookups = lookups[:allowed]
+
+    start = time.perf_counter()
+    for li in lookups:
+        lat, lon = listings[li]["latitude"], listings[li]["longitude"]
+        for ki, k in enumerate(keys):
+            spec = PLACES_TYPES[k]
+            places = places_nearby(lat, lon, spec["includedTypes"], spec.get("radius_miles", 2.0), max_results=8)
+            results[li]["poi_counts"][k] = len(places)
+
+            for p in places:
+                loc = p.get("location", {}) or {}
                 try:
-                    dist = haversine_miles(lat, lon, float(plat), float(plon))
-                    dists.append(dist)
-                except Exception:
-                    pass
+                    plat = float(loc.get("latitude"))
+                    plon = float(loc.get("longitude"))
+                except (TypeError, ValueError):
+                    continue  # Missing or malformed location: skip before appending anything
+                dst_lat.append(plat)
+                dst_lon.append(plon)
+                src_lat.append(float(lat))
+                src_lon.append(float(lon))
+                slots.append(li * len(keys) + ki)
+    observe("places", time.perf_counter() - start, len(lookups))
+
+    logs.summary("Places API", "Nearby searches for %d listings", len(listings))
+    if store is not None:
+        cache_lookup("poi_snapshot", True, served_locally)
+        cache_lookup("poi_snapshot", False, len(listings) - served_locally)
+        logs.info("POI Index", f"Served {served_locally}/{len(listings)} listings from local snapshot")
+
+    mins = grouped_min_distance_miles(src_lat, src_lon, dst_lat, dst_lon, slots, len(listings) * len(keys))
+
+    for li, result in enumerate(results):
+        for ki, k in enumerate(keys):
+            if k in result["poi_counts"] and k not in result["poi_min_miles"]:
+                dist = mins[li * len(keys) + ki]
+                result["poi_min_miles"][k] = None if np.isnan(dist) else float(dist)
+
+    return results
 
-        poi_min[k] = min(dists) if dists else None
-        poi_counts[k] = len(places)
 
-    return {"poi_min_miles": poi_min, "poi_counts": poi_counts}
+def enrich_with_places(listing: Dict[str, Any], poi_keys: List[str] = None) -> Dict[str, Any]:
+    """
+    Enrich listing with nearby POI distances using Google Places API
+    Returns dict with poi_min_miles and poi_counts
+    """
+    return enrich_listings_with_places([listing], poi_keys=poi_keys)[0]
 
 
 @dataclass
@@ -151,6 +237,8 @@ class Preferences:
     property_types: List[str] = None
     school_priority: str = "medium"  # "low", "medium", "high"
     commute_address: str = None  # Optional commute destination
+    commute_mode: str = "driving"  # "driving", "transit", "bicycling", "walking"
+    max_commute_minutes: int = None  # Optional commute tolerance
 
     def __post_init__(self):
         if self.must_haves is None:
@@ -163,8 +251,13 @@ class Preferences:
             self.property_types = []
 
 
-def parse_prefs_llm(user_text: str) -> Preferences:
-    """Parse free-form buyer preferences using OpenAI LLM"""
+def parse_prefs_llm(user_text: str, usage: TokenUsage = None, deadline: Deadline = None) -> Preferences:
+    """
+    Parse free-form buyer preferences using OpenAI LLM
+
+    Invalid fields are dropped; if the LLM cannot be reached the default
+    (unfiltered) preferences are returned.
+    """
     prompt = f"""
 You are a real estate assistant. Extract structured preferences from this buyer's description.
 
@@ -182,23 +275,126 @@ Return a JSON with these fields:
 - nice_to_haves (list of strings, preferred but not required)
 - preferred_areas (list of city names or neighborhoods)
 - property_types (list of strings like "Single Family", "Condo", "Townhouse")
+- commute_address (string, work or other regular commute destination if mentioned, else null)
+- commute_mode (one of "driving", "transit", "bicycling", "walking", default "driving")
+- max_commute_minutes (integer, maximum acceptable commute if mentioned, else null)
 
 Only output valid JSON, nothing else.
 """
 
-    response = openai_client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.0
-    )
+    fields = parse_preferences(openai_client, prompt, deadline=deadline, usage=usage)
+    if fields is None:
+        logs.warning("LLM", "Preference parsing unavailable, using default preferences")
+        fields = {}
+    return Preferences(**fields)
+
+
+PROPERTY_COLUMNS = (
+    "id, address, city, state, zip_code, coordinates, "
+    "listing_price, bedrooms, bathrooms, square_feet, lot_size, "
+    "property_type, year_built, description, "
+    "school_avg_rating, school_closest_miles, school_best_elementary, school_best_middle, school_best_high, "
+    "zillow_property_id, data_source"
+)
+
+
+def normalize_property_row(prop: Dict[str, Any]) -> Dict[str, Any]:
+    """Normalize a properties row to the listing shape used for scoring"""
+    return {
+        "id": prop["id"],  # Database UUID (for adding to buyer_properties)
+        "zpid": prop.get("zillow_property_id") or prop["id"],  # Display ID
+        "address": prop.get("address") or "",
+        "city": prop.get("city") or "",
+        "state": prop.get("state") or "",
+        "zipcode": prop.get("zip_code") or "",
+        "price": prop.get("listing_price") or 0,
+        "bedrooms": prop.get("bedrooms") or 0,
+        "bathrooms": prop.get("bathrooms") or 0,
+        "livingArea": prop.get("square_feet") or 0,
+        "lotSize": prop.get("lot_size") or 0,
+        "propertyType": prop.get("property_type") or "",
+        "yearBuilt": prop.get("year_built"),
+        "description": prop.get("description") or "",
+        "latitude": prop.get("coordinates", {}).get("lat") if isinstance(prop.get("coordinates"), dict) else None,
+        "longitude": prop.get("coordinates", {}).get("lng") if isinstance(prop.get("coordinates"), dict) else None,
+        "avg_school_rating": prop.get("school_avg_rating"),  # Precomputed (migration 0015)
+        "closest_school_miles": prop.get("school_closest_miles"),
+        "best_elementary_rating": prop.get("school_best_elementary"),
+        "best_middle_rating": prop.get("school_best_middle"),
+        "best_high_rating": prop.get("school_best_high"),
+        "_raw": prop
+    }
+
+
+def fetch_interacted_property_ids(buyer_id: str = None) -> List[str]:
+    """Property ids in buyer_properties for buyer_id (active AND inactive)"""
+    if not buyer_id or not supabase:
+        return []
+    try:
+        count_call("supabase")
+        interaction_response = supabase.table("buyer_properties").select("property_id").eq(
+            "buyer_id", buyer_id
+        ).execute()  # Removed .eq("is_active", True) - exclude ALL properties
+
+        excluded_property_ids = [row["property_id"] for row in interaction_response.data]
+        logs.info("DB Filter", f"Excluding {len(excluded_property_ids)} already-interacted properties for buyer {buyer_id}")
+        return excluded_property_ids
+    except Exception as e:
+        logs.warning("DB Filter", f"Could not fetch interactions: {e}")
+    return []
+
+
+def fetch_geo_candidate_ids(
+    center: Optional[Tuple[float, float]] = None,
+    radius_miles: float = None,
+    polygon: List[Tuple[float, float]] = None,
+    min_price: int = 0,
+    max_price: int = 999999999,
+    min_beds: int = 0,
+    min_baths: float = 0,
+    property_types: List[str] = None,
+    exclude_ids: List[str] = None,
+    limit: int = 100,
+    updated_since: str = None,
+    candidate_ids: List[str] = None
+) -> Optional[List[Tuple[str, float]]]:
+    """
+    Nearest-first candidate ids within a radius and/or polygon via the
+    search_properties_geo RPC (PostGIS). Returns [(property_id, distance_miles)]
+    or None if the RPC is unavailable.
+    """
+    params: Dict[str, Any] = {"max_results": limit}
+    if center:
+        params["center_lat"], params["center_lng"] = center
+    if radius_miles:
+        params["radius_miles"] = float(radius_miles)
+    if polygon:
+        params["polygon"] = polygon_to_geojson(polygon)
+    if min_price and min_price > 0:
+        params["min_price"] = min_price
+    if max_price is not None and max_price < 999999999:
+        params["max_price"] = max_price
+    if min_beds and min_beds > 0:
+        params["min_beds"] = min_beds
+    if min_baths and min_baths > 0:
+        params["min_baths"] = min_baths
+    if property_types:
+        params["property_types"] = property_types
+    if exclude_ids:
+        params["exclude_ids"] = exclude_ids
+    if updated_since:
+        params["updated_since"] = updated_since
+    if candidate_ids is not None:
+        params["candidate_ids"] = candidate_ids
 
-    result_text = response.choices[0].message.content.strip()
-    if result_text.startswith("```"):
-        lines = result_text.split("\n")
-        result_text = "\n".join(lines[1:-1])
+    try:
+        count_call("supabase")
+        response = supabase.rpc("search_properties_geo", params).execute()
+    except Exception as e:
+        logs.warning("Geo Search", f"RPC unavailable, falling back to area filter: {e}")
+        return None
 
-    parsed = json.loads(result_text)
-    return Preferences(**parsed)
+    return [(row["property_id"], row["distance_miles"]) for row in (response.data or [])]
 
 
 def fetch_properties_from_supabase(
@@ -210,7 +406,12 @@ def fetch_properties_from_supabase(
     property_types: List[str] = None,
     limit: int = 100,
     buyer_id: str = None,
-    exclude_interacted: bool = True
+    exclude_interacted: bool = True,
+    center: Optional[Tuple[float, float]] = None,
+    radius_miles: float = None,
+    polygon: List[Tuple[float, float]] = None,
+    updated_since: str = None,
+    property_ids: List[str] = None
 ) -> List[Dict[str, Any]]:
     """
     Fetch properties from Supabase database with filters
@@ -218,6 +419,13 @@ def fetch_properties_from_supabase(
     OPTIMIZATION: If buyer_id is provided and exclude_interacted=True,
     properties already in buyer_properties (where is_active=true) are
     excluded at the DATABASE level (not in Python), making queries much faster.
+
+    Geo mode: with center + radius_miles and/or polygon, candidates come from
+    the PostGIS index nearest-first (with distance_miles) instead of by city.
+
+    updated_since (ISO timestamp) restricts candidates to listings changed
+    after it (incremental precompute runs); property_ids restricts them to
+    those ids (semantic search hits).
     """
     if not supabase:
         return []
@@ -225,28 +433,48 @@ def fetch_properties_from_supabase(
     # OPTIMIZATION: Fetch already-interacted property IDs to exclude them
     # Exclude ALL properties in buyer_properties (active AND inactive)
     # Only properties that were DELETED (hard delete) can be re-recommended
-    excluded_property_ids = []
-    if buyer_id and exclude_interacted:
-        try:
-            interaction_response = supabase.table("buyer_properties").select("property_id").eq(
-                "buyer_id", buyer_id
-            ).execute()  # Removed .eq("is_active", True) - exclude ALL properties
-
-            excluded_property_ids = [row["property_id"] for row in interaction_response.data]
-            print(f"[DB Filter] Excluding {len(excluded_property_ids)} already-interacted properties for buyer {buyer_id}")
-        except Exception as e:
-            print(f"[DB Filter] Warning: Could not fetch interactions: {e}")
-
-    query = supabase.table("properties").select(
-        "id, address, city, state, zip_code, coordinates, "
-        "listing_price, bedrooms, bathrooms, square_feet, lot_size, "
-        "property_type, year_built, description, schools, "
-        "zillow_property_id, data_source"
-    )
+    excluded_property_ids = fetch_interacted_property_ids(buyer_id) if exclude_interacted else []
+
+    # Geo retrieval mode: nearest candidates within radius / polygon
+    if (center and radius_miles) or polygon:
+        geo_hits = fetch_geo_candidate_ids(
+            center=center,
+            radius_miles=radius_miles,
+            polygon=polygon,
+            min_price=min_price,
+            max_price=max_price,
+            min_beds=min_beds,
+            min_baths=min_baths,
+            property_types=property_types,
+            exclude_ids=excluded_property_ids,
+            limit=limit,
+            updated_since=updated_since,
+            candidate_ids=property_ids
+        )
+        if geo_hits is not None:
+            logs.info("Geo Search", f"{len(geo_hits)} candidates within search area")
+            if not geo_hits:
+                return []
+            distance_by_id = dict(geo_hits)
+            count_call("supabase")
+            response = supabase.table("properties").select(PROPERTY_COLUMNS).in_("id", list(distance_by_id)).execute()
+            rows = sorted(response.data, key=lambda r: distance_by_id.get(r["id"], math.inf))
+            properties = []
+            for prop in rows:
+                normalized = normalize_property_row(prop)
+                normalized["distance_miles"] = distance_by_id.get(prop["id"])
+                properties.append(normalized)
+            return properties
+
+    query = supabase.table("properties").select(PROPERTY_COLUMNS)
 
     # OPTIMIZATION: Exclude already-interacted properties at SQL level
     if excluded_property_ids:
         query = query.not_.in_("id", excluded_property_ids)
+    if updated_since:
+        query = query.gt("updated_at", updated_since)
+    if property_ids is not None:
+        query = query.in_("id", property_ids)
 
     if min_price and min_price > 0:
         query = query.gte("listing_price", min_price)
@@ -267,24 +495,24 @@ def fetch_properties_from_supabase(
         used_area_filter = True
 
     query = query.limit(limit)
+    count_call("supabase")
     response = query.execute()
 
     # FALLBACK: If preferred_areas filter returned 0 results, retry without it
     # This handles cases where preferred_areas are neighborhoods, not cities
     if used_area_filter and len(response.data) == 0:
-        print(f"[DB Filter] No properties found matching preferred_areas={preferred_areas} as cities")
-        print(f"[DB Filter] Retrying without area filter (preferred_areas may be neighborhoods)")
+        logs.info("DB Filter", f"No properties found matching preferred_areas={preferred_areas} as cities")
+        logs.info("DB Filter", "Retrying without area filter (preferred_areas may be neighborhoods)")
 
         # Rebuild query without the city filter
-        query = supabase.table("properties").select(
-            "id, address, city, state, zip_code, coordinates, "
-            "listing_price, bedrooms, bathrooms, square_feet, lot_size, "
-            "property_type, year_built, description, schools, "
-            "zillow_property_id, data_source"
-        )
+        query = supabase.table("properties").select(PROPERTY_COLUMNS)
 
         if excluded_property_ids:
             query = query.not_.in_("id", excluded_property_ids)
+        if updated_since:
+            query = query.gt("updated_at", updated_since)
+        if property_ids is not None:
+            query = query.in_("id", property_ids)
         if min_price and min_price > 0:
             query = query.gte("listing_price", min_price)
         if max_price is not None and max_price < 999999999:
@@ -298,46 +526,108 @@ def fetch_properties_from_supabase(
         # Skip preferred_areas filter
 
         query = query.limit(limit)
+        count_call("supabase")
         response = query.execute()
-        print(f"[DB Filter] Fallback query returned {len(response.data)} properties")
+        logs.info("DB Filter", f"Fallback query returned {len(response.data)} properties")
 
-    properties = []
-    for prop in response.data:
-        normalized = {
-            "id": prop["id"],  # Database UUID (for adding to buyer_properties)
-            "zpid": prop.get("zillow_property_id") or prop["id"],  # Display ID
-            "address": prop.get("address") or "",
-            "city": prop.get("city") or "",
-            "state": prop.get("state") or "",
-            "zipcode": prop.get("zip_code") or "",
-            "price": prop.get("listing_price") or 0,
-            "bedrooms": prop.get("bedrooms") or 0,
-            "bathrooms": prop.get("bathrooms") or 0,
-            "livingArea": prop.get("square_feet") or 0,
-            "lotSize": prop.get("lot_size") or 0,
-            "propertyType": prop.get("property_type") or "",
-            "yearBuilt": prop.get("year_built"),
-            "description": prop.get("description") or "",
-            "latitude": prop.get("coordinates", {}).get("lat") if isinstance(prop.get("coordinates"), dict) else None,
-            "longitude": prop.get("coordinates", {}).get("lng") if isinstance(prop.get("coordinates"), dict) else None,
-            "schools": prop.get("schools") or [],
-            "_raw": prop
-        }
-        properties.append(normalized)
+    return [normalize_property_row(prop) for prop in response.data]
+
+
+def fetch_properties_from_snapshot(
+    snapshot: FeatureSnapshot,
+    preferred_areas: List[str] = None,
+    min_price: int = 0,
+    max_price: int = 999999999,
+    min_beds: int = 0,
+    min_baths: float = 0,
+    property_types: List[str] = None,
+    must_haves: List[str] = None,
+    limit: int = 100,
+    buyer_id: str = None,
+    center: Optional[Tuple[float, float]] = None,
+    radius_miles: float = None,
+    property_ids: List[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Select candidates in-process from the local feature snapshot
+
+    Filters run as vectorized masks over the memory-mapped columns; rows that
+    mention more of the buyer's must-have amenities come first (nearest first
+    in radius mode). Only the selected `limit` display rows are fetched from
+    Supabase, and school / POI enrichment is taken from the snapshot.
+    property_ids restricts candidates to those ids (semantic search hits).
+    """
+    if not supabase:
+        return []
 
+    # Row numbers below must all refer to one version of the arrays
+    snapshot = snapshot.pinned()
+    excluded_property_ids = fetch_interacted_property_ids(buyer_id)
+    filters = dict(
+        min_price=min_price,
+        max_price=max_price,
+        min_beds=min_beds,
+        min_baths=min_baths,
+        property_types=property_types,
+        exclude_ids=excluded_property_ids,
+        center=center,
+        radius_miles=radius_miles,
+        property_ids=property_ids
+    )
+    geo_mode = bool(center and radius_miles)
+    rows, distances = snapshot.filter(cities=None if geo_mode else preferred_areas, **filters)
+
+    # Same fallback as the database path: preferred_areas may be neighborhoods
+    if preferred_areas and not geo_mode and rows.size == 0:
+        logs.info("Feature Snapshot", f"No properties in preferred_areas={preferred_areas}, retrying without area filter")
+        rows, distances = snapshot.filter(**filters)
+
+    if distances is None:
+        order = np.argsort(-snapshot.amenity_matches(rows, must_haves), kind="stable")
+        rows = rows[order]
+    rows = rows[:limit]
+    logs.info("Feature Snapshot", f"Selected {len(rows)} candidates in-process")
+    if rows.size == 0:
+        return []
+
+    property_ids = snapshot.ids[rows].tolist()
+    count_call("supabase")
+    response = supabase.table("properties").select(PROPERTY_COLUMNS).in_("id", property_ids).execute()
+    rows_by_id = {prop["id"]: prop for prop in response.data or []}
+
+    properties = []
+    for i, (property_id, row) in enumerate(zip(property_ids, rows)):
+        prop = rows_by_id.get(property_id)
+        if prop is None:
+            continue  # Removed since the snapshot was built
+        listing = normalize_property_row(prop)
+        listing.update(snapshot.listing_features(int(row)))
+        if distances is not None:
+            listing["distance_miles"] = float(distances[i])
+        properties.append(listing)
     return properties
 
 
 def enrich_with_schools_data(listing: Dict[str, Any]) -> Dict[str, Any]:
-    """Use schools data already stored in the database"""
-    schools = listing.get("schools", [])
-    ratings = [s.get("rating", 0) for s in schools if s.get("rating")]
-    listing["avg_school_rating"] = sum(ratings) / len(ratings) if ratings else 0
-    distances = [s.get("distance", 999) for s in schools if s.get("distance")]
-    listing["closest_school_miles"] = min(distances) if distances else None
+    """Finish school fields from the aggregates precomputed in the database (migration 0015)"""
+    listing["avg_school_rating"] = float(listing.get("avg_school_rating") or 0)
+    closest = listing.get("closest_school_miles")
+    listing["closest_school_miles"] = float(closest) if closest is not None else None
     return listing
 
 
+def prepare_snapshot_listings(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Normalize and enrich raw properties rows for the feature snapshot (build and delta sync)"""
+    listings = [normalize_property_row(prop) for prop in rows]
+    for listing in listings:
+        enrich_with_schools_data(listing)
+    if listings and (os.environ.get("GOOGLE_PLACES_API_KEY") or get_poi_store(POI_SNAPSHOT_PATH)):
+        poi_results = enrich_listings_with_places(listings, poi_keys=["school", "supermarket", "park", "transit"])
+        for listing, poi_data in zip(listings, poi_results):
+            listing.update(poi_data)
+    return listings
+
+
 def rule_score(listing: Dict[str, Any], prefs: Preferences) -> Tuple[float, List[str]]:
     """
     Enhanced rule-based scoring with:
@@ -417,6 +707,20 @@ def rule_score(listing: Dict[str, Any], prefs: Preferences) -> Tuple[float, List
     if transit_boost > 0:
         score += transit_boost
 
+    # Commute proximity (uses precomputed commute_minutes, 0-8 points)
+    commute = listing.get("commute_minutes")
+    if commute is not None:
+        tolerance = prefs.max_commute_minutes or 60
+        commute_boost = boost(commute, 8, tolerance)
+        if commute_boost > 0:
+            score += commute_boost
+            if commute <= tolerance / 2:
+                reasons.append(f"short commute (~{commute:.0f} min)")
+        elif prefs.max_commute_minutes:
+            # Penalty grows with how far past the buyer's limit the commute is
+            score -= min(8, 8 * (commute - tolerance) / tolerance)
+            reasons.append(f"long commute (~{commute:.0f} min)")
+
     # Must-haves with PENALTIES for missing features
     text = (listing.get("description") or "").lower() + " " + (listing.get("address") or "").lower()
 
@@ -454,217 +758,308 @@ def rule_score(listing: Dict[str, Any], prefs: Preferences) -> Tuple[float, List
     return final_score, reasons[:4]  # Return top 4 reasons
 
 
-def llm_score_batch(prefs: Preferences, listings: List[Dict[str, Any]]) -> Dict[str, float]:
-    """Score all listings in a single LLM call for efficiency"""
+def llm_score_batch(prefs: Preferences, listings: List[Dict[str, Any]],
+                    usage: TokenUsage = None, deadline: Deadline = None) -> Dict[str, float]:
+    """
+    Score all listings with as few LLM calls as fit the token budget
+
+    Listings are sent as compact rows (see llm_prompt) and replies are
+    validated by llm_client, which re-asks only for listings left unscored.
+    Listings still without a valid score are missing from the result.
+    Token usage is added to usage when given.
+    """
     if not listings:
         return {}
 
-    summaries = []
-    for i, listing in enumerate(listings):
-        summary = f"""
-Property {i+1}:
-- Address: {listing.get('address', 'N/A')}, {listing.get('city', 'N/A')}
-- Price: ${listing.get('price', 0):,}
-- Beds/Baths: {listing.get('bedrooms', 0)}/{listing.get('bathrooms', 0)}
-- Size: {listing.get('livingArea', 0):,} sqft, Lot: {listing.get('lotSize', 0):,} sqft
-- Type: {listing.get('propertyType', 'N/A')}
-- Year: {listing.get('yearBuilt', 'N/A')}
-- Schools: Avg rating {listing.get('avg_school_rating', 0):.1f}/10
-- Description: {listing.get('description', 'N/A')[:200]}
-"""
-        summaries.append(summary)
-
-    prefs_text = f"""
-Budget: ${prefs.budget_min:,} - ${prefs.budget_max:,}
-Min beds: {prefs.min_beds}, Min baths: {prefs.min_baths}
-Min sqft: {prefs.min_sqft:,}, Min lot: {prefs.min_lot_size:,} sqft
-Must have: {', '.join(prefs.must_haves) if prefs.must_haves else 'None'}
-Nice to have: {', '.join(prefs.nice_to_haves) if prefs.nice_to_haves else 'None'}
-Preferred areas: {', '.join(prefs.preferred_areas) if prefs.preferred_areas else 'Any'}
-"""
-
-    prompt = f"""
-You are a real estate expert. Score each property (0-100) based on how well it matches the buyer's preferences.
-Consider: budget fit, location, size, amenities, schools, and overall value.
-
-Buyer Preferences:
-{prefs_text}
-
-Properties:
-{chr(10).join(summaries)}
-
-Return ONLY a JSON object mapping property index to score:
-{{"0": 85, "1": 72, ...}}
-"""
+    scores_by_index = score_listings(openai_client, prefs, listings, deadline=deadline, usage=usage)
 
-    response = openai_client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.0
-    )
+    # Map back to zpid
+    return {listings[i].get("zpid", ""): score for i, score in scores_by_index.items()}
 
-    result_text = response.choices[0].message.content.strip()
-    if result_text.startswith("```"):
-        lines = result_text.split("\n")
-        result_text = "\n".join(lines[1:-1])
 
-    scores_by_index = json.loads(result_text)
-    scores = {}
-    for i, listing in enumerate(listings):
-        zpid = listing.get("zpid", "")
-        score = scores_by_index.get(str(i), 50)
-        scores[zpid] = float(score)
+def loved_similarity_boosts(listings: List[Dict[str, Any]], loved_property_ids: List[str],
+                            buyer_id: str = None) -> Optional[np.ndarray]:
+    """
+    Hybrid-score boosts from similarity to the buyer's loved properties.
 
-    return scores
+    Loved rows are fetched with the scoring columns and normalized like
+    candidates; their feature vectors are cached per buyer. All candidates
+    are compared to all loved properties in one matrix product.
+    Returns None when there is nothing to compare against.
+    """
+    if not loved_property_ids:
+        return None
 
+    loved_vectors = get_cached_loved_vectors(buyer_id, loved_property_ids)
+    if loved_vectors is None:
+        if not supabase:
+            return None
+        try:
+            count_call("supabase")
+            loved_response = supabase.table("properties").select(PROPERTY_COLUMNS).in_("id", loved_property_ids).execute()
+        except Exception as e:
+            logs.error("Similarity", f"Error fetching loved properties: {e}")
+            return None
+        loved_rows = [normalize_property_row(p) for p in (loved_response.data or [])]
+        if not loved_rows:
+            return None
+        loved_vectors = build_feature_matrix(loved_rows)
+        cache_loved_vectors(buyer_id, loved_property_ids, loved_vectors)
+
+    logs.info("Similarity", f"Boosting recommendations based on {loved_vectors.shape[0]} loved properties")
+    similarities = similarity_to_loved(build_feature_matrix(listings), loved_vectors)
+    return similarity_boost(similarities)
+
+
+def feedback_adjustments(listings: List[Dict[str, Any]], buyer_id: str = None,
+                         saved_property_ids: List[str] = None,
+                         viewing_scheduled_property_ids: List[str] = None,
+                         passed_property_ids: List[str] = None) -> Optional[np.ndarray]:
+    """
+    Signed hybrid-score adjustments from saved / viewing / passed feedback.
 
-def recommend_hybrid(
-    user_prefs_text: str = None,
-    prefs: Preferences = None,
+    The buyer's preference centroid is cached and updated incrementally:
+    only properties with a new or changed signal are fetched and folded in.
+    Returns None when there is no usable feedback.
+    """
+    weights = feedback_weights(saved_property_ids, viewing_scheduled_property_ids, passed_property_ids)
+    if not weights:
+        return None
+
+    centroid = get_feedback_centroid(buyer_id)
+    with centroid.lock:  # concurrent requests for this buyer share the centroid
+        missing = centroid.missing(weights)
+        new_vectors = {}
+        if missing and supabase:
+            try:
+                count_call("supabase")
+                response = supabase.table("properties").select(PROPERTY_COLUMNS).in_("id", missing).execute()
+                rows = [normalize_property_row(p) for p in (response.data or [])]
+                if rows:
+                    new_vectors = dict(zip((r["id"] for r in rows), build_feature_matrix(rows)))
+            except Exception as e:
+                logs.error("Feedback", f"Error fetching feedback properties: {e}")
+
+        changed = centroid.update(weights, new_vectors)
+        direction = centroid.direction()
+        used = len(centroid.weights)
+    logs.info("Feedback", f"Centroid over {used} properties ({changed} updated, {len(missing)} fetched)")
+    if direction is None:
+        return None
+    return feedback_adjustment(build_feature_matrix(listings), direction)
+
+
+def select_candidates(
+    prefs: Preferences,
     preferred_areas: List[str] = None,
     limit: int = 50,
-    w_llm: float = 0.7,  # Increased from 0.5
-    w_rule: float = 0.3,   # Increased from 0.2
     buyer_id: str = None,
-    loved_property_ids: List[str] = None,
-    viewing_scheduled_property_ids: List[str] = None,
-    saved_property_ids: List[str] = None,
-    passed_property_ids: List[str] = None
-) -> List[Dict[str, Any]]:
+    search_center: Optional[Tuple[float, float]] = None,
+    radius_miles: float = None,
+    search_polygon: List[Tuple[float, float]] = None,
+    updated_since: str = None
+) -> Tuple[List[Dict[str, Any]], bool]:
     """
-    LIGHTWEIGHT VERSION: LLM (70%) + Rules (30%)
-    For Full ML version with Ridge regression, see recommend_full_ml.py
-
-    OPTIMIZATION: If buyer_id is provided, already-interacted properties are
-    excluded at the DATABASE level (SQL WHERE NOT IN), not in Python.
-    This makes queries much faster and reduces data transfer.
-
-    We still send loved_property_ids for similarity boosting (price, location, etc.)
+    Candidate listings for one buyer, interacted properties excluded (feature
+    snapshot or database, then semantic pre-ranking). Returns (listings,
+    from_snapshot); snapshot listings already carry school and POI features.
     """
-    if user_prefs_text and not prefs:
-        prefs = parse_prefs_llm(user_prefs_text)
-
-    if not prefs:
-        raise ValueError("Must provide either user_prefs_text or prefs object")
-
     if not preferred_areas and prefs.preferred_areas:
         preferred_areas = prefs.preferred_areas
 
-    print(f"[recommend_hybrid] Requested limit: {limit}, Buyer ID: {buyer_id}")
+    logs.info("recommend_hybrid", f"Requested limit: {limit}, Buyer ID: {buyer_id}")
+
+    semantic_index = get_embedding_index(EMBEDDING_INDEX_PATH)
+
+    # Candidates from the local feature snapshot when available (polygon search needs PostGIS)
+    feature_snapshot = get_feature_snapshot(FEATURE_SNAPSHOT_PATH)
+    use_snapshot = feature_snapshot is not None and not search_polygon and not updated_since
+    if use_snapshot and supabase:
+        # Patch in catalog changes since the last sync (rate-limited, in the background)
+        sync_if_due(feature_snapshot, supabase, PROPERTY_COLUMNS, prepare_snapshot_listings,
+                    FEATURE_SNAPSHOT_SYNC_SECONDS)
+
+    def fetch(fetch_limit: int, property_ids: List[str] = None) -> List[Dict[str, Any]]:
+        with span("fetch_candidates", snapshot=use_snapshot):
+            if use_snapshot:
+                return fetch_properties_from_snapshot(
+                    feature_snapshot,
+                    preferred_areas=preferred_areas,
+                    min_price=prefs.budget_min,
+                    max_price=prefs.budget_max,
+                    min_beds=prefs.min_beds,
+                    min_baths=prefs.min_baths,
+                    property_types=prefs.property_types,
+                    must_haves=prefs.must_haves,
+                    limit=fetch_limit,
+                    buyer_id=buyer_id,
+                    center=search_center,
+                    radius_miles=radius_miles,
+                    property_ids=property_ids
+                )
+            # OPTIMIZATION: Pass buyer_id to database query for SQL-level filtering
+            # Properties already in buyer_properties (is_active=true) are excluded at DB level
+            return fetch_properties_from_supabase(
+                preferred_areas=preferred_areas,
+                min_price=prefs.budget_min,
+                max_price=prefs.budget_max,
+                min_beds=prefs.min_beds,
+                min_baths=prefs.min_baths,
+                property_types=prefs.property_types,
+                limit=fetch_limit,
+                buyer_id=buyer_id,
+                exclude_interacted=True,  # Enable SQL-level duplicate filtering
+                center=search_center,
+                radius_miles=radius_miles,
+                polygon=search_polygon,
+                updated_since=updated_since,
+                property_ids=property_ids
+            )
 
-    # OPTIMIZATION: Pass buyer_id to database query for SQL-level filtering
-    # Properties already in buyer_properties (is_active=true) are excluded at DB level
-    listings = fetch_properties_from_supabase(
-        preferred_areas=preferred_areas,
-        min_price=prefs.budget_min,
-        max_price=prefs.budget_max,
-        min_beds=prefs.min_beds,
-        min_baths=prefs.min_baths,
-        property_types=prefs.property_types,
-        limit=limit,
-        buyer_id=buyer_id,
-        exclude_interacted=True  # Enable SQL-level duplicate filtering
-    )
+    # Semantic search: the catalog's nearest neighbours of the preferences that pass the
+    # filters, best first (geo and incremental searches keep their own candidate sets)
+    if semantic_index and not (search_center and radius_miles) and not search_polygon and not updated_since:
+        with span("semantic_search"):
+            hits = semantic_search(prefs, semantic_index, k=max(SEMANTIC_SEARCH_SIZE, limit * SEMANTIC_POOL_FACTOR),
+                                   openai_client=openai_client)
+        if hits:
+            listings = rank_by_hits(fetch(len(hits), [pid for pid, _ in hits]), hits, keep=limit)
+            if len(listings) >= limit:
+                logs.info("Embeddings", "Semantic search kept %d/%d nearest neighbours", len(listings), len(hits))
+                return listings, use_snapshot
+            logs.info("Embeddings", "Only %d/%d nearest neighbours pass the filters, pre-ranking the filtered pool",
+                      len(listings), len(hits))
+
+    # Otherwise fetch a wider filtered pool and keep the best `limit` by embedding similarity
+    listings = fetch(limit * SEMANTIC_POOL_FACTOR if semantic_index else limit)
 
     if not listings:
-        print("[recommend_hybrid] No properties returned from database after filtering")
-        return []
+        logs.info("recommend_hybrid", "No properties returned from database after filtering")
+        return [], use_snapshot
 
-    print(f"[recommend_hybrid] Fetched {len(listings)} properties from database (already filtered)")
+    logs.info("recommend_hybrid", f"Fetched {len(listings)} properties from database (already filtered)")
+
+    if semantic_index and len(listings) > limit:
+        with span("semantic_prerank"):
+            listings = semantic_prerank(listings, prefs, semantic_index, keep=limit, openai_client=openai_client)
+
+    return listings, use_snapshot
 
-    # Fetch loved properties for similarity boosting
-    loved_properties = []
-    if loved_property_ids and supabase:
-        try:
-            loved_response = supabase.table("properties").select("*").in_("id", loved_property_ids).execute()
-            loved_properties = loved_response.data if loved_response.data else []
-            if loved_properties:
-                print(f"Boosting recommendations based on {len(loved_properties)} loved properties")
-        except Exception as e:
-            print(f"Error fetching loved properties: {e}")
 
-    # Enrich with schools data
+
+def enrich_candidates(listings: List[Dict[str, Any]], time_budget: TimeBudget = None):
+    """School and Google Places POI features for database candidates, in place"""
     for listing in listings:
         enrich_with_schools_data(listing)
 
     # Enrich with Google Places POI data (schools, markets, parks, transit)
     # Only if GOOGLE_PLACES_API_KEY is configured
-    if os.environ.get("GOOGLE_PLACES_API_KEY"):
-        print(f"[recommend_hybrid] Enriching {len(listings)} properties with POI data...")
-        for listing in listings:
-            poi_data = enrich_with_places(listing, poi_keys=["school", "supermarket", "park", "transit"])
+    if os.environ.get("GOOGLE_PLACES_API_KEY") or get_poi_store(POI_SNAPSHOT_PATH):
+        logs.info("recommend_hybrid", f"Enriching {len(listings)} properties with POI data...")
+        with span("enrich_places", listings=len(listings)):
+            poi_results = enrich_listings_with_places(listings, poi_keys=["school", "supermarket", "park", "transit"],
+                                                      time_budget=time_budget)
+        for listing, poi_data in zip(listings, poi_results):
             listing.update(poi_data)
-        print(f"[recommend_hybrid] POI enrichment complete")
+        logs.info("recommend_hybrid", "POI enrichment complete")
     else:
-        print("[recommend_hybrid] Skipping POI enrichment (GOOGLE_PLACES_API_KEY not configured)")
+        logs.info("recommend_hybrid", "Skipping POI enrichment (no GOOGLE_PLACES_API_KEY or POI snapshot)")
         # Set empty POI data so rule_score doesn't fail
         for listing in listings:
             listing["poi_min_miles"] = {}
             listing["poi_counts"] = {}
 
-    # Calculate rule scores
-    rule_scores = []
-    rule_reasons = []
-    for listing in listings:
-        score, reasons = rule_score(listing, prefs)
-        rule_scores.append(score)
-        rule_reasons.append("; ".join(reasons[:3]))
 
-    # Calculate LLM scores (batch)
-    llm_scores_dict = llm_score_batch(prefs, listings)
-    llm_scores = [llm_scores_dict.get(listing.get("zpid", ""), 50) for listing in listings]
+def score_candidates(
+    listings: List[Dict[str, Any]],
+    prefs: Preferences,
+    limit: int = 50,
+    w_llm: float = 0.7,
+    w_rule: float = 0.3,
+    buyer_id: str = None,
+    loved_property_ids: List[str] = None,
+    viewing_scheduled_property_ids: List[str] = None,
+    saved_property_ids: List[str] = None,
+    passed_property_ids: List[str] = None,
+    usage: TokenUsage = None,
+    deadline: Deadline = None,
+    time_budget: TimeBudget = None
+) -> List[Dict[str, Any]]:
+    """
+    Score enriched candidates for one buyer and return the best limit
+    (commute, rules, LLM, feedback). Listings without an LLM score rank by
+    their rule score; under a time budget, commute and LLM scoring only run
+    as far as they fit.
+    """
+    if usage is None:
+        usage = TokenUsage()
+
+    # Commute times: one geocode + one bulk estimate for all candidates
+    if prefs.commute_address and time_budget is not None and not time_budget.affordable("commute", 1, reserve=("llm",)):
+        time_budget.degrade("commute", "skipped")
+    elif prefs.commute_address:
+        with span("commute"), measured("commute"):
+            destination = geocode_address(prefs.commute_address)
+            if destination:
+                commute_times = commute_minutes_for_listings(listings, destination, mode=prefs.commute_mode or "driving")
+                for listing, minutes in zip(listings, commute_times):
+                    listing["commute_minutes"] = minutes
+            else:
+                logs.warning("Commute", "Could not geocode commute address, skipping commute scoring")
+
+    # Calculate rule scores
+    with span("rule_score"):
+        rule_scores = []
+        rule_reasons = []
+        for listing in listings:
+            score, reasons = rule_score(listing, prefs)
+            rule_scores.append(score)
+            rule_reasons.append("; ".join(reasons[:3]))
+
+    # Calculate LLM scores (batch), ending in time for the stages after it
+    if time_budget is not None:
+        deadline = time_budget.cap(deadline or Deadline())
+    start = time.perf_counter()
+    with span("llm_score", listings=len(listings)):
+        llm_scores_dict = llm_score_batch(prefs, listings, usage=usage, deadline=deadline)
+    # Listings the LLM did not score (unavailable, timed out, invalid reply) report their rule score
+    has_llm = [listing.get("zpid", "") in llm_scores_dict for listing in listings]
+    llm_scores = [llm_scores_dict.get(listing.get("zpid", ""), rule_scores[i]) for i, listing in enumerate(listings)]
+    if all(has_llm):
+        observe("llm", time.perf_counter() - start)
+    else:
+        logs.info("LLM", f"Rule-only fallback for {len(listings) - sum(has_llm)}/{len(listings)} listings")
+        if time_budget is not None:
+            time_budget.degrade("llm", f"scored {sum(has_llm)}/{len(listings)} listings")
 
     # Normalize rule scores to 0-100
     max_rule = max(rule_scores) if rule_scores else 1
     rule_scores_norm = [(s / max_rule) * 100 for s in rule_scores]
 
-    # Calculate hybrid score (LLM 70% + Rules 30%)
+    # Calculate hybrid score (LLM 70% + Rules 30%); without an LLM score the
+    # weights renormalize to the rule score alone
     hybrid_scores = [
-        w_llm * llm_scores[i] + w_rule * rule_scores_norm[i]
+        w_llm * llm_scores[i] + w_rule * rule_scores_norm[i] if has_llm[i] else rule_scores_norm[i]
         for i in range(len(listings))
     ]
 
-    # Apply feedback from interaction history
-    if loved_properties:
-        # Calculate average characteristics from loved properties
-        avg_price = sum(p.get("price", 0) for p in loved_properties) / len(loved_properties)
-        loved_cities = set(p.get("city", "").lower() for p in loved_properties if p.get("city"))
-        loved_types = set(p.get("propertyType", "").lower() for p in loved_properties if p.get("propertyType"))
-        avg_beds = sum(p.get("bedrooms", 0) for p in loved_properties) / len(loved_properties)
-        avg_baths = sum(p.get("bathrooms", 0) for p in loved_properties) / len(loved_properties)
-
-        # Boost properties similar to loved ones
-        for i, listing in enumerate(listings):
-            similarity_boost = 0
-
-            # Price similarity (within 20% gets +10 points)
-            listing_price = listing.get("price", 0)
-            if avg_price > 0 and 0.8 * avg_price <= listing_price <= 1.2 * avg_price:
-                similarity_boost += 10
-
-            # Same city as loved properties (+15 points)
-            listing_city = (listing.get("city") or "").lower()
-            if listing_city in loved_cities:
-                similarity_boost += 15
-
-            # Same property type (+10 points)
-            listing_type = (listing.get("propertyType") or "").lower()
-            if listing_type in loved_types:
-                similarity_boost += 10
-
-            # Bedroom similarity (+5 points)
-            listing_beds = listing.get("bedrooms", 0)
-            if abs(listing_beds - avg_beds) <= 1:
-                similarity_boost += 5
-
-            # Bathroom similarity (+5 points)
-            listing_baths = listing.get("bathrooms", 0)
-            if abs(listing_baths - avg_baths) <= 0.5:
-                similarity_boost += 5
-
-            # Apply boost (max +45 points possible)
-            if similarity_boost > 0:
-                hybrid_scores[i] = min(100, hybrid_scores[i] + similarity_boost)
+    # Apply feedback from interaction history: similarity to loved properties
+    with span("loved_similarity"):
+        boosts = loved_similarity_boosts(listings, loved_property_ids, buyer_id=buyer_id)
+    if boosts is not None:
+        hybrid_scores = np.minimum(100.0, np.asarray(hybrid_scores) + boosts).tolist()
+
+    # Re-rank with saved / viewing-scheduled (positive) and passed (negative) feedback
+    with span("feedback_rerank"):
+        adjustments = feedback_adjustments(
+            listings,
+            buyer_id=buyer_id,
+            saved_property_ids=saved_property_ids,
+            viewing_scheduled_property_ids=viewing_scheduled_property_ids,
+            passed_property_ids=passed_property_ids
+        )
+    if adjustments is not None:
+        hybrid_scores = np.clip(np.asarray(hybrid_scores) + adjustments, 0.0, 100.0).tolist()
 
     # Create results
     results = []
@@ -683,6 +1078,12 @@ def recommend_hybrid(
             "property_type": listing.get("propertyType", ""),
             "year_built": listing.get("yearBuilt", ""),
             "avg_school_rating": listing.get("avg_school_rating", 0),
+            "best_elementary_rating": listing.get("best_elementary_rating"),
+            "best_middle_rating": listing.get("best_middle_rating"),
+            "best_high_rating": listing.get("best_high_rating"),
+            "distance_miles": listing.get("distance_miles"),  # Geo search only
+            "commute_minutes": listing.get("commute_minutes"),
+            "semantic_score": listing.get("semantic_score"),  # Embedding index only
             "hybrid_score": hybrid_scores[i],
             "llm_score": llm_scores[i],
             "ml_score": 0,  # Not used in lightweight version
@@ -696,93 +1097,438 @@ def recommend_hybrid(
 
     # IMPORTANT: Return exactly the requested number of properties
     limited_results = results[:limit]
-    print(f"Returning {len(limited_results)} properties (requested limit: {limit})")
+    logs.info("recommend_hybrid", f"Returning {len(limited_results)} properties (requested limit: {limit})")
+
+    logs.info("LLM", "%d calls, %d prompt + %d completion tokens for %d recommendations",
+              usage.calls, usage.prompt_tokens, usage.completion_tokens, len(limited_results))
 
     return limited_results
 
 
+def recommend_hybrid(
+    user_prefs_text: str = None,
+    prefs: Preferences = None,
+    preferred_areas: List[str] = None,
+    limit: int = 50,
+    w_llm: float = 0.7,  # Increased from 0.5
+    w_rule: float = 0.3,   # Increased from 0.2
+    buyer_id: str = None,
+    loved_property_ids: List[str] = None,
+    viewing_scheduled_property_ids: List[str] = None,
+    saved_property_ids: List[str] = None,
+    passed_property_ids: List[str] = None,
+    search_center: Optional[Tuple[float, float]] = None,
+    radius_miles: float = None,
+    search_polygon: List[Tuple[float, float]] = None,
+    usage: TokenUsage = None,
+    updated_since: str = None,
+    time_budget: TimeBudget = None
+) -> List[Dict[str, Any]]:
+    """
+    LIGHTWEIGHT VERSION: LLM (70%) + Rules (30%)
+    For Full ML version with Ridge regression, see recommend_full_ml.py
+
+    OPTIMIZATION: If buyer_id is provided, already-interacted properties are
+    excluded at the DATABASE level (SQL WHERE NOT IN), not in Python.
+    This makes queries much faster and reduces data transfer.
+
+    We still send loved_property_ids for similarity boosting (price, location, etc.)
+    saved / viewing_scheduled / passed ids re-rank results through a cached
+    per-buyer preference centroid (no extra LLM calls).
+
+    Geo search: search_center + radius_miles and/or search_polygon retrieve
+    candidates nearest-first from the spatial index instead of by city.
+
+    LLM token usage (preference parsing + scoring) is accumulated into usage.
+
+    updated_since (ISO timestamp) only considers listings changed after it;
+    precompute.py uses it to rescore new listings incrementally.
+
+    time_budget bounds the run: Places, commute and LLM scoring are cut to
+    what fits, and what was cut is recorded in time_budget.degraded (see
+    time_budget.py).
+    """
+    if usage is None:
+        usage = TokenUsage()
+    deadline = Deadline()
+    if time_budget is not None:
+        deadline = time_budget.cap(deadline)
+
+    if user_prefs_text and not prefs:
+        if time_budget is not None and deadline.expired():
+            time_budget.degrade("preferences", "not parsed, default preferences")
+        with span("parse_preferences"):
+            prefs = parse_prefs_llm(user_prefs_text, usage=usage, deadline=deadline)
+
+    if not prefs:
+        raise ValueError("Must provide either user_prefs_text or prefs object")
+
+    listings, use_snapshot = select_candidates(
+        prefs,
+        preferred_areas=preferred_areas,
+        limit=limit,
+        buyer_id=buyer_id,
+        search_center=search_center,
+        radius_miles=radius_miles,
+        search_polygon=search_polygon,
+        updated_since=updated_since
+    )
+    if not listings:
+        return []
+
+    # School aggregates and POI data come precomputed with snapshot candidates
+    if use_snapshot:
+        logs.info("recommend_hybrid", "POI data from feature snapshot")
+    else:
+        enrich_candidates(listings, time_budget=time_budget)
+
+    return score_candidates(
+        listings,
+        prefs,
+        limit=limit,
+        w_llm=w_llm,
+        w_rule=w_rule,
+        buyer_id=buyer_id,
+        loved_property_ids=loved_property_ids,
+        viewing_scheduled_property_ids=viewing_scheduled_property_ids,
+        saved_property_ids=saved_property_ids,
+        passed_property_ids=passed_property_ids,
+        usage=usage,
+        deadline=deadline,
+        time_budget=time_budget
+    )
+
+
+BATCH_MAX_BUYERS = int(os.environ.get("BATCH_MAX_BUYERS", "50"))
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", "8"))
+
+# Per-query fields a buyer's candidate carries besides the shared listing data
+QUERY_FIELDS = ("distance_miles", "semantic_score")
+
+
+def _submit_in_context(pool: ThreadPoolExecutor, fn, *args) -> Future:
+    # Each task runs in a copy of the caller's context (request log, trace)
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+
+def _with_query_fields(shared: Dict[str, Any], own: Dict[str, Any]) -> Dict[str, Any]:
+    listing = dict(shared)
+    for key in QUERY_FIELDS:
+        if key in own:
+            listing[key] = own[key]
+        else:
+            listing.pop(key, None)
+    return listing
+
+
+def recommend_hybrid_batch(batch_requests: List[Dict[str, Any]], usages: List[TokenUsage] = None,
+                           workers: int = BATCH_WORKERS) -> List[Any]:
+    """
+    recommend_hybrid for many buyers at once
+
+    Each request is a dict of recommend_hybrid keyword arguments. Candidates
+    are selected per buyer (concurrently, each excluding that buyer's
+    interactions), then schools and Places POIs are computed once per listing
+    in the union, and each buyer is scored against their own candidates.
+
+    Returns one entry per request, in order: its result list, or the
+    exception that buyer failed with. LLM token usage of request i is
+    accumulated into usages[i].
+    """
+    if usages is None:
+        usages = [TokenUsage() for _ in batch_requests]
+    outcomes: List[Any] = [None] * len(batch_requests)
+    selected: Dict[int, Tuple[Preferences, List[Dict[str, Any]], bool]] = {}
+
+    def select(i: int):
+        request = batch_requests[i]
+        prefs = request.get("prefs")
+        if request.get("user_prefs_text") and not prefs:
+            with span("parse_preferences"):
+                prefs = parse_prefs_llm(request["user_prefs_text"], usage=usages[i], deadline=Deadline())
+        if not prefs:
+            raise ValueError("Must provide either user_prefs_text or prefs object")
+        listings, use_snapshot = select_candidates(
+            prefs,
+            preferred_areas=request.get("preferred_areas"),
+            limit=request.get("limit", 50),
+            buyer_id=request.get("buyer_id"),
+            search_center=request.get("search_center"),
+            radius_miles=request.get("radius_miles"),
+            search_polygon=request.get("search_polygon"),
+            updated_since=request.get("updated_since")
+        )
+        return prefs, listings, use_snapshot
+
+    def score(i: int):
+        prefs, listings, use_snapshot = selected[i]
+        own = [_with_query_fields(shared[(listing.get("id"), use_snapshot)], listing) for listing in listings]
+        request = batch_requests[i]
+        return score_candidates(
+            own,
+            prefs,
+            limit=request.get("limit", 50),
+            buyer_id=request.get("buyer_id"),
+            loved_property_ids=request.get("loved_property_ids"),
+            viewing_scheduled_property_ids=request.get("viewing_scheduled_property_ids"),
+            saved_property_ids=request.get("saved_property_ids"),
+            passed_property_ids=request.get("passed_property_ids"),
+            usage=usages[i],
+            deadline=Deadline()
+        )
+
+    def collect(futures: Dict[int, Future], into: Dict[int, Any]):
+        for i, future in futures.items():
+            try:
+                into[i] = future.result()
+            except Exception as e:
+                outcomes[i] = e
+                logs.count("Batch", "failed", example=f"{i}: {e}")
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(batch_requests))), thread_name_prefix="batch") as pool:
+        collect({i: _submit_in_context(pool, select, i) for i in range(len(batch_requests))}, selected)
+
+        # One shared dict per listing (snapshot candidates already carry school / POI features)
+        shared: Dict[Tuple[Any, bool], Dict[str, Any]] = {}
+        for _, listings, use_snapshot in selected.values():
+            for listing in listings:
+                shared.setdefault((listing.get("id"), use_snapshot), listing)
+        candidate_rows = sum(len(listings) for _, listings, _ in selected.values())
+        logs.info("Batch", "%d buyers, %d candidates, %d unique listings",
+                  len(batch_requests), candidate_rows, len(shared))
+
+        from_database = [listing for (_, use_snapshot), listing in shared.items() if not use_snapshot]
+        if from_database:
+            enrich_candidates(from_database)
+
+        scored: Dict[int, List[Dict[str, Any]]] = {}
+        collect({i: _submit_in_context(pool, score, i) for i, (_, listings, _) in selected.items() if listings},
+                scored)
+
+    for i in selected:
+        if outcomes[i] is None:
+            outcomes[i] = scored.get(i, [])
+    logs.summary("Batch", "Buyers")
+    return outcomes
+
+
+def buyer_request_inputs(data: Dict[str, Any]) -> Tuple[Optional[str], Dict[str, Any]]:
+    """
+    (buyer_profile_id, recommend_hybrid keyword arguments) for one buyer of a
+    request body; buyer_profile_id is the buyer's person id and loads their
+    profile preferences.
+    """
+    user_prefs_text = data.get("preferences_text")
+    buyer_profile_id = data.get("buyer_profile_id")
+    preferred_areas = data.get("preferred_areas")
+    limit = data.get("limit", 50)
+
+    # Extract interaction history for personalized recommendations
+    loved_property_ids = data.get("loved_property_ids", [])
+    viewing_scheduled_property_ids = data.get("viewing_scheduled_property_ids", [])
+    saved_property_ids = data.get("saved_property_ids", [])
+    passed_property_ids = data.get("passed_property_ids", [])
+
+    # Optional geo search area
+    search_center = parse_lat_lng(data.get("search_center"))
+    radius_miles = data.get("radius_miles")
+    search_polygon = data.get("search_polygon")
+
+    # Log interaction history for debugging
+    total_interactions = len(loved_property_ids) + len(viewing_scheduled_property_ids) + len(saved_property_ids) + len(passed_property_ids)
+    if total_interactions > 0:
+        logs.info("Interactions", f"{len(loved_property_ids)} loved, {len(viewing_scheduled_property_ids)} scheduled, {len(saved_property_ids)} saved, {len(passed_property_ids)} passed")
+
+    prefs = None
+    if buyer_profile_id and supabase:
+        profile_response = supabase.table("buyer_profiles").select("*").eq("person_id", buyer_profile_id).execute()
+        if profile_response.data:
+            profile = profile_response.data[0]
+            prefs = Preferences(
+                budget_min=profile.get("price_min") or 0,
+                budget_max=profile.get("price_max") or 999999999,
+                must_haves=profile.get("must_have_features") or [],
+                nice_to_haves=profile.get("nice_to_have_features") or [],
+                preferred_areas=profile.get("preferred_areas") or [],
+                property_types=profile.get("property_type_preferences") or []
+            )
+            if not user_prefs_text and profile.get("raw_background"):
+                user_prefs_text = profile.get("raw_background")
+
+    return buyer_profile_id, dict(
+        user_prefs_text=user_prefs_text,
+        prefs=prefs,
+        preferred_areas=preferred_areas,
+        limit=limit,
+        buyer_id=buyer_profile_id,  # Enable SQL-level duplicate filtering
+        loved_property_ids=loved_property_ids,
+        viewing_scheduled_property_ids=viewing_scheduled_property_ids,
+        saved_property_ids=saved_property_ids,
+        passed_property_ids=passed_property_ids,
+        search_center=search_center,
+        radius_miles=radius_miles,
+        search_polygon=search_polygon
+    )
+
+
+def batch_response(data: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    """
+    (status, payload) for a batch request: {"buyers": [...], "limit": 30}.
+    Each buyer takes the single-request fields; matching precomputed lists
+    are served as is, the other buyers share one recommend_hybrid_batch run.
+    """
+    buyers = data.get("buyers")
+    if not isinstance(buyers, list) or not buyers:
+        return 400, {"success": False, "error": "buyers must be a non-empty list"}
+    if len(buyers) > BATCH_MAX_BUYERS:
+        return 400, {"success": False, "error": f"At most {BATCH_MAX_BUYERS} buyers per batch"}
+
+    default_limit = data.get("limit", 50)
+    buyer_ids: List[Optional[str]] = [None] * len(buyers)
+    outcomes: List[Any] = [None] * len(buyers)
+    usages = [TokenUsage() for _ in buyers]
+
+    with start_trace("recommend_batch", enabled=tracing_wanted(data.get("include_timings")), version="lightweight",
+                     request_id=logs.current().request_id) as trace:
+        pending: Dict[int, Dict[str, Any]] = {}
+        precomputed = 0
+        for i, buyer in enumerate(buyers):
+            try:
+                if not isinstance(buyer, dict):
+                    raise ValueError("Each buyer must be an object")
+                buyer_ids[i], request_inputs = buyer_request_inputs({"limit": default_limit, **buyer})
+            except Exception as e:
+                outcomes[i] = e
+                continue
+            stored = load_precomputed(supabase, "lightweight", buyer_ids[i], request_inputs, request_inputs["limit"])
+            if stored is not None:
+                outcomes[i] = stored
+                precomputed += 1
+            else:
+                pending[i] = request_inputs
+
+        if pending:
+            computed = recommend_hybrid_batch(list(pending.values()), usages=[usages[i] for i in pending])
+            for i, outcome in zip(pending, computed):
+                outcomes[i] = outcome
+
+    results = []
+    for buyer_id, outcome, usage in zip(buyer_ids, outcomes, usages):
+        if isinstance(outcome, Exception):
+            results.append({"buyer_profile_id": buyer_id, "success": False, "error": str(outcome),
+                            "error_type": type(outcome).__name__})
+            continue
+        results.append({
+            "buyer_profile_id": buyer_id,
+            "success": True,
+            "count": len(outcome),
+            "recommendations": outcome,
+            "llm_usage": usage.as_dict(len(outcome))
+        })
+
+    failed = sum(1 for result in results if not result["success"])
+    logs.info("Batch", "Returning %d buyers (%d failed, %d precomputed)", len(results), failed, precomputed)
+    payload = {"success": True, "count": len(results), "failed": failed, "results": results, "version": "lightweight"}
+    if trace is not None:
+        payload["timings"] = trace.timings()
+    return 200, payload
+
+
 class handler(BaseHTTPRequestHandler):
     """Vercel serverless function handler"""
 
     def do_POST(self):
         """Handle POST requests for property recommendations"""
-        try:
-            content_length = int(self.headers.get('Content-Length', 0))
-            body = self.rfile.read(content_length).decode('utf-8')
-            data = json.loads(body)
-
-            user_prefs_text = data.get("preferences_text")
-            buyer_profile_id = data.get("buyer_profile_id")
-            preferred_areas = data.get("preferred_areas")
-            limit = data.get("limit", 50)
-
-            # Extract interaction history for personalized recommendations
-            loved_property_ids = data.get("loved_property_ids", [])
-            viewing_scheduled_property_ids = data.get("viewing_scheduled_property_ids", [])
-            saved_property_ids = data.get("saved_property_ids", [])
-            passed_property_ids = data.get("passed_property_ids", [])
-
-            # Log interaction history for debugging
-            total_interactions = len(loved_property_ids) + len(viewing_scheduled_property_ids) + len(saved_property_ids) + len(passed_property_ids)
-            if total_interactions > 0:
-                print(f"Using interaction history: {len(loved_property_ids)} loved, {len(viewing_scheduled_property_ids)} scheduled, {len(saved_property_ids)} saved, {len(passed_property_ids)} passed")
-
-            prefs = None
-            if buyer_profile_id and supabase:
-                profile_response = supabase.table("buyer_profiles").select("*").eq("person_id", buyer_profile_id).execute()
-                if profile_response.data:
-                    profile = profile_response.data[0]
-                    prefs = Preferences(
-                        budget_min=profile.get("price_min") or 0,
-                        budget_max=profile.get("price_max") or 999999999,
-                        must_haves=profile.get("must_have_features") or [],
-                        nice_to_haves=profile.get("nice_to_have_features") or [],
-                        preferred_areas=profile.get("preferred_areas") or [],
-                        property_types=profile.get("property_type_preferences") or []
-                    )
-                    if not user_prefs_text and profile.get("raw_background"):
-                        user_prefs_text = profile.get("raw_background")
-
-            recommendations = recommend_hybrid(
-                user_prefs_text=user_prefs_text,
-                prefs=prefs,
-                preferred_areas=preferred_areas,
-                limit=limit,
-                buyer_id=buyer_profile_id,  # Enable SQL-level duplicate filtering
-                loved_property_ids=loved_property_ids,
-                viewing_scheduled_property_ids=viewing_scheduled_property_ids,
-                saved_property_ids=saved_property_ids,
-                passed_property_ids=passed_property_ids
-            )
-
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({
-                "success": True,
-                "count": len(recommendations),
-                "recommendations": recommendations,
-                "version": "lightweight"  # Indicate which version is running
-            }).encode('utf-8'))
-
-        except Exception as e:
-            import traceback
-            error_details = {
-                "success": False,
-                "error": str(e),
-                "error_type": type(e).__name__,
-                "traceback": traceback.format_exc(),
-                "env_check": {
-                    "has_openai_key": bool(os.environ.get("OPENAI_API_KEY")),
-                    "has_supabase_url": bool(os.environ.get("SUPABASE_URL")),
-                    "has_supabase_key": bool(os.environ.get("SUPABASE_SERVICE_ROLE_KEY")),
-                    "supabase_client_initialized": supabase is not None
+        with logs.request(self.headers.get("X-Request-ID")):
+            try:
+                content_length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(content_length).decode('utf-8')
+                data = json.loads(body)
+
+                # Many buyers at once: shared candidate enrichment (see batch_response)
+                if "buyers" in data:
+                    status, response = batch_response(data)
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(json.dumps(response).encode('utf-8'))
+                    return
+
+                buyer_profile_id, request_inputs = buyer_request_inputs(data)
+                limit = request_inputs["limit"]
+                llm_usage = TokenUsage()
+                deadline_seconds = request_deadline(data)
+
+                def run_pipeline():
+                    # (recommendations, stages cut short by the time budget)
+                    # Nightly precomputed list (precompute.py) when it was computed from these inputs
+                    stored = load_precomputed(supabase, "lightweight", buyer_profile_id, request_inputs, limit)
+                    if stored is not None:
+                        return stored, {}
+                    time_budget = TimeBudget(deadline_seconds) if deadline_seconds else None
+                    recommendations = recommend_hybrid(**request_inputs, usage=llm_usage, time_budget=time_budget)
+                    return recommendations, time_budget.degraded if time_budget else {}
+
+                # Identical requests (reloads, re-mounts) are served from the response cache
+                cache_key = request_key("lightweight", **request_inputs)
+                version = None if cache_bypassed(data, self.headers) else cache_version(supabase, buyer_profile_id)
+
+                profile_header = self.headers.get("X-Profile")
+                with start_trace("recommend", enabled=tracing_wanted(data.get("include_timings")), version="lightweight",
+                                 request_id=logs.current().request_id) as trace, \
+                        profile_request(profiling_wanted(profile_header), label="lightweight") as profile:
+                    (recommendations, degraded), cache_status = get_response_cache().fetch(
+                        cache_key, version, run_pipeline, cacheable=lambda value: not value[1])
+
+                response = {
+                    "success": True,
+                    "count": len(recommendations),
+                    "recommendations": recommendations,
+                    "llm_usage": llm_usage.as_dict(len(recommendations)),
+                    "degraded": degraded,
+                    "version": "lightweight",  # Indicate which version is running
+                    "cache": cache_status
                 }
-            }
-            self.send_response(500)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(error_details).encode('utf-8'))
+                if trace is not None:
+                    response["timings"] = trace.timings()
+                if profile is not None and header_requested(profile_header):
+                    response["profile"] = profile.summary()
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps(response).encode('utf-8'))
+
+            except ValueError as ve:
+                # Validation errors (e.g. a non-numeric deadline_seconds), as in the GCF entry point
+                logs.warning("Vercel Handler", f"ValueError: {ve}")
+                self.send_response(400)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({
+                    "success": False,
+                    "error": str(ve),
+                    "type": "ValueError"
+                }).encode('utf-8'))
+
+            except Exception as e:
+                import traceback
+                error_details = {
+                    "success": False,
+                    "error": str(e),
+                    "error_type": type(e).__name__,
+                    "traceback": traceback.format_exc(),
+                    "env_check": {
+                        "has_openai_key": bool(os.environ.get("OPENAI_API_KEY")),
+                        "has_supabase_url": bool(os.environ.get("SUPABASE_URL")),
+                        "has_supabase_key": bool(os.environ.get("SUPABASE_SERVICE_ROLE_KEY")),
+                        "supabase_client_initialized": supabase is not None
+                    }
+                }
+                self.send_response(500)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps(error_details).encode('utf-8'))
 
     def do_GET(self):
         """Handle GET requests for health check"""
@@ -794,3 +1540,7 @@ class handler(BaseHTTPRequestHandler):
             "message": "Property Recommendation API is running",
             "version": "lightweight (LLM 70% + Rules 30%)"
         }).encode('utf-8'))
+
+
+# Record/replay external calls when CASSETTE_MODE is set (see cassette.py)
+cassette.install_from_env(sys.modules[__name__])
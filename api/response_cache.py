@@ -0,0 +1,190 @@
+"""
+Whole-response cache for recommendation requests.
+
+Tab reloads and re-mounted components send the same request again; this
+serves the earlier response instead of re-running the pipeline (LLM,
+Places, PIM).
+
+- Key: engine version + buyer + a fingerprint of everything that shapes
+  the result (preference text and parsed preferences, areas, limit,
+  search geometry, interaction id lists).
+- Version: recommendation_cache_version() (migration 0016) -- the latest
+  catalog change and the buyer's latest interaction. An entry stored under
+  another version is dropped. The stamp itself is cached per buyer for
+  RESPONSE_CACHE_VERSION_SECONDS, so a hit normally needs no database call.
+- Freshness: an entry younger than RESPONSE_CACHE_TTL is served as is; up
+  to RESPONSE_CACHE_STALE_SECONDS older it is served stale while one
+  background refresh recomputes it (stale-while-revalidate). The Cloud
+  Function entry point recomputes stale entries in the request instead: its
+  CPU is throttled after the response, and the pipeline there also saves
+  the recommendations.
+- Responses degraded by a time budget (see time_budget.py) are served but
+  not stored.
+
+Entries live in process memory (LRU, RESPONSE_CACHE_MAX_ENTRIES). When the
+version stamp is unavailable (no database, RPC not deployed) nothing is
+cached.
+"""
+
+import dataclasses
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import logs
+from tracing import cache_lookup, count_call
+
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "300"))  # seconds fresh; 0 disables
+RESPONSE_CACHE_STALE_SECONDS = float(os.environ.get("RESPONSE_CACHE_STALE_SECONDS", "1800"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "256"))
+RESPONSE_CACHE_VERSION_SECONDS = float(os.environ.get("RESPONSE_CACHE_VERSION_SECONDS", "5"))
+
+FRESH, STALE, MISS, BYPASS = "hit", "stale", "miss", "bypass"
+
+
+def request_key(engine: str, **inputs: Any) -> str:
+    """Stable key for a request; id lists are order-insensitive (None = []), dataclasses are expanded"""
+    canonical = {}
+    for name, value in inputs.items():
+        if dataclasses.is_dataclass(value):
+            value = dataclasses.asdict(value)
+        elif name.endswith("_ids"):
+            value = sorted(str(v) for v in value or [])
+        canonical[name] = value
+    raw = json.dumps([engine, canonical], sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """In-process LRU of responses stamped with the version they were computed under"""
+
+    def __init__(self, ttl: float = RESPONSE_CACHE_TTL, stale_seconds: float = RESPONSE_CACHE_STALE_SECONDS,
+                 max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.stale_seconds = stale_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, str, Any]]" = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def get(self, key: str, version: str) -> Tuple[Optional[Any], str]:
+        """(value, FRESH | STALE) or (None, MISS); entries of another version are dropped"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, MISS
+            stored_at, stored_version, value = entry
+            age = now - stored_at
+            if stored_version != version or age >= self.ttl + self.stale_seconds:
+                del self._entries[key]
+                return None, MISS
+            self._entries.move_to_end(key)
+        return value, FRESH if age < self.ttl else STALE
+
+    def put(self, key: str, version: str, value: Any):
+        with self._lock:
+            self._entries[key] = (time.time(), version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def refresh(self, key: str, version: str, compute: Callable[[], Any],
+                cacheable: Callable[[Any], bool] = None):
+        """Recompute key in the background unless a refresh of it is already running"""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="response-cache")
+
+        def run():
+            try:
+                value = compute()
+                if cacheable is not None and not cacheable(value):
+                    logs.info("Response Cache", "Refresh of %s not cacheable, keeping the stale entry", key[:12])
+                    return
+                self.put(key, version, value)
+                logs.info("Response Cache", "Refreshed %s", key[:12])
+            except Exception as e:
+                logs.warning("Response Cache", "Background refresh failed: %s", e)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._executor.submit(run)
+
+    def fetch(self, key: str, version: Optional[str], compute: Callable[[], Any],
+              cacheable: Callable[[Any], bool] = None, revalidate: bool = True) -> Tuple[Any, str]:
+        """
+        Cached value for key (refreshing it in the background if stale) or
+        compute() now and store it. version None bypasses the cache; values
+        cacheable rejects (e.g. degraded by a time budget) are not stored.
+        revalidate=False recomputes stale entries now instead, for hosts that
+        stop running threads once the response is sent.
+        """
+        if version is None or self.ttl <= 0:
+            return compute(), BYPASS
+        value, status = self.get(key, version)
+        if status == STALE and not revalidate:
+            value, status = None, MISS
+        cache_lookup("response", status != MISS)
+        if status == STALE:
+            self.refresh(key, version, compute, cacheable)
+        if status != MISS:
+            return value, status
+        value = compute()
+        if cacheable is None or cacheable(value):
+            self.put(key, version, value)
+        return value, MISS
+
+
+_cache = ResponseCache()
+_versions: Dict[Optional[str], Tuple[float, Optional[str]]] = {}
+_versions_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    return _cache
+
+
+def cache_version(supabase, buyer_id: str = None) -> Optional[str]:
+    """
+    Version stamp for buyer_id's cached responses, or None if it cannot be
+    determined. Reused for RESPONSE_CACHE_VERSION_SECONDS.
+    """
+    if supabase is None or RESPONSE_CACHE_TTL <= 0:
+        return None
+    now = time.time()
+    with _versions_lock:
+        cached = _versions.get(buyer_id)
+    if cached is not None and now - cached[0] < RESPONSE_CACHE_VERSION_SECONDS:
+        return cached[1]
+    try:
+        count_call("supabase")
+        stamp = supabase.rpc("recommendation_cache_version", {"p_buyer_id": buyer_id}).execute().data
+        version = json.dumps(stamp, sort_keys=True, default=str)
+    except Exception as e:
+        logs.warning("Response Cache", "Version unavailable, not caching: %s", e)
+        version = None
+    with _versions_lock:
+        _versions[buyer_id] = (now, version)
+    return version
+
+
+def cache_bypassed(data: Dict[str, Any], headers) -> bool:
+    """Requests measuring the pipeline (timings, profiling) or asking for no-cache skip it"""
+    cache_control = (headers.get("Cache-Control") or "").lower() if headers is not None else ""
+    return bool(data.get("no_cache") or data.get("include_timings") or "no-cache" in cache_control
+                or (headers is not None and headers.get("X-Profile")))
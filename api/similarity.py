@@ -0,0 +1,219 @@
+"""
+Loved-property similarity engine.
+
+Listings are mapped once to fixed-scale feature vectors (numeric fields
+standardized against market-level constants, city and property type
+one-hot encoded into hashed buckets) and L2-normalized, so cosine
+similarity between every candidate and every loved property is a single
+matrix product. Loved-property vectors are cached per buyer.
+
+Saved / viewing-scheduled / passed interactions are folded into a per-buyer
+preference centroid (positive minus negative signals) that is updated
+incrementally as the buyer's interaction lists change.
+"""
+
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# (field, transform, center, scale) - fixed so vectors are comparable across requests
+NUMERIC_FEATURES: Sequence[Tuple[str, str, float, float]] = (
+    ("price", "log", 13.8, 0.6),
+    ("bedrooms", "linear", 3.0, 1.2),
+    ("bathrooms", "linear", 2.0, 1.0),
+    ("livingArea", "log", 7.4, 0.5),
+    ("lotSize", "log", 8.0, 1.5),
+    ("yearBuilt", "linear", 1970.0, 30.0),
+)
+
+# (field, number of hashed buckets, weight)
+CATEGORICAL_FEATURES: Sequence[Tuple[str, int, float]] = (
+    ("city", 32, 1.5),
+    ("propertyType", 8, 1.0),
+)
+
+FEATURE_DIM = len(NUMERIC_FEATURES) + sum(buckets for _, buckets, _ in CATEGORICAL_FEATURES)
+
+LOVED_CACHE_TTL = 600  # seconds
+LOVED_CACHE_MAX_ENTRIES = 4096  # buyers per instance (LRU)
+_loved_cache: "OrderedDict[str, Tuple[Tuple[str, ...], np.ndarray, float]]" = OrderedDict()
+_loved_lock = threading.Lock()
+
+
+def _bucket(value: str, buckets: int) -> int:
+    return zlib.crc32(value.strip().lower().encode("utf-8")) % buckets
+
+
+def build_feature_matrix(listings: List[Dict[str, Any]]) -> np.ndarray:
+    """
+    Feature vectors for normalized listings (see normalize_property_row).
+
+    Returns an (n, FEATURE_DIM) float32 matrix with L2-normalized rows.
+    Missing numeric values sit at the feature center (0).
+    """
+    X = np.zeros((len(listings), FEATURE_DIM), dtype=np.float32)
+
+    for col, (field, transform, center, scale) in enumerate(NUMERIC_FEATURES):
+        values = np.array([listing.get(field) or 0 for listing in listings], dtype=np.float64)
+        present = values > 0
+        if transform == "log":
+            transformed = np.log1p(np.maximum(values, 0))
+        else:
+            transformed = values
+        X[:, col] = np.where(present, (transformed - center) / scale, 0.0)
+
+    offset = len(NUMERIC_FEATURES)
+    for field, buckets, weight in CATEGORICAL_FEATURES:
+        for row, listing in enumerate(listings):
+            value = listing.get(field)
+            if value:
+                X[row, offset + _bucket(str(value), buckets)] = weight
+        offset += buckets
+
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    np.divide(X, norms, out=X, where=norms > 0)
+    return X
+
+
+def similarity_to_loved(candidates: np.ndarray, loved: np.ndarray, k: int = 1) -> np.ndarray:
+    """
+    Cosine similarity of each candidate to its k nearest loved properties.
+
+    Both inputs must come from build_feature_matrix. Returns an (n,) array
+    (mean of the top-k similarities); zeros when nothing is loved.
+    """
+    if loved.size == 0 or candidates.size == 0:
+        return np.zeros(candidates.shape[0], dtype=np.float32)
+
+    sims = candidates @ loved.T  # (n_candidates, n_loved)
+    k = max(1, min(k, sims.shape[1]))
+    if k == 1:
+        return sims.max(axis=1)
+    top_k = np.partition(sims, sims.shape[1] - k, axis=1)[:, -k:]
+    return top_k.mean(axis=1)
+
+
+def similarity_boost(similarity: np.ndarray, max_boost: float = 45.0, floor: float = 0.5) -> np.ndarray:
+    """Map cosine similarity to hybrid-score points: 0 at or below floor, max_boost at 1.0"""
+    return max_boost * np.clip((similarity - floor) / (1.0 - floor), 0.0, 1.0)
+
+
+def get_cached_loved_vectors(buyer_id: Optional[str], loved_ids: Sequence[str]) -> Optional[np.ndarray]:
+    """Cached loved-property matrix for buyer_id if the loved set is unchanged and fresh"""
+    if not buyer_id:
+        return None
+    with _loved_lock:
+        entry = _loved_cache.get(buyer_id)
+        if entry is None:
+            return None
+        _loved_cache.move_to_end(buyer_id)
+    ids, matrix, stored_at = entry
+    if ids != tuple(sorted(loved_ids)) or time.time() - stored_at > LOVED_CACHE_TTL:
+        return None
+    return matrix
+
+
+def cache_loved_vectors(buyer_id: Optional[str], loved_ids: Sequence[str], matrix: np.ndarray):
+    """Remember a buyer's loved-property matrix for LOVED_CACHE_TTL seconds"""
+    if not buyer_id:
+        return
+    with _loved_lock:
+        _loved_cache[buyer_id] = (tuple(sorted(loved_ids)), matrix, time.time())
+        _loved_cache.move_to_end(buyer_id)
+        while len(_loved_cache) > LOVED_CACHE_MAX_ENTRIES:
+            _loved_cache.popitem(last=False)
+
+
+# ------------------- Interaction feedback centroid -------------------
+# Signal weights: positive signals pull the centroid toward similar listings,
+# passes push it away. Loved properties are handled by the kNN boost above.
+FEEDBACK_WEIGHTS = {"viewing_scheduled": 1.0, "saved": 0.6, "passed": -0.8}
+FEEDBACK_MAX_ADJUST = 15.0  # hybrid-score points at cosine +/-1
+FEEDBACK_CACHE_TTL = 3600  # seconds
+FEEDBACK_CACHE_MAX_ENTRIES = 4096  # buyers per instance (LRU)
+
+
+class FeedbackCentroid:
+    """
+    Running weighted sum of property vectors for one buyer.
+
+    update() only touches properties whose signal weight changed since the
+    last call, so a buyer who saves or passes one more listing costs one
+    vector add, not a rebuild. Concurrent requests for the same buyer share
+    one centroid: hold lock across missing(), update() and direction().
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.weights: Dict[str, float] = {}
+        self.vectors: Dict[str, np.ndarray] = {}
+        self.total = np.zeros(FEATURE_DIM, dtype=np.float64)
+        self.updated_at = time.time()
+
+    def missing(self, weights: Dict[str, float]) -> List[str]:
+        """Property ids whose vectors must be fetched before update()"""
+        return [pid for pid, w in weights.items() if w and pid not in self.vectors]
+
+    def update(self, weights: Dict[str, float], new_vectors: Dict[str, np.ndarray]) -> int:
+        """Apply the buyer's current signal weights; returns how many properties changed"""
+        self.vectors.update(new_vectors)
+        changed = 0
+        for pid in set(self.weights) | set(weights):
+            old, new = self.weights.get(pid, 0.0), weights.get(pid, 0.0)
+            if old == new or pid not in self.vectors:
+                continue
+            self.total += (new - old) * self.vectors[pid]
+            changed += 1
+        self.weights = {pid: w for pid, w in weights.items() if w and pid in self.vectors}
+        self.vectors = {pid: self.vectors[pid] for pid in self.weights}
+        self.updated_at = time.time()
+        return changed
+
+    def direction(self) -> Optional[np.ndarray]:
+        """Unit preference direction (positive minus negative), or None if neutral"""
+        norm = np.linalg.norm(self.total)
+        if not self.weights or norm < 1e-9:
+            return None
+        return (self.total / norm).astype(np.float32)
+
+
+_feedback_cache: "OrderedDict[str, FeedbackCentroid]" = OrderedDict()
+_feedback_lock = threading.Lock()
+
+
+def feedback_weights(saved_ids: Sequence[str] = None, viewing_scheduled_ids: Sequence[str] = None,
+                     passed_ids: Sequence[str] = None) -> Dict[str, float]:
+    """Combine interaction lists into per-property signal weights"""
+    weights: Dict[str, float] = {}
+    for signal, ids in (("saved", saved_ids), ("viewing_scheduled", viewing_scheduled_ids),
+                        ("passed", passed_ids)):
+        for pid in ids or []:
+            weights[pid] = weights.get(pid, 0.0) + FEEDBACK_WEIGHTS[signal]
+    return weights
+
+
+def get_feedback_centroid(buyer_id: Optional[str]) -> FeedbackCentroid:
+    """Cached centroid for buyer_id (fresh one for anonymous or expired buyers)"""
+    if not buyer_id:
+        return FeedbackCentroid()
+    with _feedback_lock:
+        centroid = _feedback_cache.get(buyer_id)
+        if centroid is None or time.time() - centroid.updated_at > FEEDBACK_CACHE_TTL:
+            centroid = FeedbackCentroid()
+            _feedback_cache[buyer_id] = centroid
+        _feedback_cache.move_to_end(buyer_id)
+        while len(_feedback_cache) > FEEDBACK_CACHE_MAX_ENTRIES:
+            _feedback_cache.popitem(last=False)
+    return centroid
+
+
+def feedback_adjustment(candidates: np.ndarray, direction: Optional[np.ndarray],
+                        max_adjust: float = FEEDBACK_MAX_ADJUST) -> np.ndarray:
+    """Signed score adjustment for each candidate: max_adjust * cosine to the preference direction"""
+    if direction is None or candidates.size == 0:
+        return np.zeros(candidates.shape[0], dtype=np.float32)
+    return max_adjust * (candidates @ direction)
@@ -0,0 +1,153 @@
+"""
+Time budget for one recommendation request.
+
+Without a budget (the default) every stage of recommend_hybrid runs in
+full. With one (RECOMMEND_DEADLINE_SECONDS, or "deadline_seconds" in the
+request body)
+the expensive optional stages are planned against the time left when they
+start, so a slow LLM / PIM / Places call costs quality, not the response:
+
+- Places POI lookups and PIM service calls run for as many candidates as
+  fit (candidates come best first); the rest go without
+- commute times are skipped when the lookup doesn't fit
+- LLM scoring gets what is left before the finish time (ML fit, similarity,
+  response); llm_client starts no call with less than MIN_CALL_SECONDS left
+
+LLM scores carry the most weight, so the stages before it leave room for
+its expected cost and are cut first -- but never more than RESERVE_FRACTION
+of the time left, and FINISH_SECONDS is capped at FINISH_FRACTION of the
+budget, so small budgets still run every stage for some candidates.
+
+Costs are per unit -- a listing for Places and PIM, one LLM scoring pass,
+one commute lookup. STAGE_COSTS is the guess before anything has run; the
+first measurement of a stage replaces it, later ones are folded in with an
+exponential moving average. A stage whose estimate no longer fits still
+gets one unit every PROBE_SECONDS, so an estimate from a slow spell (or an
+unrealistic prior) is measured again instead of cutting the stage forever.
+
+Every cut is recorded in TimeBudget.degraded ({stage: what happened}),
+which the handlers return as "degraded"; the hybrid score is renormalized
+over the components each listing actually has.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Sequence, Set
+
+from llm_client import MIN_CALL_SECONDS, Deadline
+import logs
+
+RECOMMEND_DEADLINE_SECONDS = float(os.environ.get("RECOMMEND_DEADLINE_SECONDS", "0"))  # 0 = no budget (default)
+FINISH_SECONDS = float(os.environ.get("RECOMMEND_FINISH_SECONDS", "1.0"))  # kept for the stages after LLM
+FINISH_FRACTION = 0.2  # ... but at most this share of the budget
+RESERVE_FRACTION = 0.5  # share of the time left that reserve stages may hold back
+COST_SMOOTHING = 0.3  # weight of the newest observation
+PROBE_SECONDS = 60.0  # run one unit of a cut stage this often, to re-measure it
+
+# Seconds per unit before anything has been observed
+STAGE_COSTS = {
+    "places": 0.5,   # per listing (4 nearby searches)
+    "pim": 0.3,      # per listing without a cached score
+    "commute": 1.0,  # per lookup (geocode + one bulk estimate)
+    "llm": 6.0,      # per scoring pass over all candidates
+}
+
+# Least a stage needs to run at all: an LLM call is not started with less
+# than MIN_CALL_SECONDS left, plus slack for the stages before it overrunning
+# their estimates
+STAGE_MINIMUMS = {"llm": MIN_CALL_SECONDS + 0.25}
+
+_costs: Dict[str, float] = dict(STAGE_COSTS)
+_measured: Set[str] = set()
+_last_run: Dict[str, float] = {}  # monotonic time each stage was last measured / probed
+_costs_lock = threading.Lock()
+
+
+def expected_cost(stage: str) -> float:
+    with _costs_lock:
+        return _costs[stage]
+
+
+def observe(stage: str, seconds: float, units: int = 1):
+    """Fold a measured run of units of stage into its expected cost"""
+    if units <= 0:
+        return
+    with _costs_lock:
+        if stage in _measured:
+            _costs[stage] += COST_SMOOTHING * (seconds / units - _costs[stage])
+        else:
+            _costs[stage] = seconds / units  # first measurement replaces the prior
+            _measured.add(stage)
+        _last_run[stage] = time.monotonic()
+
+
+def _claim_probe(stage: str) -> bool:
+    """True for one caller per PROBE_SECONDS per stage"""
+    with _costs_lock:
+        now = time.monotonic()
+        if stage in _last_run and now - _last_run[stage] < PROBE_SECONDS:
+            return False
+        _last_run[stage] = now
+        return True
+
+
+@contextmanager
+def measured(stage: str, units: int = 1) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start, units)
+
+
+def request_deadline(data: Dict[str, Any]) -> Optional[float]:
+    """Budget in seconds for a request body ("deadline_seconds", else the default); None = no budget"""
+    seconds = data.get("deadline_seconds")
+    if seconds is None:
+        seconds = RECOMMEND_DEADLINE_SECONDS
+    elif isinstance(seconds, bool) or not isinstance(seconds, (int, float)):
+        raise ValueError("deadline_seconds must be a number")
+    return float(seconds) if seconds > 0 else None
+
+
+class TimeBudget:
+    """Wall-clock budget of one recommend_hybrid run and the stages it cut"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.finish_seconds = min(FINISH_SECONDS, FINISH_FRACTION * seconds)
+        self.degraded: Dict[str, str] = {}
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def affordable(self, stage: str, units: int, reserve: Sequence[str] = ()) -> int:
+        """
+        How many of units of stage fit in the time left, keeping the
+        expected cost of the reserve stages (capped at RESERVE_FRACTION of
+        the time left, but not below what they need to run at all) and
+        finish_seconds free; at least one unit when a probe is due
+        """
+        left = self.remaining() - self.finish_seconds
+        if units <= 0 or left <= 0:
+            return 0
+        held = min(sum(expected_cost(s) for s in reserve), RESERVE_FRACTION * left)
+        spare = left - max(held, sum(STAGE_MINIMUMS.get(s, 0.0) for s in reserve))
+        cost = expected_cost(stage)
+        fit = units if cost <= 0 else min(units, int(spare / cost))
+        if fit == 0 and _claim_probe(stage):
+            return 1
+        return fit
+
+    def cap(self, deadline: Deadline) -> Deadline:
+        """deadline, ending no later than finish_seconds before the budget does"""
+        capped = Deadline(0)
+        capped.expires_at = min(deadline.expires_at, self.expires_at - self.finish_seconds)
+        return capped
+
+    def degrade(self, stage: str, detail: str):
+        self.degraded[stage] = detail
+        logs.warning("Time Budget", "%s: %s (%.1f s of %.1f s left)", stage, detail, self.remaining(), self.seconds)
@@ -0,0 +1,260 @@
+"""
+Lightweight request tracing for the recommendation pipeline.
+
+A trace is started per request (start_trace) and held in a context
+variable; span() times a stage or outbound call inside it, count_call()
+counts calls to an external service and cache_lookup() records cache hits
+and misses. Outside a trace all of these are no-ops, so library code can
+be instrumented unconditionally.
+
+Finished traces can be exported:
+
+- TRACE_EXPORTER=log   one JSON line per request on stdout
+- TRACE_EXPORTER=otel  replayed as OpenTelemetry spans (needs the
+                       opentelemetry-api package and an SDK/exporter
+                       configured by the deployment, e.g. OTLP)
+
+Trace.timings() is the compact summary handlers return as "timings".
+"""
+
+import json
+import os
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import wraps
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # optional
+    otel_trace = None
+
+TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", "none").lower()  # none | log | otel
+RESPONSE_TIMINGS = os.environ.get("RESPONSE_TIMINGS", "false").lower() == "true"
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[str]] = ContextVar("current_span", default=None)
+
+
+@dataclass
+class Span:
+    name: str
+    span_id: str
+    parent_id: Optional[str]
+    start: float  # perf_counter seconds
+    end: float = 0.0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end - self.start) * 1000.0
+
+
+class Trace:
+    """Spans, external-call counts and cache statistics of one request"""
+
+    def __init__(self, name: str, attributes: Dict[str, Any] = None):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.attributes = dict(attributes or {})
+        self.start = time.perf_counter()
+        self.start_epoch_ns = time.time_ns()
+        self.end: Optional[float] = None
+        self.spans: List[Span] = []
+        self.calls: Counter = Counter()
+        self.cache_hits: Counter = Counter()
+        self.cache_misses: Counter = Counter()
+        self._lock = Lock()
+
+    def add_span(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def count_call(self, service: str, n: int = 1):
+        with self._lock:
+            self.calls[service] += n
+
+    def cache_lookup(self, cache: str, hit: bool, n: int = 1):
+        with self._lock:
+            (self.cache_hits if hit else self.cache_misses)[cache] += n
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end or time.perf_counter()) - self.start) * 1000.0
+
+    def timings(self) -> Dict[str, Any]:
+        """Per-stage totals, external-call counts and cache hit ratios"""
+        stages: Dict[str, Dict[str, Any]] = {}
+        for span in self.spans:
+            stage = stages.setdefault(span.name, {"ms": 0.0, "count": 0})
+            stage["ms"] += span.duration_ms
+            stage["count"] += 1
+        for stage in stages.values():
+            stage["ms"] = round(stage["ms"], 1)
+
+        caches = {}
+        for cache in sorted(set(self.cache_hits) | set(self.cache_misses)):
+            hits, misses = self.cache_hits[cache], self.cache_misses[cache]
+            caches[cache] = {"hits": hits, "misses": misses, "hit_ratio": round(hits / (hits + misses), 3)}
+
+        return {
+            "trace_id": self.trace_id,
+            "total_ms": round(self.duration_ms, 1),
+            "stages": stages,
+            "external_calls": dict(self.calls),
+            "cache": caches,
+        }
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _ActiveSpan:
+    __slots__ = ("trace", "span", "token")
+
+    def __init__(self, trace: Trace, name: str, attributes: Dict[str, Any]):
+        self.trace = trace
+        self.span = Span(name, uuid.uuid4().hex[:16], _current_span.get(), 0.0, attributes=attributes)
+        self.token = None
+
+    def __enter__(self) -> Span:
+        self.token = _current_span.set(self.span.span_id)
+        self.span.start = time.perf_counter()
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.end = time.perf_counter()
+        if exc is not None:
+            self.span.error = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(self.token)
+        self.trace.add_span(self.span)
+        return False
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def span(name: str, **attributes):
+    """Context manager timing a stage of the current trace (no-op without one)"""
+    trace = _current_trace.get()
+    if trace is None:
+        return _NOOP_SPAN
+    return _ActiveSpan(trace, name, attributes)
+
+
+def traced(name: str, service: str = None) -> Callable:
+    """Decorator: run the function inside span(name), counting one call to service"""
+    def decorate(fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            trace = _current_trace.get()
+            if trace is None:
+                return fn(*args, **kwargs)
+            if service:
+                trace.count_call(service)
+            with _ActiveSpan(trace, name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count_call(service: str, n: int = 1):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.count_call(service, n)
+
+
+def cache_lookup(cache: str, hit: bool, n: int = 1):
+    trace = _current_trace.get()
+    if trace is not None and n:
+        trace.cache_lookup(cache, hit, n)
+
+
+def tracing_wanted(requested: bool = False) -> bool:
+    """Whether a request should be traced at all (timings asked for, or an exporter is on)"""
+    return bool(requested) or RESPONSE_TIMINGS or TRACE_EXPORTER != "none"
+
+
+class start_trace:
+    """
+    Context manager for one request's trace; yields the Trace, or None when
+    tracing is off (enabled=False), so instrumented code stays no-op.
+    """
+
+    def __init__(self, name: str, enabled: bool = True, **attributes):
+        self.trace = Trace(name, attributes) if enabled else None
+        self.token = None
+
+    def __enter__(self) -> Optional[Trace]:
+        if self.trace is not None:
+            self.token = _current_trace.set(self.trace)
+        return self.trace
+
+    def __exit__(self, *exc):
+        if self.trace is not None:
+            self.trace.end = time.perf_counter()
+            _current_trace.reset(self.token)
+            export(self.trace)
+        return False
+
+
+# ------------------- Export -------------------
+def export(trace: Trace):
+    try:
+        if TRACE_EXPORTER == "log":
+            print(f"[Trace] {json.dumps({'name': trace.name, **trace.attributes, **trace.timings()})}")
+        elif TRACE_EXPORTER == "otel":
+            export_otel(trace)
+    except Exception as e:
+        print(f"[Trace] Export failed: {e}")
+
+
+def export_otel(trace: Trace):
+    """Replay a finished trace as OpenTelemetry spans with their original timestamps"""
+    if otel_trace is None:
+        print("[Trace] TRACE_EXPORTER=otel but opentelemetry is not installed")
+        return
+    tracer = otel_trace.get_tracer("recommend")
+
+    def epoch_ns(perf: float) -> int:
+        return trace.start_epoch_ns + int((perf - trace.start) * 1e9)
+
+    root = tracer.start_span(trace.name, start_time=trace.start_epoch_ns,
+                             attributes={"trace.local_id": trace.trace_id, **_otel_attributes(trace.attributes),
+                                         **{f"calls.{k}": v for k, v in trace.calls.items()}})
+    otel_spans = {None: root}
+    for s in sorted(trace.spans, key=lambda s: s.start):
+        parent = otel_spans.get(s.parent_id, root)
+        otel_span = tracer.start_span(s.name, context=otel_trace.set_span_in_context(parent),
+                                      start_time=epoch_ns(s.start), attributes=_otel_attributes(s.attributes))
+        if s.error:
+            otel_span.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR, s.error))
+        otel_spans[s.span_id] = otel_span
+    for s in trace.spans:
+        otel_spans[s.span_id].end(end_time=epoch_ns(s.end))
+    root.end(end_time=epoch_ns(trace.end or time.perf_counter()))
+
+
+def _otel_attributes(attributes: Dict[str, Any]) -> Dict[str, Any]:
+    # OTel attribute values must be primitives (or lists of them)
+    return {k: v if isinstance(v, (str, bool, int, float)) else str(v)
+            for k, v in attributes.items() if v is not None}
@@ -0,0 +1,224 @@
+"""
+Write-behind persistence for recommendation rows.
+
+Rows are journaled to a local SQLite file and flushed to the database in
+batches by a background worker, so the request path never waits on DB
+writes. The journal is keyed on (buyer_id, property_id): re-enqueuing the
+same pair replaces the pending row (idempotent, last write wins). Rows are
+only removed from the journal after the flush function reports them saved;
+failures are retried with exponential backoff and, after max_attempts,
+parked as "dead" rows instead of being dropped.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+import logs
+
+FlushFn = Callable[[List[Dict[str, Any]]], Dict[str, Any]]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS journal (
+    buyer_id TEXT NOT NULL,
+    property_id TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    dead INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (buyer_id, property_id)
+)
+"""
+
+
+class WriteBehindQueue:
+    """
+    Durable local queue of buyer_properties rows with a background flusher.
+
+    Args:
+        path: SQLite journal file (created if missing)
+        flush_fn: Writes a batch of rows and returns
+            {"saved": int, "failed": [{"buyer_id", "property_id", "error"}, ...]}
+        batch_size: Max rows handed to flush_fn per call
+        flush_interval: Seconds the worker sleeps when the journal is idle
+        max_attempts: Failures before a row is parked as dead
+        base_backoff: First retry delay in seconds (doubles per attempt, capped at 5 min)
+    """
+
+    def __init__(self, path: str, flush_fn: FlushFn, batch_size: int = 500,
+                 flush_interval: float = 0.5, max_attempts: int = 8,
+                 base_backoff: float = 1.0):
+        self.path = path
+        self.flush_fn = flush_fn
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """Open a connection for one transaction (commit on success, always close)"""
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    # ------------------- Producer side -------------------
+    def enqueue(self, rows: List[Dict[str, Any]]) -> int:
+        """Journal rows for writing; returns the number of rows accepted"""
+        if not rows:
+            return 0
+
+        now_ns = time.time_ns()
+        records = [
+            (row["buyer_id"], row["property_id"], json.dumps(row), now_ns + i)
+            for i, row in enumerate(rows)
+        ]
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO journal "
+                "(buyer_id, property_id, payload, seq, attempts, next_attempt_at, last_error, dead) "
+                "VALUES (?, ?, ?, ?, 0, 0, NULL, 0)",
+                records
+            )
+        self._wake.set()
+        return len(records)
+
+    def pending(self) -> int:
+        """Number of rows waiting to be flushed (excluding dead rows)"""
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM journal WHERE dead = 0").fetchone()[0]
+
+    def dead(self) -> List[Dict[str, Any]]:
+        """Rows that exhausted their retries, with the last error"""
+        with self._connect() as conn:
+            cursor = conn.execute("SELECT payload, attempts, last_error FROM journal WHERE dead = 1")
+            return [
+                {"row": json.loads(payload), "attempts": attempts, "error": error}
+                for payload, attempts, error in cursor.fetchall()
+            ]
+
+    # ------------------- Consumer side -------------------
+    def flush_once(self) -> Dict[str, int]:
+        """
+        Flush one batch of due rows.
+
+        Returns {"attempted", "saved", "failed"} counts for the batch.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            batch = conn.execute(
+                "SELECT buyer_id, property_id, payload, seq, attempts FROM journal "
+                "WHERE dead = 0 AND next_attempt_at <= ? ORDER BY seq LIMIT ?",
+                (now, self.batch_size)
+            ).fetchall()
+
+        if not batch:
+            return {"attempted": 0, "saved": 0, "failed": 0}
+
+        rows = [json.loads(payload) for _, _, payload, _, _ in batch]
+        try:
+            report = self.flush_fn(rows) or {}
+            failed = {
+                (f.get("buyer_id"), f.get("property_id")): f.get("error", "unknown error")
+                for f in report.get("failed", [])
+            }
+        except Exception as e:
+            logs.warning("WriteBehind", f"Flush of {len(rows)} rows failed: {e}")
+            failed = {(b, p): str(e) for b, p, _, _, _ in batch}
+
+        done, retry = [], []
+        for buyer_id, property_id, _, seq, attempts in batch:
+            error = failed.get((buyer_id, property_id))
+            if error is None:
+                done.append((buyer_id, property_id, seq))
+            else:
+                attempts += 1
+                delay = min(300.0, self.base_backoff * (2 ** (attempts - 1)))
+                dead = 1 if attempts >= self.max_attempts else 0
+                retry.append((attempts, now + delay, error, dead, buyer_id, property_id, seq))
+
+        # seq guards against removing a newer version enqueued during the flush
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "DELETE FROM journal WHERE buyer_id = ? AND property_id = ? AND seq = ?",
+                done
+            )
+            conn.executemany(
+                "UPDATE journal SET attempts = ?, next_attempt_at = ?, last_error = ?, dead = ? "
+                "WHERE buyer_id = ? AND property_id = ? AND seq = ?",
+                retry
+            )
+
+        if retry:
+            logs.warning("WriteBehind", f"{len(retry)}/{len(batch)} rows failed, scheduled for retry")
+        return {"attempted": len(batch), "saved": len(done), "failed": len(retry)}
+
+    def drain(self, timeout: Optional[float] = None) -> int:
+        """Flush due batches until the journal has nothing due; returns rows saved"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        saved = 0
+        while deadline is None or time.monotonic() < deadline:
+            result = self.flush_once()
+            saved += result["saved"]
+            if result["attempted"] == 0 or result["saved"] == 0:
+                break
+        return saved
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                result = self.flush_once()
+            except Exception as e:
+                logs.warning("WriteBehind", f"Worker error: {e}")
+                result = {"attempted": 0}
+            if result["attempted"] == 0:
+                self._wake.wait(self.flush_interval)
+                self._wake.clear()
+
+    def start(self) -> "WriteBehindQueue":
+        """Start the background flusher (idempotent); resumes any journaled rows"""
+        if self._worker is None or not self._worker.is_alive():
+            self._stop.clear()
+            self._worker = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._worker.start()
+        return self
+
+    def stop(self, drain: bool = True, timeout: float = 5.0):
+        """
+        Stop the background flusher, then optionally drain due rows.
+
+        The drain only runs once the worker has exited: if it is still
+        mid-flush after timeout, the remaining rows stay journaled for the
+        next start rather than being flushed twice concurrently.
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._worker is not None:
+            self._worker.join(timeout)
+            if self._worker.is_alive():
+                logs.warning("WriteBehind", f"Worker still flushing after {timeout}s, leaving rows journaled")
+                return
+            self._worker = None
+        if drain:
+            self.drain(timeout=timeout)
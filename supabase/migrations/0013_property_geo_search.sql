@@ -0,0 +1,72 @@
+-- =============================================================================
+-- GEOSPATIAL CANDIDATE RETRIEVAL FOR RECOMMENDATIONS
+-- =============================================================================
+--
+-- Adds a PostGIS point derived from properties.coordinates ({"lat", "lng"}),
+-- a GiST index on it, and an RPC used by the recommendation API to fetch
+-- candidates within a radius and/or inside a polygon, ordered by distance.
+-- =============================================================================
+
+CREATE EXTENSION IF NOT EXISTS postgis;
+
+ALTER TABLE properties
+  ADD COLUMN IF NOT EXISTS geog geography(Point, 4326)
+  GENERATED ALWAYS AS (
+    CASE
+      WHEN coordinates ? 'lat' AND coordinates ? 'lng'
+      THEN ST_SetSRID(
+        ST_MakePoint((coordinates->>'lng')::float8, (coordinates->>'lat')::float8),
+        4326
+      )::geography
+    END
+  ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_properties_geog ON properties USING GIST (geog);
+
+-- Candidate ids within radius_miles of (center_lat, center_lng) and/or inside
+-- polygon (GeoJSON Polygon geometry), nearest first. When only a polygon is
+-- given, distance is measured from its centroid.
+CREATE OR REPLACE FUNCTION search_properties_geo(
+  center_lat float8 DEFAULT NULL,
+  center_lng float8 DEFAULT NULL,
+  radius_miles float8 DEFAULT NULL,
+  polygon jsonb DEFAULT NULL,
+  min_price numeric DEFAULT NULL,
+  max_price numeric DEFAULT NULL,
+  min_beds int DEFAULT NULL,
+  min_baths numeric DEFAULT NULL,
+  property_types text[] DEFAULT NULL,
+  exclude_ids uuid[] DEFAULT NULL,
+  max_results int DEFAULT 100
+)
+RETURNS TABLE (property_id uuid, distance_miles float8)
+LANGUAGE sql STABLE AS $$
+  WITH area AS (
+    SELECT
+      CASE WHEN polygon IS NOT NULL
+        THEN ST_SetSRID(ST_GeomFromGeoJSON(polygon::text), 4326)::geography
+      END AS poly,
+      CASE
+        WHEN center_lat IS NOT NULL AND center_lng IS NOT NULL
+          THEN ST_SetSRID(ST_MakePoint(center_lng, center_lat), 4326)::geography
+        WHEN polygon IS NOT NULL
+          THEN ST_Centroid(ST_SetSRID(ST_GeomFromGeoJSON(polygon::text), 4326))::geography
+      END AS center
+  )
+  SELECT p.id, ST_Distance(p.geog, area.center) / 1609.344
+  FROM properties p, area
+  WHERE p.geog IS NOT NULL
+    AND (radius_miles IS NULL OR area.center IS NULL
+         OR ST_DWithin(p.geog, area.center, radius_miles * 1609.344))
+    AND (area.poly IS NULL OR ST_Covers(area.poly, p.geog))
+    AND (min_price IS NULL OR p.listing_price >= min_price)
+    AND (max_price IS NULL OR p.listing_price <= max_price)
+    AND (min_beds IS NULL OR p.bedrooms >= min_beds)
+    AND (min_baths IS NULL OR p.bathrooms >= min_baths)
+    AND (property_types IS NULL OR p.property_type = ANY(property_types))
+    AND (exclude_ids IS NULL OR NOT (p.id = ANY(exclude_ids)))
+  ORDER BY p.geog <-> area.center
+  LIMIT max_results;
+$$;
+
+GRANT EXECUTE ON FUNCTION search_properties_geo TO authenticated, service_role;
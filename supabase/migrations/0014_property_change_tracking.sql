@@ -0,0 +1,49 @@
+-- =============================================================================
+-- PROPERTY CHANGE TRACKING FOR SNAPSHOT DELTA SYNC
+-- =============================================================================
+--
+-- The recommendation API keeps a local feature snapshot of the catalog and
+-- pulls only what changed since its last sync:
+--   - updated / inserted rows: properties.updated_at > watermark (indexed)
+--   - deleted rows: tombstones in property_deletions, written by trigger
+-- =============================================================================
+
+CREATE INDEX IF NOT EXISTS idx_properties_updated_at ON properties(updated_at);
+
+CREATE TABLE IF NOT EXISTS property_deletions (
+  property_id uuid PRIMARY KEY,
+  deleted_at timestamp with time zone NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_property_deletions_deleted_at ON property_deletions(deleted_at);
+
+CREATE OR REPLACE FUNCTION record_property_deletion()
+RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+  INSERT INTO property_deletions (property_id, deleted_at)
+  VALUES (OLD.id, now())
+  ON CONFLICT (property_id) DO UPDATE SET deleted_at = EXCLUDED.deleted_at;
+  RETURN OLD;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS record_property_deletion ON properties;
+CREATE TRIGGER record_property_deletion AFTER DELETE ON properties
+  FOR EACH ROW EXECUTE FUNCTION record_property_deletion();
+
+-- A re-inserted id is live again
+CREATE OR REPLACE FUNCTION clear_property_deletion()
+RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+  DELETE FROM property_deletions WHERE property_id = NEW.id;
+  RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS clear_property_deletion ON properties;
+CREATE TRIGGER clear_property_deletion AFTER INSERT ON properties
+  FOR EACH ROW EXECUTE FUNCTION clear_property_deletion();
+
+GRANT SELECT ON property_deletions TO authenticated, service_role;
@@ -0,0 +1,80 @@
+-- =============================================================================
+-- PRECOMPUTED SCHOOL AGGREGATES FOR RECOMMENDATIONS
+-- =============================================================================
+--
+-- The recommendation API used to download every listing's `schools` JSON and
+-- aggregate it per request. These columns are maintained at write time by a
+-- trigger, so the API selects a few numbers instead of the whole blob.
+--
+-- `schools` appears in two shapes:
+--   - array of {"name", "rating", "distance", "level" | "type" | "grades"}
+--   - object keyed by level: {"elementary": "Name" | {"rating", ...}, ...}
+-- Ratings / distances of 0 or missing are ignored (same as the old Python code).
+-- =============================================================================
+
+ALTER TABLE properties
+  ADD COLUMN IF NOT EXISTS school_avg_rating numeric,
+  ADD COLUMN IF NOT EXISTS school_closest_miles numeric,
+  ADD COLUMN IF NOT EXISTS school_count int,
+  ADD COLUMN IF NOT EXISTS school_best_elementary numeric,
+  ADD COLUMN IF NOT EXISTS school_best_middle numeric,
+  ADD COLUMN IF NOT EXISTS school_best_high numeric;
+
+CREATE OR REPLACE FUNCTION jsonb_numeric(value jsonb)
+RETURNS numeric
+LANGUAGE sql IMMUTABLE AS $$
+  SELECT CASE
+    WHEN jsonb_typeof(value) = 'number' THEN value::text::numeric
+    WHEN jsonb_typeof(value) = 'string' AND value #>> '{}' ~ '^\s*-?[0-9]+(\.[0-9]+)?\s*$'
+      THEN (value #>> '{}')::numeric
+  END;
+$$;
+
+-- One row per school: (level text, rating, distance)
+CREATE OR REPLACE FUNCTION school_entries(schools jsonb)
+RETURNS TABLE (level text, rating numeric, distance numeric)
+LANGUAGE sql IMMUTABLE AS $$
+  SELECT
+    lower(concat_ws(' ', e->>'level', e->>'type', e->>'grades')),
+    jsonb_numeric(e->'rating'),
+    jsonb_numeric(e->'distance')
+  FROM jsonb_array_elements(CASE WHEN jsonb_typeof(schools) = 'array' THEN schools ELSE '[]'::jsonb END) AS e
+  WHERE jsonb_typeof(e) = 'object'
+  UNION ALL
+  SELECT
+    lower(k),
+    CASE WHEN jsonb_typeof(v) = 'object' THEN jsonb_numeric(v->'rating') END,
+    CASE WHEN jsonb_typeof(v) = 'object' THEN jsonb_numeric(v->'distance') END
+  FROM jsonb_each(CASE WHEN jsonb_typeof(schools) = 'object' THEN schools ELSE '{}'::jsonb END) AS t(k, v);
+$$;
+
+CREATE OR REPLACE FUNCTION set_school_aggregates()
+RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+  SELECT
+    avg(rating) FILTER (WHERE rating > 0),
+    min(distance) FILTER (WHERE distance > 0),
+    count(*),
+    max(rating) FILTER (WHERE rating > 0 AND (level LIKE '%elementary%' OR level LIKE '%primary%')),
+    max(rating) FILTER (WHERE rating > 0 AND (level LIKE '%middle%' OR level LIKE '%junior%')),
+    max(rating) FILTER (WHERE rating > 0 AND level LIKE '%high%' AND level NOT LIKE '%junior%')
+  INTO
+    NEW.school_avg_rating,
+    NEW.school_closest_miles,
+    NEW.school_count,
+    NEW.school_best_elementary,
+    NEW.school_best_middle,
+    NEW.school_best_high
+  FROM school_entries(NEW.schools);
+  RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS set_school_aggregates ON properties;
+CREATE TRIGGER set_school_aggregates BEFORE INSERT OR UPDATE OF schools ON properties
+  FOR EACH ROW EXECUTE FUNCTION set_school_aggregates();
+
+-- Backfill existing rows. This also bumps updated_at, so the next snapshot
+-- delta sync (migration 0014) picks the new aggregates up.
+UPDATE properties SET schools = schools;
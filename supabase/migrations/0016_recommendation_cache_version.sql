@@ -0,0 +1,32 @@
+-- =============================================================================
+-- VERSION STAMP FOR THE RECOMMENDATION RESPONSE CACHE
+-- =============================================================================
+--
+-- The recommendation API caches whole responses and stores this stamp with
+-- each entry; an entry whose stamp no longer matches is recomputed.
+--   - catalog: latest properties.updated_at / property_deletions.deleted_at
+--     (both indexed by 0014), so any listing insert, update or delete
+--   - interactions: the buyer's buyer_properties rows they acted on
+--     (interest level set or deactivated). Rows written by recommendation
+--     saves do not count, so a reload is served the list it already got.
+-- =============================================================================
+
+CREATE OR REPLACE FUNCTION recommendation_cache_version(p_buyer_id uuid DEFAULT NULL)
+RETURNS jsonb
+LANGUAGE sql STABLE AS $$
+  SELECT jsonb_build_object(
+    'catalog', greatest(
+      (SELECT max(updated_at) FROM properties),
+      (SELECT max(deleted_at) FROM property_deletions)
+    ),
+    'interactions', (
+      SELECT jsonb_build_object('rows', count(*), 'updated_at', max(updated_at))
+      FROM buyer_properties
+      WHERE p_buyer_id IS NOT NULL
+        AND buyer_id = p_buyer_id
+        AND (interest_level IS NOT NULL OR is_active = false)
+    )
+  );
+$$;
+
+GRANT EXECUTE ON FUNCTION recommendation_cache_version TO authenticated, service_role;
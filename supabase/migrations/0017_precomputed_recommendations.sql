@@ -0,0 +1,42 @@
+-- =============================================================================
+-- PRECOMPUTED RECOMMENDATIONS PER ACTIVE BUYER
+-- =============================================================================
+--
+-- `python api/precompute.py` (nightly) runs the recommendation pipeline for
+-- every active buyer and stores the top-N here. The API serves a stored list
+-- when the request matches the inputs it was computed from
+-- (inputs_fingerprint), instead of calling the LLM.
+--
+-- Later runs only rescore listings changed since catalog_version and merge
+-- them in; a buyer whose profile or interactions changed (new fingerprint)
+-- gets a full run.
+-- =============================================================================
+
+CREATE TABLE IF NOT EXISTS precomputed_recommendations (
+  buyer_id uuid NOT NULL,
+  engine text NOT NULL,                          -- 'full_ml' | 'lightweight'
+  buyer_profile_id uuid,
+  inputs_fingerprint text NOT NULL,
+  recommendations jsonb NOT NULL DEFAULT '[]',   -- result dicts, best first
+  catalog_version timestamp with time zone,      -- latest properties.updated_at covered
+  full_run_at timestamp with time zone NOT NULL DEFAULT now(),
+  computed_at timestamp with time zone NOT NULL DEFAULT now(),
+  PRIMARY KEY (buyer_id, engine)
+);
+
+-- Buyers worth precomputing: profile edited or any property activity since p_since
+CREATE OR REPLACE FUNCTION active_buyer_profiles(p_since timestamp with time zone)
+RETURNS TABLE (buyer_id uuid, buyer_profile_id uuid)
+LANGUAGE sql STABLE AS $$
+  SELECT DISTINCT ON (bp.person_id) bp.person_id, bp.id
+  FROM buyer_profiles bp
+  WHERE bp.updated_at >= p_since
+     OR EXISTS (
+       SELECT 1 FROM buyer_properties r
+       WHERE r.buyer_id = bp.person_id AND r.last_activity_at >= p_since
+     )
+  ORDER BY bp.person_id, bp.updated_at DESC;
+$$;
+
+GRANT SELECT, INSERT, UPDATE, DELETE ON precomputed_recommendations TO service_role;
+GRANT EXECUTE ON FUNCTION active_buyer_profiles TO service_role;
@@ -0,0 +1,65 @@
+-- =============================================================================
+-- GEO SEARCH: CHANGED-SINCE AND CANDIDATE-ID FILTERS
+-- =============================================================================
+--
+-- search_properties_geo (0013) applied its LIMIT before the recommendation
+-- API could restrict the hits to listings changed since the last precompute
+-- run or to semantic search hits, so those requests got fewer candidates
+-- than asked for. Both filters now run inside the RPC, before the LIMIT.
+--
+-- The signature changes, so the 0013 function is dropped rather than
+-- overloaded (PostgREST cannot choose between overloads by named arguments).
+-- =============================================================================
+
+DROP FUNCTION IF EXISTS search_properties_geo(
+  float8, float8, float8, jsonb, numeric, numeric, int, numeric, text[], uuid[], int
+);
+
+CREATE OR REPLACE FUNCTION search_properties_geo(
+  center_lat float8 DEFAULT NULL,
+  center_lng float8 DEFAULT NULL,
+  radius_miles float8 DEFAULT NULL,
+  polygon jsonb DEFAULT NULL,
+  min_price numeric DEFAULT NULL,
+  max_price numeric DEFAULT NULL,
+  min_beds int DEFAULT NULL,
+  min_baths numeric DEFAULT NULL,
+  property_types text[] DEFAULT NULL,
+  exclude_ids uuid[] DEFAULT NULL,
+  max_results int DEFAULT 100,
+  updated_since timestamp with time zone DEFAULT NULL,
+  candidate_ids uuid[] DEFAULT NULL
+)
+RETURNS TABLE (property_id uuid, distance_miles float8)
+LANGUAGE sql STABLE AS $$
+  WITH area AS (
+    SELECT
+      CASE WHEN polygon IS NOT NULL
+        THEN ST_SetSRID(ST_GeomFromGeoJSON(polygon::text), 4326)::geography
+      END AS poly,
+      CASE
+        WHEN center_lat IS NOT NULL AND center_lng IS NOT NULL
+          THEN ST_SetSRID(ST_MakePoint(center_lng, center_lat), 4326)::geography
+        WHEN polygon IS NOT NULL
+          THEN ST_Centroid(ST_SetSRID(ST_GeomFromGeoJSON(polygon::text), 4326))::geography
+      END AS center
+  )
+  SELECT p.id, ST_Distance(p.geog, area.center) / 1609.344
+  FROM properties p, area
+  WHERE p.geog IS NOT NULL
+    AND (radius_miles IS NULL OR area.center IS NULL
+         OR ST_DWithin(p.geog, area.center, radius_miles * 1609.344))
+    AND (area.poly IS NULL OR ST_Covers(area.poly, p.geog))
+    AND (min_price IS NULL OR p.listing_price >= min_price)
+    AND (max_price IS NULL OR p.listing_price <= max_price)
+    AND (min_beds IS NULL OR p.bedrooms >= min_beds)
+    AND (min_baths IS NULL OR p.bathrooms >= min_baths)
+    AND (property_types IS NULL OR p.property_type = ANY(property_types))
+    AND (exclude_ids IS NULL OR NOT (p.id = ANY(exclude_ids)))
+    AND (updated_since IS NULL OR p.updated_at > updated_since)
+    AND (candidate_ids IS NULL OR p.id = ANY(candidate_ids))
+  ORDER BY p.geog <-> area.center
+  LIMIT max_results;
+$$;
+
+GRANT EXECUTE ON FUNCTION search_properties_geo TO authenticated, service_role;